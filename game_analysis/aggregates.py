@@ -0,0 +1,147 @@
+import logging
+import numpy as np
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.db import connection, transaction
+
+from .models import Game, TurnState, WinProbabilityCell
+
+# Number of turns in each turn bucket of the win probability cube
+TURN_BUCKET_SIZE = 5
+
+# Width of the income and army difference bins of the win probability cube.
+# Differences beyond the largest bin are counted in it
+INCOME_DIFF_BIN_WIDTH = 2
+ARMY_DIFF_BIN_WIDTH = 10
+MAX_DIFF_BIN = 20
+
+# Number of games whose Turn States are aggregated at a time when rebuilding
+REBUILD_BATCH_SIZE = 1000
+
+# Add Turn States and wins to cells of the win probability cube, creating any
+# cells that do not exist
+INCREMENT_WIN_PROBABILITY_CELL_SQL = f'''
+    insert into {WinProbabilityCell._meta.db_table}
+        (template_id, turn_bucket, income_diff_bin, army_diff_bin,
+            turn_states, wins)
+    values (%s, %s, %s, %s, %s, %s)
+    on conflict (template_id, turn_bucket, income_diff_bin, army_diff_bin)
+    do update set
+        turn_states = turn_states + excluded.turn_states,
+        wins = wins + excluded.wins
+'''
+
+# Key of a cell of the win probability cube
+CellKey = Tuple[int, int, int, int]
+
+
+# Get the turn bucket of turn numbers
+def get_turn_bucket(turn_numbers: Any) -> Any:
+    return turn_numbers // TURN_BUCKET_SIZE
+
+
+# Get the bin of differences, limited to the largest bins
+def get_diff_bin(differences: Any, bin_width: int) -> Any:
+    return np.clip(differences // bin_width, -MAX_DIFF_BIN, MAX_DIFF_BIN)
+
+
+# Get the key of the cell of the win probability cube a game state is in
+def get_cell_key(template_id: int, turn_number: int, income_diff: int,
+        army_diff: int) -> CellKey:
+    return (
+        template_id,
+        get_turn_bucket(turn_number),
+        int(get_diff_bin(income_diff, INCOME_DIFF_BIN_WIDTH)),
+        int(get_diff_bin(army_diff, ARMY_DIFF_BIN_WIDTH))
+    )
+
+
+# Add the Turn States of the given Games to the win probability cube. Each
+# Turn State is counted from the point of view of both players
+def increment_win_probability_cells(game_ids: List[int]) -> None:
+    rows = np.array(
+        list(
+            TurnState.objects
+                .filter(game_id__in=game_ids)
+                .values_list('game__template_id', 'turn_number', 'p1_winner',
+                    'p1_income', 'p2_income', 'p1_armies_on_board',
+                    'p2_armies_on_board')
+        ),
+        dtype=np.int64
+    ).reshape(-1, 7)
+
+    if not len(rows):
+        return
+
+    template_ids, turn_numbers, p1_wins = rows[:, 0], rows[:, 1], rows[:, 2]
+    income_diffs = rows[:, 3] - rows[:, 4]
+    army_diffs = rows[:, 5] - rows[:, 6]
+
+    # Player 2's point of view has the opposite differences and result
+    cell_keys = np.column_stack([
+        np.concatenate([template_ids, template_ids]),
+        np.concatenate([get_turn_bucket(turn_numbers)] * 2),
+        get_diff_bin(np.concatenate([income_diffs, -income_diffs]),
+            INCOME_DIFF_BIN_WIDTH),
+        get_diff_bin(np.concatenate([army_diffs, -army_diffs]),
+            ARMY_DIFF_BIN_WIDTH),
+    ])
+    wins = np.concatenate([p1_wins, 1 - p1_wins])
+
+    unique_cell_keys, cell_indices = np.unique(cell_keys, axis=0,
+        return_inverse=True)
+    cell_indices = cell_indices.reshape(-1)
+    turn_state_counts = np.bincount(cell_indices)
+    win_counts = np.bincount(cell_indices, weights=wins).astype(np.int64)
+
+    with transaction.atomic(), connection.cursor() as c:
+        c.executemany(INCREMENT_WIN_PROBABILITY_CELL_SQL, [
+            (*cell_key, turn_state_count, win_count)
+            for cell_key, turn_state_count, win_count
+            in zip(unique_cell_keys.tolist(), turn_state_counts.tolist(),
+                win_counts.tolist())
+        ])
+
+
+# Rebuild the win probability cube from the Turn States of all Games
+def rebuild_win_probability_cells() -> None:
+    game_ids = list(
+        Game.objects
+            .filter(turnstate__isnull=False)
+            .distinct()
+            .order_by('id')
+            .values_list('id', flat=True)
+    )
+    logging.info(f'Rebuilding win probability cube from {len(game_ids)} games')
+
+    with transaction.atomic():
+        WinProbabilityCell.objects.all().delete()
+        for i in range(0, len(game_ids), REBUILD_BATCH_SIZE):
+            increment_win_probability_cells(
+                game_ids[i:i + REBUILD_BATCH_SIZE])
+
+
+# Get the win probability of a player in a game state from the cube
+def get_win_probability(template_id: int, turn_number: int, income_diff: int,
+        army_diff: int) -> Dict[str, Any]:
+    template_id, turn_bucket, income_diff_bin, army_diff_bin = get_cell_key(
+        template_id, turn_number, income_diff, army_diff)
+    cell: Optional[WinProbabilityCell] = (
+        WinProbabilityCell.objects
+            .filter(template_id=template_id, turn_bucket=turn_bucket,
+                income_diff_bin=income_diff_bin, army_diff_bin=army_diff_bin)
+            .first()
+    )
+    turn_states = cell.turn_states if cell else 0
+    wins = cell.wins if cell else 0
+
+    return {
+        'template_id': template_id,
+        'turn_bucket': turn_bucket,
+        'income_diff_bin': income_diff_bin,
+        'army_diff_bin': army_diff_bin,
+        'turn_states': turn_states,
+        'wins': wins,
+        'win_probability': wins / turn_states if turn_states else None,
+    }
@@ -0,0 +1,150 @@
+import logging
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from .win_probability import TurnStateSource
+
+# Player State values whose difference between player 1 and player 2 can be
+# binned
+DIFFERENCE_METRICS = [
+    'income',
+    'armies_on_board',
+    'armies_deployed',
+    'cumulative_armies_deployed',
+    'territories_controlled',
+]
+
+# Number of Turn States read at a time
+BATCH_SIZE = 65536
+
+# Per game by bin win and Turn State counts shared by the worker processes
+_game_bin_wins: Optional[np.ndarray] = None
+_game_bin_counts: Optional[np.ndarray] = None
+
+
+# Count the wins and Turn States of each game in each bin of the difference
+# between player 1 and player 2 of a metric. Returns the counts and the start
+# of each bin. Differences beyond the first and last bin are counted in them
+def get_game_bin_counts(source: TurnStateSource, metric: str,
+        bin_width: int, min_difference: int,
+        max_difference: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if metric not in DIFFERENCE_METRICS:
+        raise ValueError(f'Unknown metric {metric}.')
+
+    bin_starts = np.arange(min_difference, max_difference + 1, bin_width)
+    game_id_batches: List[np.ndarray] = []
+    bin_batches: List[np.ndarray] = []
+    win_batches: List[np.ndarray] = []
+
+    for turn_states in source.get_batches(BATCH_SIZE):
+        differences = (
+            turn_states[f'p1_{metric}'].astype(np.int32)
+            - turn_states[f'p2_{metric}'])
+        bins = (differences - min_difference) // bin_width
+        game_id_batches.append(turn_states['game_id'])
+        bin_batches.append(np.clip(bins, 0, len(bin_starts) - 1))
+        win_batches.append(turn_states['p1_winner'])
+
+    game_ids = np.concatenate(game_id_batches)
+    bins = np.concatenate(bin_batches)
+    wins = np.concatenate(win_batches)
+    _, game_indices = np.unique(game_ids, return_inverse=True)
+    game_count = int(game_indices.max()) + 1 if len(game_indices) else 0
+    logging.info(f'Binned {len(game_ids)} Turn States of {game_count} games')
+
+    # Flatten each (game, bin) into one index to count them all at once
+    cell_indices = game_indices * len(bin_starts) + bins
+    cell_count = game_count * len(bin_starts)
+    game_bin_wins = np.bincount(cell_indices, weights=wins,
+        minlength=cell_count).reshape(game_count, len(bin_starts))
+    game_bin_counts = np.bincount(cell_indices,
+        minlength=cell_count).reshape(game_count, len(bin_starts))
+
+    return game_bin_wins, game_bin_counts, bin_starts
+
+
+# Set the counts resampled by a worker process
+def _set_game_bin_counts(game_bin_wins: np.ndarray,
+        game_bin_counts: np.ndarray) -> None:
+    global _game_bin_wins, _game_bin_counts
+    _game_bin_wins = game_bin_wins
+    _game_bin_counts = game_bin_counts
+
+
+# Get the win probability of each bin in a batch of replicates. Each
+# replicate draws games with replacement, which weights each game by the
+# number of times it was drawn
+def _get_replicate_win_probabilities(seed_sequence: np.random.SeedSequence,
+        replicate_count: int) -> np.ndarray:
+    assert _game_bin_wins is not None and _game_bin_counts is not None
+    game_count = len(_game_bin_wins)
+    rng = np.random.default_rng(seed_sequence)
+    game_weights = rng.multinomial(game_count,
+        np.full(game_count, 1 / game_count), size=replicate_count)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result: np.ndarray = (
+            (game_weights @ _game_bin_wins)
+            / (game_weights @ _game_bin_counts))
+        return result
+
+
+# Bootstrap the win probability of player 1 by the difference in a metric,
+# resampling whole games since the turns of a game are correlated. Batches
+# of replicates are resampled in parallel. Returns the probability and
+# confidence interval of each bin
+def bootstrap_win_probabilities(source: TurnStateSource, metric: str,
+        bin_width: int = 5, min_difference: int = -50,
+        max_difference: int = 50, replicates: int = 1000,
+        confidence: float = 0.95, workers: int = 1,
+        replicates_per_batch: int = 50,
+        seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    game_bin_wins, game_bin_counts, bin_starts = get_game_bin_counts(source,
+        metric, bin_width, min_difference, max_difference)
+    if not len(game_bin_wins):
+        raise ValueError('There are no Turn States to resample.')
+
+    batch_sizes = [replicates_per_batch] * (replicates // replicates_per_batch)
+    if replicates % replicates_per_batch:
+        batch_sizes.append(replicates % replicates_per_batch)
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+
+    logging.info(
+        f'Resampling {replicates} replicates of {len(game_bin_wins)} games '
+        f'in {workers} processes'
+    )
+    with ProcessPoolExecutor(workers, initializer=_set_game_bin_counts,
+            initargs=(game_bin_wins, game_bin_counts)) as executor:
+        replicate_win_probabilities = np.concatenate(list(executor.map(
+            _get_replicate_win_probabilities, seed_sequences, batch_sizes)))
+
+    # Bins without any Turn States in a replicate are ignored
+    alpha = (1 - confidence) / 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        win_probabilities = (
+            game_bin_wins.sum(axis=0) / game_bin_counts.sum(axis=0))
+    turn_state_counts = game_bin_counts.sum(axis=0)
+
+    bins: List[Dict[str, Any]] = []
+    for i, bin_start in enumerate(bin_starts):
+        bin_replicates = replicate_win_probabilities[:, i]
+        bin_replicates = bin_replicates[~np.isnan(bin_replicates)]
+        is_estimated = len(bin_replicates) > 0
+
+        bins.append({
+            'bin_start': int(bin_start),
+            'turn_states': int(turn_state_counts[i]),
+            'win_probability': (
+                float(win_probabilities[i]) if turn_state_counts[i]
+                else None),
+            'lower': (
+                float(np.quantile(bin_replicates, alpha)) if is_estimated
+                else None),
+            'upper': (
+                float(np.quantile(bin_replicates, 1 - alpha)) if is_estimated
+                else None),
+        })
+
+    return bins
@@ -1,10 +1,14 @@
 import logging
+import os
 
-from typing import Dict
+from collections import Counter
+from typing import Dict, Optional, Tuple
 
+from .combat import DEFAULT_MAX_ARMIES, CombatTables
 from .models import Card, Game, Ladder, Player, Map, Order, OrderType
 from .models import PlayerAccount, PlayerStateType, Template
 from .models import TemplateCardSetting, Territory, Turn
+from .ratings import Ratings
 from .wrappers import BonusWrapper, GameWrapper, MapWrapper, TerritoryWrapper
 
 # Cached Ladders
@@ -31,9 +35,44 @@ player_accounts: Dict[int, PlayerAccount] = {}
 # Cached Games
 games: Dict[int, GameWrapper] = {}
 
+# Cached combat tables by Template id
+combat_tables: Dict[int, CombatTables] = {}
+
+# Cached Ratings by path, with the modification time of the file they were
+# loaded from
+ratings: Dict[str, Tuple[Optional[float], Ratings]] = {}
+
+# Number of lookups of each cache that were found and not found in the cache
+cache_hits: Counter = Counter()
+cache_misses: Counter = Counter()
+
+
+# Record whether a lookup was found in the named cache
+def _record_lookup(cache_name: str, is_hit: bool) -> None:
+    if is_hit:
+        cache_hits[cache_name] += 1
+    else:
+        cache_misses[cache_name] += 1
+
+
+# Reset the number of lookups found and not found in each cache
+def reset_hit_counts() -> None:
+    cache_hits.clear()
+    cache_misses.clear()
+
+
+# Get the fraction of lookups of each cache that were found in the cache
+def get_hit_rates() -> Dict[str, float]:
+    return {
+        cache_name: cache_hits[cache_name] / (
+            cache_hits[cache_name] + cache_misses[cache_name])
+        for cache_name in cache_hits.keys() | cache_misses.keys()
+    }
+
 
 # Get Ladder
 def get_ladder(id: int) -> Ladder:
+    _record_lookup('ladders', id in ladders)
     try:
         return ladders[id]
     except KeyError:
@@ -43,6 +82,7 @@ def get_ladder(id: int) -> Ladder:
 
 # Get Card
 def get_card(id: int) -> Card:
+    _record_lookup('cards', id in cards)
     try:
         return cards[id]
     except KeyError:
@@ -52,6 +92,7 @@ def get_card(id: int) -> Card:
 
 # Get Player State Type
 def get_player_state_type(id: str) -> PlayerStateType:
+    _record_lookup('player_state_types', id in player_state_types)
     try:
         return player_state_types[id]
     except KeyError:
@@ -61,6 +102,7 @@ def get_player_state_type(id: str) -> PlayerStateType:
 
 # Get OrderType
 def get_order_type(id: str) -> OrderType:
+    _record_lookup('order_types', id in order_types)
     try:
         return order_types[id]
     except KeyError:
@@ -147,7 +189,10 @@ def get_map_wrapper(map_id: int, for_import: bool) -> MapWrapper:
 
     # If map is not in the dictionary
     if map_id not in maps or maps[map_id].uses_api_ids != for_import:
+        _record_lookup('maps', False)
         add_map_to_cache(map_id, for_import)
+    else:
+        _record_lookup('maps', True)
 
     # Return map wrapper
     return maps[map_id]
@@ -162,6 +207,7 @@ def add_template_to_cache(template: Template) -> None:
 # Otherwise, Fetches Template from DB and adds it to the cache.
 # Throws Template.DoesNotExist if Template doesn't exist in the DB.
 def get_template(template_id: int) -> Template:
+    _record_lookup('templates', template_id in templates)
     # if template is not in the dictionary
     if template_id  not in templates:
         template = Template.objects.get(pk=template_id)
@@ -172,6 +218,43 @@ def get_template(template_id: int) -> Template:
     return templates[template_id]
 
 
+# Fetches the combat tables of a Template from cache if they cover attacks of
+# max_armies. Otherwise, builds tables that cover them, at least doubling the
+# size of any cached tables, and adds them to the cache
+def get_combat_tables(template: Template, max_armies: int) -> CombatTables:
+    tables = combat_tables.get(template.id)
+    is_hit = tables is not None and tables.max_armies >= max_armies
+    _record_lookup('combat_tables', is_hit)
+
+    if not is_hit:
+        size = max(max_armies, DEFAULT_MAX_ARMIES,
+            2 * tables.max_armies if tables else 0)
+        logging.debug(
+            f'Building combat tables of Template {template.id} covering '
+            f'{size} armies'
+        )
+        combat_tables[template.id] = CombatTables.from_template(template,
+            size)
+
+    return combat_tables[template.id]
+
+
+# Fetches the Ratings saved at a path from cache. Otherwise, or if the file
+# has changed since they were loaded, loads them and adds them to the cache
+def get_ratings(path: str) -> Ratings:
+    modified_time = (
+        os.path.getmtime(path) if os.path.exists(path) else None)
+    cached_ratings = ratings.get(path)
+    is_hit = (
+        cached_ratings is not None and cached_ratings[0] == modified_time)
+    _record_lookup('ratings', is_hit)
+
+    if not is_hit:
+        ratings[path] = (modified_time, Ratings.load(path))
+
+    return ratings[path][1]
+
+
 # Add the player account to the cache
 def add_player_account_to_cache(player_account: PlayerAccount) -> None:
     player_accounts[player_account.id] = player_account
@@ -182,6 +265,7 @@ def add_player_account_to_cache(player_account: PlayerAccount) -> None:
 # Add the player account to the player accounts cache. Uses ID as key
 # Returns Player
 def get_player_account(player_account_id: int) -> PlayerAccount:
+    _record_lookup('player_accounts', player_account_id in player_accounts)
     if player_account_id not in player_accounts:
         player_account = PlayerAccount.objects.get(pk=player_account_id)
         add_player_account_to_cache(player_account)
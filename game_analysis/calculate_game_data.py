@@ -1,15 +1,34 @@
 import logging
+import os.path
 
-from typing import Dict, List, Set
+from functools import partial
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
+from django.db import connection, transaction
 from django.db.models import Prefetch
 from django.db.models.query import QuerySet
 
+from . import aggregates
 from . import cache
-from .models import Game, Map, Order, Player, PlayerState, Turn
-from .wrappers import GameWrapper, MapWrapper, PlayerStateWrapper
+from . import feature_store
+from . import player_statistics
+from . import trajectories
+from .models import Game, Map, Order, Player, PlayerState, TerritoryState
+from .models import Turn, TurnState
+from .progress import ProgressCallback, report
+from .wrappers import GameWrapper, MapWrapper, PlayerStateWrapper, TurnWrapper
+
+# Owning Player id and armies of a Territory. Neutral Territories have neither
+TerritoryOwnership = Tuple[Optional[int], Optional[int]]
+NEUTRAL_OWNERSHIP: TerritoryOwnership = (None, None)
+
+# Query to insert the Turn States of a list of Games
+with open(os.path.join(os.path.dirname(__file__),
+        'sql/insert_turn_state.sql'), 'r') as file:
+    INSERT_TURN_STATES_SQL = file.read()
 
 player_states_to_save: List[PlayerState] = []
+territory_states_to_save: List[TerritoryState] = []
 
 CURRENT_VERSION = 1
 SELECT_GAMES_QUERY: QuerySet = (
@@ -19,19 +38,30 @@ SELECT_GAMES_QUERY: QuerySet = (
             'player_set',
             # Not needed for version 1
             # 'territorybaseline_set',
+            'turn_set',
             Prefetch(
-                'turn_set__order_set',
+                'order_set',
                 queryset=Order.objects.select_related('attackresult')),
-            'turn_set__playerstate_set'
+            'playerstate_set'
         )
 )
 
 
+# Get the number of objects waiting in each save queue
+def _get_queue_depths() -> Dict[str, int]:
+    return {
+        'player_states': len(player_states_to_save),
+        'territory_states': len(territory_states_to_save),
+    }
+
+
 # Create a Player State Wrapper for the next turn
 def _set_player_state_wrapper_turn(wrapper: PlayerStateWrapper,
         turn: Turn) -> None:
     wrapper.player_state = PlayerState(
+        game_id = turn.game_id,
         turn = turn,
+        turn_number = turn.turn_number,
         player = wrapper.player_state.player,
         income = wrapper.player_state.income,
         armies_deployed = 0,
@@ -233,8 +263,10 @@ def _process_blockade(map_wrapper: MapWrapper,
         _process_territory_loss(map_wrapper, territory_owners, blockader, order)
 
 
-# Return Player States data for a Game
-def _parse_player_states(game_wrapper: GameWrapper) -> None:
+# Replay the Orders of a Game. Yields each Turn along with the state of each
+# Player at the end of that Turn
+def replay_game(game_wrapper: GameWrapper) -> Iterator[
+        Tuple[TurnWrapper, Dict[int, PlayerStateWrapper]]]:
     template = cache.get_template(game_wrapper.game.template_id)
     map_wrapper = cache.get_map_wrapper(template.map_id, False)
 
@@ -291,15 +323,85 @@ def _parse_player_states(game_wrapper: GameWrapper) -> None:
             # TODO handle Bomb - not needed for most templates
             # TODO handle Diplomacy - not needed for most templates
 
+        yield turn_wrapper, players_state
+
+
+# Queue a TerritoryState for each Territory whose owner or armies changed
+# during the Turn. Updates territory_states to the state at the end of the Turn
+def _record_territory_changes(game: Game, turn: Turn,
+        players_state: Dict[int, PlayerStateWrapper],
+        territory_states: Dict[int, TerritoryOwnership]) -> None:
+    current_states: Dict[int, TerritoryOwnership] = {
+        territory_id: (player_state_wrapper.player_state.player_id, armies)
+        for player_state_wrapper in players_state.values()
+        for territory_id, armies in player_state_wrapper.territories.items()
+    }
+
+    # Territories no longer held by any player have reverted to neutral
+    for territory_id in territory_states.keys() - current_states.keys():
+        current_states[territory_id] = NEUTRAL_OWNERSHIP
+
+    for territory_id, (owner_id, armies) in current_states.items():
+        if territory_states.get(territory_id, NEUTRAL_OWNERSHIP) != (
+                owner_id, armies):
+            territory_states_to_save.append(
+                TerritoryState(
+                    game = game,
+                    territory_id = territory_id,
+                    turn_number = turn.turn_number,
+                    owner_id = owner_id,
+                    armies = armies
+                )
+            )
+
+        # Neutral is the default so there is no need to keep track of it
+        if owner_id is None:
+            territory_states.pop(territory_id, None)
+        else:
+            territory_states[territory_id] = (owner_id, armies)
+
+
+# Return Player States data for a Game
+def _parse_player_states(game_wrapper: GameWrapper,
+        record_territory_history: bool = False) -> None:
+    # Dictionary of territory ids to the current owner and armies of each
+    # territory that isn't neutral
+    territory_states: Dict[int, TerritoryOwnership] = {}
+
+    for turn_wrapper, players_state in replay_game(game_wrapper):
         # Add PlayerStates to list of PlayerStates to save
         player_states_to_save.extend([
             player_state_wrapper.player_state
             for player_state_wrapper in players_state.values()
         ])
 
+        if record_territory_history:
+            _record_territory_changes(game_wrapper.game, turn_wrapper.turn,
+                players_state, territory_states)
+
+
+# Replace the materialized Turn States of the given Games with ones built from
+# their current Player States
+def _refresh_turn_states(game_ids: List[int]) -> None:
+    if not game_ids:
+        return
+
+    sql_statement = INSERT_TURN_STATES_SQL.format(
+        game_ids=', '.join(['%s'] * len(game_ids)))
+
+    with transaction.atomic():
+        TurnState.objects.filter(game_id__in=game_ids).delete()
+        with connection.cursor() as c:
+            c.execute(sql_statement, game_ids)
+
 
-# Create Player State data for a given number of games from an given offset
-def calculate_game_data(max_games_to_process: int, batch_size:int = 5) -> int:
+# Create Player State data for a given number of games from an given offset.
+# If record_territory_history is set, also records the changes in owner and
+# armies of each Territory. Reports a 'game' event for each Game and a 'batch'
+# event for each batch of Games to progress
+def calculate_game_data(max_games_to_process: int, batch_size:int = 5,
+        record_territory_history: bool = False,
+        progress: Optional[ProgressCallback] = None) -> int:
     logging.info(
         f'Processing {max_games_to_process} games'
     )
@@ -321,18 +423,44 @@ def calculate_game_data(max_games_to_process: int, batch_size:int = 5) -> int:
 
         # Clear save queue
         player_states_to_save.clear()
+        territory_states_to_save.clear()
         
         for game in games:
             logging.info(
                 f'Processing game {game.id}: Offset {counter}')
             
-            _parse_player_states(GameWrapper(game))
+            _parse_player_states(GameWrapper(game), record_territory_history)
             game.version = CURRENT_VERSION
             counter += 1
+            report(progress, 'game', game_id=game.id, games_processed=counter,
+                queue_depths=_get_queue_depths(),
+                cache_hit_rates=cache.get_hit_rates())
         
-        # Save Player States to the DB
-        Game.objects.bulk_update(games, ['version'])
-        PlayerState.objects.bulk_create(player_states_to_save)
+        # Save Player States and everything derived from them to the DB in
+        # one transaction. The version is updated last, so if any step fails
+        # the Games are left to be calculated again. The files derived from
+        # them are only appended to once the transaction commits
+        queue_depths = _get_queue_depths()
+        game_ids = [game.id for game in games]
+        with transaction.atomic():
+            PlayerState.objects.bulk_create(player_states_to_save)
+            player_statistics.add_player_states(player_states_to_save)
+            _refresh_turn_states(game_ids)
+            aggregates.increment_win_probability_cells(game_ids)
+
+            # Replace any Territory history left by a previous calculation
+            if record_territory_history:
+                TerritoryState.objects.filter(game_id__in=game_ids).delete()
+                TerritoryState.objects.bulk_create(territory_states_to_save)
+
+            Game.objects.bulk_update(games, ['version'])
+            transaction.on_commit(
+                partial(feature_store.append_game_features, game_ids))
+            transaction.on_commit(
+                partial(trajectories.append_game_trajectories, game_ids))
+
+        report(progress, 'batch', games_processed=counter,
+            queue_depths=queue_depths, cache_hit_rates=cache.get_hit_rates())
 
         are_games_to_process = games and counter < max_games_to_process
 
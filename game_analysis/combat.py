@@ -0,0 +1,169 @@
+import numpy as np
+
+from typing import Any, Tuple
+
+from .models import Template
+
+# Number of armies the combat tables of a template cover when first built.
+# Tables are rebuilt to cover larger attacks when needed
+DEFAULT_MAX_ARMIES = 256
+
+
+# Get the distribution of the number of kills made by each number of armies
+# from 0 to max_armies. Each army kills with the kill rate, then the random
+# kills are blended with the expected kills, weighted by the luck modifier,
+# and the blend is rounded, either to the nearest integer or up with the
+# probability of its fractional part. A luck modifier of 0 gives the expected
+# kills and 1 gives the random kills. Row n is the distribution of kills made
+# by n armies
+def get_kill_distributions(kill_rate: float, luck_modifier: float,
+        is_straight_round: bool, max_armies: int) -> np.ndarray:
+    random_kills = np.zeros((max_armies + 1, max_armies + 1))
+    random_kills[0, 0] = 1.0
+    for armies in range(1, max_armies + 1):
+        random_kills[armies, :armies + 1] = (
+            random_kills[armies - 1, :armies + 1] * (1 - kill_rate))
+        random_kills[armies, 1:armies + 1] += (
+            random_kills[armies - 1, :armies] * kill_rate)
+
+    army_indices, kill_indices = np.tril_indices(max_armies + 1)
+    probabilities = random_kills[army_indices, kill_indices]
+    blended_kills = (
+        luck_modifier * kill_indices
+        + (1 - luck_modifier) * kill_rate * army_indices)
+
+    distributions = np.zeros((max_armies + 1, max_armies + 1))
+    if is_straight_round:
+        np.add.at(distributions,
+            (army_indices, np.floor(blended_kills + 0.5).astype(np.int64)),
+            probabilities)
+    else:
+        rounded_down = np.floor(blended_kills)
+        round_up_probabilities = blended_kills - rounded_down
+        rounded_down = rounded_down.astype(np.int64)
+        np.add.at(distributions, (army_indices, rounded_down),
+            probabilities * (1 - round_up_probabilities))
+        np.add.at(distributions,
+            (army_indices, np.minimum(rounded_down + 1, army_indices)),
+            probabilities * round_up_probabilities)
+
+    return distributions
+
+
+# Kills made by one side of a battle. Kills are limited to the size of the
+# opposing side, so the tables are indexed by the number of armies and the
+# size of the opposing side, which may be one more than the largest number of
+# kills to mean no limit
+class KillTable:
+    def __init__(self, kill_rate: float, luck_modifier: float,
+            is_straight_round: bool, max_armies: int) -> None:
+        self.kill_rate = kill_rate
+        self.luck_modifier = luck_modifier
+        self.is_straight_round = is_straight_round
+        self.max_armies = max_armies
+        self.distributions = get_kill_distributions(kill_rate, luck_modifier,
+            is_straight_round, max_armies)
+
+        # Probability of making at least each number of kills
+        self.at_least = np.zeros((max_armies + 1, max_armies + 2))
+        self.at_least[:, :-1] = np.cumsum(
+            self.distributions[:, ::-1], axis=1)[:, ::-1]
+
+        # Expected kills when limited to each opposing size, which is the sum
+        # of the probabilities of making at least 1 to that many kills
+        self.expected = np.zeros((max_armies + 1, max_armies + 2))
+        self.expected[:, 1:] = np.cumsum(self.at_least[:, 1:], axis=1)
+
+    # Limit opposing sizes to the size meaning no limit
+    def _get_limit(self, opposing_sizes: Any) -> Any:
+        return np.minimum(opposing_sizes, self.max_armies + 1)
+
+    # Get the probability that armies kill all of the opposing side
+    def get_kill_all_probability(self, armies: Any,
+            opposing_sizes: Any) -> Any:
+        return self.at_least[armies, self._get_limit(opposing_sizes)]
+
+    # Get the expected number of kills made by armies against the opposing
+    # side
+    def get_expected_kills(self, armies: Any, opposing_sizes: Any) -> Any:
+        return self.expected[armies, self._get_limit(opposing_sizes)]
+
+    # Sample the kills made by armies against the opposing side, using the
+    # same rules as the distributions
+    def sample_kills(self, rng: np.random.Generator, armies: np.ndarray,
+            opposing_sizes: np.ndarray) -> np.ndarray:
+        blended_kills = (
+            self.luck_modifier * rng.binomial(armies, self.kill_rate)
+            + (1 - self.luck_modifier) * self.kill_rate * armies)
+        if self.is_straight_round:
+            kills = np.floor(blended_kills + 0.5)
+        else:
+            kills = np.floor(blended_kills + rng.random(len(armies)))
+        result: np.ndarray = np.minimum(kills.astype(np.int64),
+            opposing_sizes)
+        return result
+
+    # Get the distribution of kills made by a number of armies against an
+    # opposing side
+    def get_distribution(self, armies: int, opposing_size: int) -> np.ndarray:
+        distribution: np.ndarray = (
+            self.distributions[armies, :opposing_size + 1].copy())
+        distribution[-1] = self.at_least[armies, self._get_limit(
+            opposing_size)]
+        return distribution
+
+
+# Combat tables of a Template. Attackers kill defenders with the offensive
+# kill rate and defenders kill attackers with the defensive kill rate, and
+# an attack succeeds if it kills all defenders and some attackers survive.
+# Methods take numbers of attackers and defenders of up to max_armies, as
+# scalars or arrays that broadcast against each other to evaluate whole grids
+# of attacks at once
+class CombatTables:
+    def __init__(self, offensive_kill_rate: float, defensive_kill_rate: float,
+            luck_modifier: float, is_straight_round: bool,
+            max_armies: int = DEFAULT_MAX_ARMIES) -> None:
+        self.max_armies = max_armies
+        self.offense = KillTable(offensive_kill_rate, luck_modifier,
+            is_straight_round, max_armies)
+        self.defense = KillTable(defensive_kill_rate, luck_modifier,
+            is_straight_round, max_armies)
+
+    # Create the combat tables of a Template's settings
+    @staticmethod
+    def from_template(template: Template,
+            max_armies: int = DEFAULT_MAX_ARMIES) -> 'CombatTables':
+        return CombatTables(template.offensive_kill_rate / 100,
+            template.defensive_kill_rate / 100, template.luck_modifier,
+            template.is_straight_round, max_armies)
+
+    # Get the probability that attacks succeed
+    def get_success_probability(self, attackers: Any, defenders: Any) -> Any:
+        return (
+            self.offense.get_kill_all_probability(attackers, defenders)
+            * (1 - self.defense.get_kill_all_probability(defenders,
+                attackers))
+        )
+
+    # Get the expected numbers of defending and attacking armies killed by
+    # attacks
+    def get_expected_kills(self, attackers: Any,
+            defenders: Any) -> Tuple[Any, Any]:
+        return (self.offense.get_expected_kills(attackers, defenders),
+            self.defense.get_expected_kills(defenders, attackers))
+
+    # Sample the numbers of defending and attacking armies killed by attacks
+    def sample_kills(self, rng: np.random.Generator, attackers: np.ndarray,
+            defenders: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return (self.offense.sample_kills(rng, attackers, defenders),
+            self.defense.sample_kills(rng, defenders, attackers))
+
+    # Get the joint distribution of defending armies killed (rows) and
+    # attacking armies killed (columns) of an attack. The kills of each side
+    # are independent
+    def get_outcome_distribution(self, attackers: int,
+            defenders: int) -> np.ndarray:
+        return np.outer(
+            self.offense.get_distribution(attackers, defenders),
+            self.defense.get_distribution(defenders, attackers))
+
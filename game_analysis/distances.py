@@ -0,0 +1,106 @@
+import logging
+import os
+import numpy as np
+
+from typing import Optional
+
+from django.conf import settings
+
+# Number of territories whose breadth first searches are run together
+SOURCES_PER_BATCH = 256
+
+
+# Get the path of the distance matrix of a Map
+def get_distances_path(map_id: int) -> str:
+    return os.path.join(settings.ANALYSIS_DATA_DIR, 'maps',
+        f'{map_id}_distances.npy')
+
+
+# Get the value of a distance matrix meaning there is no path
+def get_unreachable_distance(distances: np.ndarray) -> int:
+    return int(np.iinfo(distances.dtype).max)
+
+
+# Compute the number of hops between each pair of territories, given their
+# adjacency in compressed sparse row form. Runs a breadth first search from
+# every territory, advancing a batch of searches a level at a time. Uses
+# uint8 if every distance fits in it and uint16 otherwise, with the largest
+# value meaning there is no path
+def compute_distances(adjacency_indptr: np.ndarray,
+        adjacency_indices: np.ndarray) -> np.ndarray:
+    territory_count = len(adjacency_indptr) - 1
+    neighbor_counts = np.diff(adjacency_indptr)
+
+    distances = np.full((territory_count, territory_count),
+        np.iinfo(np.uint16).max, dtype=np.uint16)
+    for start in range(0, territory_count, SOURCES_PER_BATCH):
+        sources = np.arange(start,
+            min(start + SOURCES_PER_BATCH, territory_count))
+        reached = np.zeros((len(sources), territory_count), dtype=bool)
+        kept_pairs = np.zeros((len(sources), territory_count),
+            dtype=np.int64)
+        rows = np.arange(len(sources))
+        columns = sources
+        reached[rows, columns] = True
+        distances[sources, sources] = 0
+
+        # The frontier of each search is kept as (search, territory) pairs
+        distance = 0
+        while len(rows):
+            distance += 1
+
+            # Expand each territory in the frontier to its neighbors. Only
+            # the neighbors not reached already are in the next frontier
+            counts = neighbor_counts[columns]
+            positions = np.arange(counts.sum()) + np.repeat(
+                adjacency_indptr[columns] - (np.cumsum(counts) - counts),
+                counts)
+            rows = np.repeat(rows, counts)
+            columns = adjacency_indices[positions]
+
+            # Keep one of the pairs expanded to each new territory
+            is_new = ~reached[rows, columns]
+            rows, columns = rows[is_new], columns[is_new]
+            kept_pairs[rows, columns] = np.arange(len(rows))
+            is_kept = kept_pairs[rows, columns] == np.arange(len(rows))
+            rows, columns = rows[is_kept], columns[is_kept]
+            reached[rows, columns] = True
+            distances[sources[rows], columns] = distance
+
+    reachable = distances[distances != np.iinfo(np.uint16).max]
+    if not len(reachable) or reachable.max() < np.iinfo(np.uint8).max:
+        distances[distances == np.iinfo(np.uint16).max] = (
+            np.iinfo(np.uint8).max)
+        return distances.astype(np.uint8)
+    return distances
+
+
+# Save the distance matrix of a Map, replacing any previous one only once the
+# new one is fully written
+def save_distances(map_id: int, distances: np.ndarray) -> None:
+    path = get_distances_path(map_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = path + '.tmp'
+
+    with open(temporary_path, 'wb') as file:
+        np.save(file, distances)
+
+    os.replace(temporary_path, path)
+
+
+# Load the memory mapped distance matrix of a Map, or None if it has not been
+# built for the Map's current number of territories
+def load_distances(map_id: int,
+        territory_count: int) -> Optional[np.ndarray]:
+    path = get_distances_path(map_id)
+    if not os.path.exists(path):
+        return None
+
+    distances: np.ndarray = np.load(path, mmap_mode='r')
+    if distances.shape != (territory_count, territory_count):
+        logging.warning(
+            f'Distance matrix of Map {map_id} does not match its '
+            f'{territory_count} territories'
+        )
+        return None
+    return distances
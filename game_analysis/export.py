@@ -0,0 +1,143 @@
+import csv
+import io
+import logging
+import os
+import numpy as np
+
+from itertools import islice
+from typing import Any, Iterator, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models.query import QuerySet
+
+from .models import TurnState
+
+CSV = 'csv'
+NPY = 'npy'
+
+# Number of Turn States read from the DB at a time
+EXPORT_CHUNK_SIZE = 10000
+
+# Exported Turn State columns and their types
+TURN_STATE_COLUMNS: List[Tuple[str, str]] = [
+    ('game_id', 'i4'),
+    ('turn_number', 'i2'),
+    ('p1_winner', '?'),
+    ('p1_income', 'i2'),
+    ('p1_armies_on_board', 'i2'),
+    ('p1_armies_deployed', 'i2'),
+    ('p1_cumulative_armies_deployed', 'i2'),
+    ('p1_territories_controlled', 'i2'),
+    ('p2_income', 'i2'),
+    ('p2_armies_on_board', 'i2'),
+    ('p2_armies_deployed', 'i2'),
+    ('p2_cumulative_armies_deployed', 'i2'),
+    ('p2_territories_controlled', 'i2'),
+]
+TURN_STATE_DTYPE = np.dtype(TURN_STATE_COLUMNS)
+TURN_STATE_COLUMN_NAMES = [name for name, _ in TURN_STATE_COLUMNS]
+
+# Row of values read from the DB
+Row = Tuple[Any, ...]
+
+
+# Get the Turn State rows to export, ordered by game and turn
+def get_turn_states(ladder_id: Optional[int] = None,
+        template_id: Optional[int] = None,
+        min_turn_number: Optional[int] = None,
+        max_turn_number: Optional[int] = None) -> QuerySet:
+    turn_states = TurnState.objects.all()
+
+    if ladder_id is not None:
+        turn_states = turn_states.filter(game__ladder_id=ladder_id)
+    if template_id is not None:
+        turn_states = turn_states.filter(game__template_id=template_id)
+    if min_turn_number is not None:
+        turn_states = turn_states.filter(turn_number__gte=min_turn_number)
+    if max_turn_number is not None:
+        turn_states = turn_states.filter(turn_number__lte=max_turn_number)
+
+    return (
+        turn_states
+            .order_by('game_id', 'turn_number')
+            .values_list(*TURN_STATE_COLUMN_NAMES)
+    )
+
+
+# Read the rows of a query in chunks without loading them all into memory
+def iterate_chunks(rows: QuerySet,
+        chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[List[Row]]:
+    row_iterator = rows.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(row_iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Stream Turn State rows as CSV text, one chunk at a time
+def stream_turn_states_csv(turn_states: QuerySet) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(TURN_STATE_COLUMN_NAMES)
+
+    for chunk in iterate_chunks(turn_states):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+# Stream Turn State rows as a .npy file of records, one chunk at a time. The
+# rows are counted first and no more rows than the header holds are sent, so
+# rows added during a download are left out. No transaction is held open
+# while the client reads the response
+def stream_turn_states_npy(turn_states: QuerySet) -> Iterator[bytes]:
+    row_count = turn_states.count()
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, {
+        'descr': np.lib.format.dtype_to_descr(TURN_STATE_DTYPE),
+        'fortran_order': False,
+        'shape': (row_count,),
+    })
+    yield header.getvalue()
+
+    rows_sent = 0
+    for chunk in iterate_chunks(turn_states[:row_count]):
+        rows_sent += len(chunk)
+        yield np.array(chunk, dtype=TURN_STATE_DTYPE).tobytes()
+
+    if rows_sent < row_count:
+        logging.warning(
+            f'Turn States were deleted during the export. Sent {rows_sent} '
+            f'of {row_count} rows'
+        )
+
+
+# Write Turn State rows to a directory with one memory-mappable .npy file per
+# column. Returns the number of rows written
+def export_turn_state_columns(turn_states: QuerySet, directory: str) -> int:
+    os.makedirs(directory, exist_ok=True)
+
+    with transaction.atomic():
+        row_count: int = turn_states.count()
+        columns = {
+            name: np.lib.format.open_memmap(
+                os.path.join(directory, f'{name}.npy'), mode='w+',
+                dtype=np.dtype(dtype), shape=(row_count,))
+            for name, dtype in TURN_STATE_COLUMNS
+        }
+
+        offset = 0
+        for chunk in iterate_chunks(turn_states):
+            records = np.array(chunk, dtype=TURN_STATE_DTYPE)
+            for name, column in columns.items():
+                column[offset:offset + len(records)] = records[name]
+            offset += len(records)
+
+    for column in columns.values():
+        column.flush()
+
+    return row_count
@@ -0,0 +1,191 @@
+import logging
+import os
+import shutil
+import numpy as np
+
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+
+from .export import TURN_STATE_COLUMN_NAMES, TURN_STATE_DTYPE
+from .models import TurnState
+
+# Features derived from each Turn State
+FEATURE_NAMES = [
+    'income_diff',
+    'income_ratio',
+    'armies_on_board_ratio',
+    'armies_deployed_ratio',
+    'cumulative_armies_deployed_ratio',
+]
+
+# Fixed-width record of the features of a turn. The (game, turn) key comes
+# first and each feature is stored in its own column after compaction
+FEATURE_COLUMNS: List[Tuple[str, str]] = (
+    [('game_id', 'i4'), ('turn_number', 'i2'), ('p1_winner', '?')]
+    + [(name, 'f4') for name in FEATURE_NAMES]
+)
+FEATURE_RECORD_DTYPE = np.dtype(FEATURE_COLUMNS)
+FEATURE_COLUMN_NAMES = [name for name, _ in FEATURE_COLUMNS]
+
+LOG_FILE_NAME = 'features.log'
+COLUMNS_DIRECTORY_NAME = 'columns'
+
+
+# Get the directory of the feature store
+def get_feature_store_directory() -> str:
+    return os.path.join(settings.ANALYSIS_DATA_DIR, 'features')
+
+
+# Get the path of a file or directory in the feature store
+def _get_path(name: str) -> str:
+    return os.path.join(get_feature_store_directory(), name)
+
+
+# Divide p1 values by p2 values. The ratio is NaN where p2 is 0
+def _get_ratio(p1_values: np.ndarray, p2_values: np.ndarray) -> np.ndarray:
+    ratio = np.full(len(p1_values), np.nan, dtype='f4')
+    np.divide(p1_values, p2_values, out=ratio, where=p2_values != 0)
+    return ratio
+
+
+# Calculate the feature records of Turn States
+def _get_feature_records(turn_states: np.ndarray) -> np.ndarray:
+    records = np.empty(len(turn_states), dtype=FEATURE_RECORD_DTYPE)
+    records['game_id'] = turn_states['game_id']
+    records['turn_number'] = turn_states['turn_number']
+    records['p1_winner'] = turn_states['p1_winner']
+    records['income_diff'] = (
+        turn_states['p1_income'].astype('f4') - turn_states['p2_income'])
+
+    for name in ['income', 'armies_on_board', 'armies_deployed',
+            'cumulative_armies_deployed']:
+        records[f'{name}_ratio'] = _get_ratio(
+            turn_states[f'p1_{name}'], turn_states[f'p2_{name}'])
+
+    return records
+
+
+# Append the features of the Turn States of the games to the log. Records of
+# recalculated games replace older ones when the store is compacted
+def append_game_features(game_ids: List[int]) -> int:
+    turn_states = np.array(
+        list(
+            TurnState.objects
+                .filter(game_id__in=game_ids)
+                .values_list(*TURN_STATE_COLUMN_NAMES)
+        ),
+        dtype=TURN_STATE_DTYPE
+    )
+
+    if not len(turn_states):
+        return 0
+
+    os.makedirs(get_feature_store_directory(), exist_ok=True)
+    with open(_get_path(LOG_FILE_NAME), 'ab') as log_file:
+        # Drop a record left partially written by an interrupted append so
+        # that the new records start at a record boundary
+        record_size = FEATURE_RECORD_DTYPE.itemsize
+        log_file.truncate(log_file.tell() // record_size * record_size)
+        log_file.write(_get_feature_records(turn_states).tobytes())
+
+    return len(turn_states)
+
+
+# Read the records in a log file without loading them into memory
+def _read_log(log_path: str) -> np.ndarray:
+    if not os.path.exists(log_path):
+        return np.empty(0, dtype=FEATURE_RECORD_DTYPE)
+
+    # Ignore a partially written record at the end of the log
+    record_count = os.path.getsize(log_path) // FEATURE_RECORD_DTYPE.itemsize
+    if not record_count:
+        return np.empty(0, dtype=FEATURE_RECORD_DTYPE)
+
+    return np.memmap(log_path, dtype=FEATURE_RECORD_DTYPE, mode='r',
+        shape=(record_count,))
+
+
+# Read the compacted columns into records
+def _read_columns() -> np.ndarray:
+    columns = load_feature_columns()
+    if not columns:
+        return np.empty(0, dtype=FEATURE_RECORD_DTYPE)
+
+    records = np.empty(len(columns['game_id']), dtype=FEATURE_RECORD_DTYPE)
+    for name in FEATURE_COLUMN_NAMES:
+        records[name] = columns[name]
+    return records
+
+
+# Merge the log into the compacted columns, keeping only the latest record of
+# each (game, turn). Returns the number of records in the store
+def compact_feature_store() -> int:
+    # Move the log aside so that batches calculated during compaction are
+    # appended to a new log. A log left by a failed compaction is merged first
+    compacting_log_path = _get_path(LOG_FILE_NAME + '.compacting')
+    if (not os.path.exists(compacting_log_path)
+            and os.path.exists(_get_path(LOG_FILE_NAME))):
+        os.replace(_get_path(LOG_FILE_NAME), compacting_log_path)
+
+    log_records = _read_log(compacting_log_path)
+    logging.info(f'Compacting {len(log_records)} logged feature records')
+
+    # Log records are newer than the columns. The sort is stable, so the last
+    # record of each (game, turn) is the latest one
+    records = np.concatenate([_read_columns(), log_records])
+    records = records[
+        np.lexsort((records['turn_number'], records['game_id']))]
+    is_latest = np.ones(len(records), dtype=bool)
+    is_latest[:-1] = (
+        (records['game_id'][:-1] != records['game_id'][1:])
+        | (records['turn_number'][:-1] != records['turn_number'][1:])
+    )
+    records = records[is_latest]
+
+    # Write the new columns next to the current ones before swapping them
+    columns_path = _get_path(COLUMNS_DIRECTORY_NAME)
+    new_columns_path = columns_path + '.new'
+    old_columns_path = columns_path + '.old'
+    shutil.rmtree(new_columns_path, ignore_errors=True)
+    os.makedirs(new_columns_path)
+    for name in FEATURE_COLUMN_NAMES:
+        np.save(os.path.join(new_columns_path, f'{name}.npy'),
+            np.ascontiguousarray(records[name]))
+
+    if os.path.exists(columns_path):
+        os.replace(columns_path, old_columns_path)
+    os.replace(new_columns_path, columns_path)
+    shutil.rmtree(old_columns_path, ignore_errors=True)
+
+    # The logged records are now in the columns
+    del log_records
+    if os.path.exists(compacting_log_path):
+        os.remove(compacting_log_path)
+
+    logging.info(f'Feature store contains {len(records)} records')
+    return len(records)
+
+
+# Memory-map the compacted columns of the feature store, sorted by game and
+# turn. Returns an empty dictionary if the store has not been compacted
+def load_feature_columns() -> Dict[str, np.ndarray]:
+    columns_path = _get_path(COLUMNS_DIRECTORY_NAME)
+    if not os.path.exists(columns_path):
+        return {}
+
+    return {
+        name: np.load(os.path.join(columns_path, f'{name}.npy'),
+            mmap_mode='r')
+        for name in FEATURE_COLUMN_NAMES
+    }
+
+
+# Get the start and end row of a game in the compacted columns
+def get_game_rows(columns: Dict[str, np.ndarray],
+        game_id: int) -> Tuple[int, int]:
+    game_ids = columns['game_id']
+    return (
+        int(np.searchsorted(game_ids, game_id, side='left')),
+        int(np.searchsorted(game_ids, game_id, side='right'))
+    )
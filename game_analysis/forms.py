@@ -22,6 +22,71 @@ class ImportLadderGamesForm(AuthForm):
     offset = forms.IntegerField(min_value=0, initial=0)
 
 
+class SyncLadderGamesForm(AuthForm):
+    ladder_id = forms.IntegerField(
+        label = 'Ladder ID',
+        initial = 0,
+        min_value = 0,
+        max_value = 10000)
+
+
 class CalculateGameDataForm(forms.Form):
     max_results = forms.IntegerField(label='Max Results', initial=50, min_value=1)
     batch_size = forms.IntegerField(min_value=0, initial=100)
+    record_territory_history = forms.BooleanField(
+        label = 'Record Territory History',
+        required = False)
+
+
+class ExportTurnStatesForm(forms.Form):
+    format = forms.ChoiceField(choices=[('csv', 'CSV'), ('npy', 'NumPy')])
+    ladder_id = forms.IntegerField(label='Ladder ID', required=False)
+    template_id = forms.IntegerField(label='Template ID', required=False)
+    min_turn_number = forms.IntegerField(
+        label = 'Min Turn Number',
+        required = False,
+        min_value = -1)
+    max_turn_number = forms.IntegerField(
+        label = 'Max Turn Number',
+        required = False,
+        min_value = -1)
+
+
+class SampleTurnStatesForm(forms.Form):
+    size = forms.IntegerField(min_value=1, max_value=1000000)
+    stratify_by = forms.MultipleChoiceField(required=False, choices=[
+        ('turn_number', 'Turn Number'),
+        ('template_id', 'Template'),
+        ('p1_winner', 'Outcome'),
+    ])
+    split = forms.ChoiceField(required=False, choices=[
+        ('', 'All Games'),
+        ('train', 'Train'),
+        ('test', 'Test'),
+    ])
+    test_fraction = forms.FloatField(min_value=0, max_value=1,
+        required=False)
+    seed = forms.IntegerField(min_value=0, required=False)
+    ladder_id = forms.IntegerField(label='Ladder ID', required=False)
+    template_id = forms.IntegerField(label='Template ID', required=False)
+    min_turn_number = forms.IntegerField(required=False, min_value=-1)
+    max_turn_number = forms.IntegerField(required=False, min_value=-1)
+
+
+class WinProbabilityForm(forms.Form):
+    template_id = forms.IntegerField()
+    turn_number = forms.IntegerField(min_value=-1)
+    income_diff = forms.IntegerField()
+    army_diff = forms.IntegerField()
+
+
+class OrderNgramsForm(forms.Form):
+    prefix = forms.CharField(required=False)
+    length = forms.IntegerField(min_value=1, max_value=3, required=False)
+    limit = forms.IntegerField(min_value=1, max_value=1000, required=False)
+
+
+class SimilarGamesForm(forms.Form):
+    turns = forms.IntegerField(min_value=1, required=False)
+    k = forms.IntegerField(min_value=1, max_value=1000, required=False)
+    approximate = forms.BooleanField(required=False)
@@ -3,12 +3,21 @@ import logging
 from datetime import datetime
 from json import loads as json_loads
 from pytz import UTC
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Type
 from urllib.error import URLError
 
+from django.db import transaction
+from django.db.models import Max, Model
+from django.utils import timezone
+
 from . import api
 from . import cache
+from . import luck_statistics
+from . import matchups
+from . import openings
+from . import player_statistics
 from .models import *
+from .progress import ProgressCallback, report
 
 
 # Tuple of custom argument for the settings of each card type
@@ -64,6 +73,19 @@ orders_to_save: List[Order] = []
 attack_results_to_save: List[AttackResult] = []
 
 
+# Get the number of objects waiting in each save queue
+def _get_queue_depths() -> Dict[str, int]:
+    return {
+        'games': len(games_to_save) + len(games_to_update),
+        'player_accounts': len(player_accounts_to_save),
+        'territory_baselines': len(territory_baselines_to_save),
+        'players': len(players_to_save),
+        'turns': len(turns_to_save),
+        'orders': len(orders_to_save),
+        'attack_results': len(attack_results_to_save),
+    }
+
+
 # Clear lists of objects to save
 def _clear_save_queue() -> None:
     games_to_save.clear()
@@ -76,16 +98,54 @@ def _clear_save_queue() -> None:
     attack_results_to_save.clear()
 
 
+# Assign consecutive integer keys following the largest key in the DB to new
+# objects of a model. Must be called in a transaction that has already written
+# to the DB, so that no other process can take the same keys before they are
+# saved
+def _assign_keys(model: Type[Model], objects: Sequence[Model]) -> None:
+    largest_key = model.objects.aggregate(largest_key=Max('id'))['largest_key']
+    for key, model_object in enumerate(objects, (largest_key or 0) + 1):
+        model_object.id = key
+
+
+# Copy the keys of related objects that were assigned after these objects were
+# created into their foreign key columns
+def _set_foreign_keys(objects: Sequence[Model]) -> None:
+    for model_object in objects:
+        for field in model_object._meta.concrete_fields:
+            if field.is_relation and field.is_cached(model_object):
+                related_object = field.get_cached_value(model_object)
+                if related_object is not None:
+                    setattr(model_object, field.attname, related_object.pk)
+
+
 # Save game and associated objects
 def _save_games_in_queue() -> None:
-    Game.objects.bulk_create(games_to_save)
-    Game.objects.bulk_update(games_to_update, ['ladder'])
-    PlayerAccount.objects.bulk_create(player_accounts_to_save)
-    TerritoryBaseline.objects.bulk_create(territory_baselines_to_save)
-    Player.objects.bulk_create(players_to_save)
-    Turn.objects.bulk_create(turns_to_save)
-    Order.objects.bulk_create(orders_to_save)
-    AttackResult.objects.bulk_create(attack_results_to_save)
+    with transaction.atomic():
+        # Saving the Games first locks the DB for writing before keys are
+        # assigned
+        Game.objects.bulk_create(games_to_save)
+        Game.objects.bulk_update(games_to_update, ['ladder'])
+        PlayerAccount.objects.bulk_create(player_accounts_to_save)
+
+        # Assign keys to the objects that are referenced by other new objects
+        _assign_keys(Player, players_to_save)
+        _assign_keys(Turn, turns_to_save)
+        _assign_keys(Order, orders_to_save)
+        _set_foreign_keys(orders_to_save)
+        _set_foreign_keys(attack_results_to_save)
+
+        TerritoryBaseline.objects.bulk_create(territory_baselines_to_save)
+        Player.objects.bulk_create(players_to_save)
+        Turn.objects.bulk_create(turns_to_save)
+        Order.objects.bulk_create(orders_to_save)
+        AttackResult.objects.bulk_create(attack_results_to_save)
+        player_statistics.add_imported_games(players_to_save,
+            attack_results_to_save)
+        matchups.add_imported_games(players_to_save)
+        openings.add_imported_games(territory_baselines_to_save,
+            attack_results_to_save)
+        luck_statistics.add_attack_results(attack_results_to_save)
 
 
 # Fetches PlayerAccount from DB if it exists. Otherwise creates PlayerAccount
@@ -135,6 +195,7 @@ def _import_territories_and_bonuses(map: Map, territories_node: dict,
         territories[territory.api_id] = territory
     
     # Save Territories to DB
+    _assign_keys(Territory, list(territories.values()))
     Territory.objects.bulk_create(list(territories.values()))
 
     # Import connected territories to the DB for each Territory in the Map
@@ -187,12 +248,13 @@ def get_map(map_node: dict) -> Map:
     except Map.DoesNotExist:
         # Otherwise, create map and save it to the DB
         logging.info(f'Creating Map {map_id}')
-        map = Map(id=map_id, name=map_node['name'])
-        map.save()
-        
-        # Import Territories and Bonuses
-        _import_territories_and_bonuses(map, map_node['territories'],
-            map_node['bonuses'])
+        with transaction.atomic():
+            map = Map(id=map_id, name=map_node['name'])
+            map.save()
+
+            # Import Territories and Bonuses
+            _import_territories_and_bonuses(map, map_node['territories'],
+                map_node['bonuses'])
 
         cache.add_map_to_cache(map_id, True)
         return map
@@ -410,6 +472,7 @@ def _parse_pick_order(territory: Territory, turn: Turn, order_number: int,
         is_auto_pick: bool, player: Player, is_successful: bool,
         initial_armies: int) -> None:
     order = Order(
+        game = turn.game,
         turn = turn,
         order_number = order_number,
         order_type = cache.get_order_type(
@@ -432,6 +495,7 @@ def _parse_pick_order(territory: Territory, turn: Turn, order_number: int,
 def _parse_basic_order(turn: Turn, order_number: int,
         order_node: dict) -> None:
     order = Order(
+        game = turn.game,
         turn = turn,
         order_number = order_number,
         order_type = cache.get_order_type(order_node['type']),
@@ -444,6 +508,7 @@ def _parse_basic_order(turn: Turn, order_number: int,
 def _parse_deploy_order(turn: Turn, map_id: int, order_number: int,
         order_node: dict) -> None:
     order = Order(
+        game = turn.game,
         turn = turn,
         order_number = order_number,
         order_type = cache.get_order_type(order_node['type']),
@@ -459,6 +524,7 @@ def _parse_deploy_order(turn: Turn, map_id: int, order_number: int,
 def _parse_attack_transfer_order(turn: Turn, map_id: int, order_number: int,
         order_node: dict) -> None:
     order = Order(
+        game=turn.game,
         turn=turn,
         order_number=order_number,
         order_type = cache.get_order_type(order_node['type']),
@@ -492,6 +558,7 @@ def _parse_attack_transfer_order(turn: Turn, map_id: int, order_number: int,
 def _parse_basic_play_card_order(turn: Turn, order_number: int,
         order_node: dict) -> None:
     order = Order(
+        game = turn.game,
         turn=turn,
         order_number = order_number,
         order_type = cache.get_order_type(order_node['type']),
@@ -505,6 +572,7 @@ def _parse_basic_play_card_order(turn: Turn, order_number: int,
 def _parse_blockade_order(turn: Turn, map_id: int, order_number: int,
         order_node: dict) -> None:
     order = Order(
+        game = turn.game,
         turn=turn,
         order_number = order_number,
         order_type = cache.get_order_type(order_node['type']),
@@ -592,6 +660,7 @@ def _parse_turns(game: Game, map_id: int, game_json: dict) -> None:
             game = game,
             turn_number = turn_number,
             commit_date_time = commit_date_time)
+        game.end_date_time = commit_date_time
     
         _parse_orders(turn, map_id, turn_node['orders'])
 
@@ -714,11 +783,65 @@ def import_game(email: str, api_token: str, game_id: int) -> Optional[Game]:
         return game
 
 
+# Import the Games of a page of a Ladder that do not yet exist and save them.
+# Reports a 'game' event for each Game and a 'page' event for the page to
+# progress. Returns the counts of Games processed and imported so far
+def _import_ladder_page(email: str, api_token: str, ladder: Ladder,
+        game_ids: List[int], offset: int, imported_games_count: int,
+        successful_imported_games_count: int,
+        progress: Optional[ProgressCallback]) -> Tuple[int, int]:
+    # Clear save queue
+    _clear_save_queue()
+
+    # Import each game if it does not yet exist
+    try:
+        for game_id in game_ids:
+            if _parse_ladder_game(email, api_token, game_id,
+                    imported_games_count, ladder):
+                successful_imported_games_count += 1
+            imported_games_count += 1
+            report(progress, 'game', game_id=game_id,
+                games_processed=imported_games_count,
+                games_imported=successful_imported_games_count,
+                queue_depths=_get_queue_depths(),
+                cache_hit_rates=cache.get_hit_rates())
+    except URLError as e:
+        raise URLError(
+            f'Connection failed getting game data for game {game_id} '
+            f'after importing {imported_games_count} games.'
+        ) from e
+
+    # Save Games to DB
+    queue_depths = _get_queue_depths()
+    _save_games_in_queue()
+    report(progress, 'page', offset=offset,
+        games_processed=imported_games_count,
+        games_imported=successful_imported_games_count,
+        queue_depths=queue_depths,
+        cache_hit_rates=cache.get_hit_rates())
+
+    return imported_games_count, successful_imported_games_count
+
+
+# Retrieve a page of game ids of a Ladder
+def _get_ladder_page(ladder_id: int, offset: int, max_results: int,
+        imported_games_count: int) -> List[int]:
+    try:
+        return api.get_ladder_game_ids(ladder_id, offset, max_results)
+    except URLError as e:
+        raise URLError(
+            f'Connection failed getting ladder games at offset {offset} '
+            f'after importing {imported_games_count} games.'
+        ) from e
+
+
 # Imports max_results Games (and associated data) from the specified ladder
 # starting from offset. For each Game, does nothing if the Game already exists
-# Return the count of games imported
+# Reports a 'game' event for each Game and a 'page' event for each page of
+# Games to progress. Return the count of games imported
 def import_ladder_games(email: str, api_token: str, ladder_id: int,
-        max_results: int, offset: int, games_per_page: int) -> int:
+        max_results: int, offset: int, games_per_page: int,
+        progress: Optional[ProgressCallback] = None) -> int:
     results_left_to_get = max_results
     imported_games_count = 0
     successful_imported_games_count = 0
@@ -737,39 +860,79 @@ def import_ladder_games(email: str, api_token: str, ladder_id: int,
             f'ladder {ladder}: Offset {offset}.'
         )
 
-        try:
-            game_ids = api.get_ladder_game_ids(ladder_id, offset,
-                results_left_to_get)
-        except URLError as e:
-            raise URLError(
-                f'Connection failed getting ladder games at offset {offset} '
-                f'after importing {imported_games_count} games.'
-            ) from e
-        
+        game_ids = _get_ladder_page(ladder_id, offset, results_left_to_get,
+            imported_games_count)
+
         # If game_ids empty break
         if not game_ids:
             return imported_games_count
 
-        # Clear save queue
-        _clear_save_queue()
-        
-        # Import each game if it does not yet exist
-        try:
-            for game_id in game_ids:
-                if _parse_ladder_game(email, api_token, game_id,
-                        imported_games_count, ladder):
-                    successful_imported_games_count += 1
-                imported_games_count += 1
-        except URLError as e:
-            raise URLError(
-                f'Connection failed getting game data for game {game_id} '
-                f'after importing {imported_games_count} games.'
-            ) from e
-
-        # Save Games to DB
-        _save_games_in_queue()
+        imported_games_count, successful_imported_games_count = (
+            _import_ladder_page(email, api_token, ladder, game_ids, offset,
+                imported_games_count, successful_imported_games_count,
+                progress))
 
         results_left_to_get -= len(game_ids)
         offset +=games_per_page
     
     return successful_imported_games_count
+
+
+# Imports the Games of a Ladder added since its last sync. Pages of the
+# Ladder's Games are read and the Games of each page not in the DB are
+# imported, until a page has no Game that is new. Games finish out of id
+# order, so a Game is new unless it is in the DB or at or below the
+# high-water mark, the newest Game seen by the last sync. The mark is only a
+# hint that stops Games ignored by earlier syncs from making a sync read every
+# page, and is only moved once every new Game is imported, so a failed sync
+# is retried from the old mark. Reports a 'game' event for each Game and a
+# 'page' event for each page of Games to progress. Returns the count of games
+# imported
+def sync_ladder_games(email: str, api_token: str, ladder_id: int,
+        games_per_page: int = 50,
+        progress: Optional[ProgressCallback] = None) -> int:
+    ladder = cache.get_ladder(ladder_id)
+    sync_state = (LadderSyncState.objects.filter(ladder=ladder).first()
+        or LadderSyncState(ladder=ladder))
+    newest_game_id = sync_state.newest_game_id
+    imported_games_count = 0
+    successful_imported_games_count = 0
+    offset = 0
+
+    logging.info(
+        f'Syncing ladder {ladder} from game {sync_state.newest_game_id}')
+
+    while True:
+        game_ids = _get_ladder_page(ladder_id, offset, games_per_page,
+            imported_games_count)
+        existing_game_ids = set(
+            Game.objects
+                .filter(pk__in=game_ids)
+                .values_list('id', flat=True)
+        )
+        missing_game_ids = [game_id for game_id in game_ids
+            if game_id not in existing_game_ids]
+
+        if missing_game_ids:
+            imported_games_count, successful_imported_games_count = (
+                _import_ladder_page(email, api_token, ladder,
+                    missing_game_ids, offset, imported_games_count,
+                    successful_imported_games_count, progress))
+
+        # Stop at the first page that is empty or has no new Game
+        newest_game_id = max([newest_game_id] + game_ids)
+        if not any(game_id > sync_state.newest_game_id
+                for game_id in missing_game_ids):
+            break
+        offset += games_per_page
+
+    sync_state.newest_game_id = newest_game_id
+    sync_state.synced_date_time = timezone.now()
+    sync_state.games_imported += successful_imported_games_count
+    sync_state.save()
+
+    logging.info(
+        f'Synced ladder {ladder} to game {newest_game_id}. Imported '
+        f'{successful_imported_games_count} games'
+    )
+    return successful_imported_games_count
@@ -0,0 +1,393 @@
+import json
+import logging
+import os
+import socket
+import traceback
+
+from datetime import timedelta
+from time import monotonic, sleep
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from . import cache
+from .calculate_game_data import calculate_game_data
+from .import_games import import_ladder_games, sync_ladder_games
+from .models import Job, JobEvent
+from .ngrams import build_order_ngrams
+from .progress import ProgressCallback
+from .ratings import update_ratings
+
+IMPORT_LADDER_GAMES = 'ImportLadderGames'
+SYNC_LADDER_GAMES = 'SyncLadderGames'
+CALCULATE_GAME_DATA = 'CalculateGameData'
+UPDATE_RATINGS = 'UpdateRatings'
+BUILD_ORDER_NGRAMS = 'BuildOrderNgrams'
+
+# Minimum number of seconds between progress updates saved to the DB
+PROGRESS_UPDATE_INTERVAL = 1.0
+
+# Number of seconds between polls for new events of a job being streamed
+EVENT_POLL_INTERVAL = 0.5
+
+# Number of seconds after which a comment is streamed to keep the connection
+# open while no events are reported
+EVENT_HEARTBEAT_INTERVAL = 15.0
+
+# Job types of which only one job may run at a time. Calculation jobs read
+# the same batch of uncalculated games, so two of them would replay the same
+# games
+SERIAL_JOB_TYPES = [CALCULATE_GAME_DATA]
+
+# Seconds without any event after which a running job whose worker cannot be
+# checked is considered abandoned and queued again
+STALE_JOB_TIMEOUT = 6 * 60 * 60.0
+
+# Days for which the progress events of a finished job are kept. Only its
+# status events are kept after that
+JOB_EVENT_RETENTION_DAYS = 7
+
+# Job parameters that are removed once a job is done
+SECRET_PARAMETERS = ['api_token']
+
+
+# Import ladder games for a job. Returns the result message
+def _run_import_ladder_games(progress: ProgressCallback, email: str,
+        api_token: str, ladder_id: int, max_results: int, offset: int,
+        games_per_page: int = 50) -> str:
+    count = import_ladder_games(email, api_token, ladder_id, max_results,
+        offset, games_per_page, progress)
+    return f'Imported {count} games out of {max_results}.'
+
+
+# Sync the games of a ladder for a job. Returns the result message
+def _run_sync_ladder_games(progress: ProgressCallback, email: str,
+        api_token: str, ladder_id: int, games_per_page: int = 50) -> str:
+    count = sync_ladder_games(email, api_token, ladder_id, games_per_page,
+        progress)
+    return f'Imported {count} new games.'
+
+
+# Calculate game data for a job. Returns the result message
+def _run_calculate_game_data(progress: ProgressCallback,
+        max_results: int, batch_size: int,
+        record_territory_history: bool = False) -> str:
+    count = calculate_game_data(max_results, batch_size,
+        record_territory_history, progress)
+
+    # All games must have been handled
+    all_games_processed = count < max_results
+    return (
+        f'Calculated game data for {count} games. '
+        f'There are {"no " if all_games_processed else ""}more games '
+        f'to be processed.'
+    )
+
+
+# Update the ratings of Player Accounts for a job. Returns the result message
+def _run_update_ratings(progress: ProgressCallback,
+        rebuild: bool = False) -> str:
+    count = update_ratings(rebuild=rebuild, progress=progress)
+    return f'Applied {count} games to the ratings.'
+
+
+# Build the order n-gram index of a Map for a job. Returns the result message
+def _run_build_order_ngrams(progress: ProgressCallback, map_id: int,
+        workers: int = 1) -> str:
+    index = build_order_ngrams(map_id, workers, progress=progress)
+    return (
+        f'Counted {len(index.keys)} distinct order n-grams in '
+        f'{index.game_count} games of Map {map_id}.'
+    )
+
+
+# Functions that run each type of job
+JOB_FUNCTIONS: Dict[str, Callable[..., str]] = {
+    IMPORT_LADDER_GAMES: _run_import_ladder_games,
+    SYNC_LADDER_GAMES: _run_sync_ladder_games,
+    CALCULATE_GAME_DATA: _run_calculate_game_data,
+    UPDATE_RATINGS: _run_update_ratings,
+    BUILD_ORDER_NGRAMS: _run_build_order_ngrams,
+}
+
+
+# Queue a job to be run by a worker
+def enqueue_job(job_type: str, items_total: int, **parameters: Any) -> Job:
+    job: Job = Job.objects.create(job_type=job_type,
+        items_total=items_total, parameters=json.dumps(parameters))
+    logging.info(f'Queued {job}')
+    return job
+
+
+# Get the name identifying this worker process
+def _get_worker_name() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+# Get whether the process of a worker is known to have stopped. Only workers
+# on this host can be checked
+def _is_worker_stopped(worker: str) -> bool:
+    host, _, pid = worker.rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+# Queue running jobs again whose worker has stopped, or which have reported
+# no event since the stale job timeout
+def _requeue_stale_jobs() -> None:
+    stale_time = timezone.now() - timedelta(seconds=STALE_JOB_TIMEOUT)
+    running_jobs = (
+        Job.objects
+            .filter(status=Job.RUNNING)
+            .annotate(last_event_date_time=Max('jobevent__created_date_time'))
+    )
+
+    for job in running_jobs:
+        last_active_time = job.last_event_date_time or job.started_date_time
+        if not (_is_worker_stopped(job.worker)
+                or (last_active_time and last_active_time < stale_time)):
+            continue
+
+        # Only requeue the job if it is still run by the same worker
+        is_requeued = Job.objects.filter(pk=job.id, status=Job.RUNNING,
+            worker=job.worker, started_date_time=job.started_date_time
+        ).update(status=Job.QUEUED, worker='', started_date_time=None,
+            items_processed=0)
+        if is_requeued:
+            JobEvent.objects.create(job=job, event='status',
+                data=json.dumps({'status': Job.QUEUED,
+                    'result': f'Requeued after worker {job.worker} stopped'}))
+            logging.warning(f'Requeued {job} of worker {job.worker}')
+
+
+# Get whether a claimed job of a serial job type must wait for another
+# running job of its type. Of jobs claimed at the same time, the one started
+# first, or with the smallest id, runs
+def _is_blocked(job: Job) -> bool:
+    is_blocked: bool = (
+        Job.objects
+            .filter(job_type=job.job_type, status=Job.RUNNING)
+            .exclude(pk=job.id)
+            .filter(
+                Q(started_date_time__lt=job.started_date_time)
+                | Q(started_date_time=job.started_date_time, id__lt=job.id)
+            )
+            .exists()
+    )
+    return is_blocked
+
+
+# Claim the oldest queued job for this worker. The status update only
+# succeeds for one worker, so each job is run once. Jobs of serial job types
+# are skipped while another job of their type is running
+def _claim_next_job() -> Optional[Job]:
+    running_job_types = set(
+        Job.objects
+            .filter(status=Job.RUNNING, job_type__in=SERIAL_JOB_TYPES)
+            .values_list('job_type', flat=True)
+    )
+    queued_jobs = (
+        Job.objects
+            .filter(status=Job.QUEUED)
+            .exclude(job_type__in=running_job_types)
+            .order_by('id')
+            .values_list('id', 'job_type')[:10]
+    )
+
+    for job_id, job_type in queued_jobs:
+        is_claimed = Job.objects.filter(pk=job_id, status=Job.QUEUED).update(
+            status=Job.RUNNING,
+            worker=_get_worker_name(),
+            started_date_time=timezone.now()
+        )
+        if not is_claimed:
+            continue
+
+        job: Job = Job.objects.get(pk=job_id)
+        if job_type in SERIAL_JOB_TYPES and _is_blocked(job):
+            # Another worker claimed a job of the same type first
+            Job.objects.filter(pk=job_id, status=Job.RUNNING).update(
+                status=Job.QUEUED, worker='', started_date_time=None)
+            continue
+
+        return job
+
+    return None
+
+
+# Create the progress callback of a job, which records each event with the
+# games processed per second. Per-game events are saved in bulk at most once
+# per update interval, along with the number of games processed. Events
+# not saved yet are left in events_to_save
+def _get_progress_callback(job: Job,
+        events_to_save: List[JobEvent]) -> ProgressCallback:
+    start_time = monotonic()
+    last_update_time = start_time
+
+    def progress(event: str, data: Dict[str, Any]) -> None:
+        nonlocal last_update_time
+
+        if 'games_processed' in data:
+            job.items_processed = data['games_processed']
+            elapsed_seconds = monotonic() - start_time
+            if elapsed_seconds > 0:
+                data['games_per_second'] = (
+                    job.items_processed / elapsed_seconds)
+
+        events_to_save.append(JobEvent(job=job, event=event,
+            data=json.dumps(data)))
+
+        if (event != 'game'
+                or monotonic() - last_update_time >= PROGRESS_UPDATE_INTERVAL):
+            JobEvent.objects.bulk_create(events_to_save)
+            events_to_save.clear()
+            Job.objects.filter(pk=job.id).update(
+                items_processed=job.items_processed)
+            last_update_time = monotonic()
+
+    return progress
+
+
+# Delete the progress events of jobs that finished before the retention
+# period
+def _prune_job_events() -> None:
+    finished_before = (
+        timezone.now() - timedelta(days=JOB_EVENT_RETENTION_DAYS))
+    deleted_count, _ = (
+        JobEvent.objects
+            .filter(job__status__in=[Job.FINISHED, Job.FAILED],
+                job__finished_date_time__lt=finished_before)
+            .exclude(event='status')
+            .delete()
+    )
+    if deleted_count:
+        logging.info(f'Deleted {deleted_count} old job events')
+
+
+# Run a claimed job and save its result or error
+def run_job(job: Job) -> None:
+    logging.info(f'Running {job}')
+    cache.reset_hit_counts()
+    events_to_save: List[JobEvent] = []
+
+    try:
+        job.result = JOB_FUNCTIONS[job.job_type](
+            _get_progress_callback(job, events_to_save),
+            **json.loads(job.parameters))
+        job.status = Job.FINISHED
+    except Exception:
+        logging.exception(f'{job} failed')
+        job.error = traceback.format_exc()
+        job.status = Job.FAILED
+    finally:
+        # Save the events reported since the last update
+        JobEvent.objects.bulk_create(events_to_save)
+
+    JobEvent.objects.create(job=job, event='status',
+        data=json.dumps({'status': job.status, 'result': job.result}))
+    job.finished_date_time = timezone.now()
+
+    # Secrets such as API tokens are only kept while the job may run
+    parameters = json.loads(job.parameters)
+    for name in SECRET_PARAMETERS:
+        parameters.pop(name, None)
+    job.parameters = json.dumps(parameters)
+
+    job.save(update_fields=['status', 'items_processed', 'result', 'error',
+        'finished_date_time', 'parameters'])
+    logging.info(f'Finished {job}')
+    _prune_job_events()
+
+
+# Run queued jobs until there are none left if exit_when_empty is set, or
+# forever otherwise
+def run_worker(poll_interval: float, exit_when_empty: bool = False) -> None:
+    logging.info(f'Starting job worker {_get_worker_name()}')
+
+    while True:
+        _requeue_stale_jobs()
+        job = _claim_next_job()
+        if job:
+            run_job(job)
+        elif exit_when_empty:
+            return
+        else:
+            sleep(poll_interval)
+
+
+# Get the status of a job
+def get_job_status(job: Job) -> Dict[str, Any]:
+    return {
+        'id': job.id,
+        'job_type': job.job_type,
+        'status': job.status,
+        'worker': job.worker,
+        'items_total': job.items_total,
+        'items_processed': job.items_processed,
+        'items_per_second': job.get_items_per_second(),
+        'seconds_remaining': job.get_seconds_remaining(),
+        'created_date_time': job.created_date_time,
+        'started_date_time': job.started_date_time,
+        'finished_date_time': job.finished_date_time,
+        'result': job.result,
+        'error': job.error,
+    }
+
+
+# Format an event as a server-sent event message
+def _format_server_sent_event(job_event: JobEvent) -> str:
+    return (
+        f'id: {job_event.id}\n'
+        f'event: {job_event.event}\n'
+        f'data: {job_event.data}\n\n'
+    )
+
+
+# Stream the events of a job after last_event_id as server-sent event
+# messages, until the job has finished and all of its events have been sent.
+# Stops if the job does not exist
+def stream_job_events(job_id: int, last_event_id: int = 0) -> Iterator[str]:
+    # Tell the client how long to wait before reconnecting
+    yield f'retry: {int(EVENT_HEARTBEAT_INTERVAL * 1000)}\n\n'
+    last_sent_time = monotonic()
+
+    while True:
+        # Read the status before the events so that no event saved before the
+        # job finished can be missed
+        status = (
+            Job.objects
+                .filter(pk=job_id)
+                .values_list('status', flat=True)
+                .first()
+        )
+        if status is None:
+            return
+        is_job_done = status in [Job.FINISHED, Job.FAILED]
+        job_events = list(
+            JobEvent.objects
+                .filter(job_id=job_id, id__gt=last_event_id)
+                .order_by('id')
+        )
+
+        for job_event in job_events:
+            yield _format_server_sent_event(job_event)
+            last_event_id = job_event.id
+            last_sent_time = monotonic()
+
+        if is_job_done:
+            return
+
+        if monotonic() - last_sent_time >= EVENT_HEARTBEAT_INTERVAL:
+            yield ': heartbeat\n\n'
+            last_sent_time = monotonic()
+
+        sleep(EVENT_POLL_INTERVAL)
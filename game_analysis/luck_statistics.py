@@ -0,0 +1,233 @@
+import logging
+import numpy as np
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type
+
+from django.db import transaction
+
+from .cache import get_combat_tables
+from .export import iterate_chunks
+from .models import AttackResult, LuckStatistics, PlayerLuckStatistics
+from .models import PlayerStatistics, Template, TemplateLuckStatistics
+from .player_statistics import add_luck_sums
+
+LUCK_STATISTICS_FIELDS = ['attacks'] + [
+    f'{metric}_{moment}'
+    for metric in LuckStatistics.METRICS for moment in ['mean', 'm2']
+]
+
+# Ladder id of the attacks of Games that are not on a Ladder
+NO_LADDER_ID = -1
+
+# Count, mean and sum of squared differences from the mean of each metric of
+# the attacks with each key
+Moments = Tuple[np.ndarray, Dict[str, np.ndarray], Dict[str, np.ndarray]]
+
+
+# Get the moments of each metric of attacks grouped by key
+def _get_moments(keys: np.ndarray,
+        metrics: Dict[str, np.ndarray]) -> Tuple[np.ndarray, Moments]:
+    unique_keys, key_indices = np.unique(keys, return_inverse=True)
+    counts = np.bincount(key_indices)
+    means: Dict[str, np.ndarray] = {}
+    m2s: Dict[str, np.ndarray] = {}
+
+    for metric, values in metrics.items():
+        means[metric] = np.bincount(key_indices, weights=values) / counts
+        m2s[metric] = np.bincount(key_indices,
+            weights=(values - means[metric][key_indices]) ** 2)
+
+    return unique_keys, (counts, means, m2s)
+
+
+# Merge the moments of a batch of attacks into the stored statistics of each
+# key, using the parallel form of Welford's algorithm. Must be called in a
+# transaction that has already written to the DB, which stops concurrent
+# imports from updating the same rows
+def _merge_moments(model: Type[LuckStatistics], key_field: str,
+        keys: np.ndarray, moments: Moments) -> None:
+    counts, means, m2s = moments
+    existing_statistics = model.objects.in_bulk(keys.tolist())
+
+    statistics_to_update: List[LuckStatistics] = []
+    statistics_to_create: List[LuckStatistics] = []
+    for i, key in enumerate(keys.tolist()):
+        statistics = existing_statistics.get(key)
+        if statistics:
+            statistics_to_update.append(statistics)
+        else:
+            statistics = model(**{key_field: key})
+            statistics_to_create.append(statistics)
+
+        count = statistics.attacks + counts[i]
+        for metric in LuckStatistics.METRICS:
+            mean = getattr(statistics, f'{metric}_mean')
+            delta = means[metric][i] - mean
+            setattr(statistics, f'{metric}_mean',
+                float(mean + delta * counts[i] / count))
+            setattr(statistics, f'{metric}_m2', float(
+                getattr(statistics, f'{metric}_m2') + m2s[metric][i]
+                + delta ** 2 * statistics.attacks * counts[i] / count))
+        statistics.attacks = int(count)
+
+    model.objects.bulk_update(statistics_to_update, LUCK_STATISTICS_FIELDS)
+    model.objects.bulk_create(statistics_to_create)
+
+
+# Add the offense and defense luck of a batch of attacks to the luck sums of
+# the Player Statistics of each Player Account, Ladder and Template
+def _add_luck_sums(attacks: np.ndarray) -> None:
+    keys, key_indices = np.unique(attacks[:, :3].astype(np.int64), axis=0,
+        return_inverse=True)
+    key_indices = key_indices.reshape(-1)
+    offense_luck_sums = np.bincount(key_indices, weights=attacks[:, 3])
+    defense_luck_sums = np.bincount(key_indices, weights=attacks[:, 4])
+
+    add_luck_sums({
+        (player_account_id,
+            None if ladder_id == NO_LADDER_ID else ladder_id, template_id):
+            (float(offense_luck_sums[i]), float(defense_luck_sums[i]))
+        for i, (player_account_id, ladder_id, template_id)
+            in enumerate(keys.tolist())
+    })
+
+
+# Add a batch of attacks to the Player and Template luck statistics and the
+# luck sums of the Player Statistics. Each attack is a row of Player Account
+# id, Ladder id, Template id, offense luck, defense luck, defending armies
+# killed and attack size
+def _add_attacks(attacks: np.ndarray) -> None:
+    if not len(attacks):
+        return
+
+    metrics = {
+        'offense_luck': attacks[:, 3],
+        'defense_luck': attacks[:, 4],
+        'kill_efficiency': attacks[:, 5] / attacks[:, 6],
+    }
+
+    player_account_ids, moments = _get_moments(
+        attacks[:, 0].astype(np.int64), metrics)
+    _merge_moments(PlayerLuckStatistics, 'player_account_id',
+        player_account_ids, moments)
+
+    template_ids, moments = _get_moments(
+        attacks[:, 2].astype(np.int64), metrics)
+    _merge_moments(TemplateLuckStatistics, 'template_id', template_ids,
+        moments)
+
+    _add_luck_sums(attacks)
+
+
+# Get the Ladder id of the attacks of a Game
+def _get_ladder_id(ladder_id: Optional[int]) -> int:
+    return NO_LADDER_ID if ladder_id is None else ladder_id
+
+
+# Add newly imported attacks to the luck statistics. Picks and transfers are
+# not attacks and have no luck
+def add_attack_results(attack_results: Iterable[AttackResult]) -> None:
+    _add_attacks(np.array(
+        [
+            (
+                attack_result.order.player.player_id,
+                _get_ladder_id(attack_result.order.game.ladder_id),
+                attack_result.order.game.template_id,
+                attack_result.offense_luck,
+                attack_result.defense_luck or 0,
+                attack_result.defending_armies_killed,
+                attack_result.attack_size
+            )
+            for attack_result in attack_results
+            if attack_result.is_attack
+                and attack_result.offense_luck is not None
+                and attack_result.attack_size
+        ],
+        dtype=np.float64
+    ).reshape(-1, 7))
+
+
+# Rebuild the luck statistics and the luck sums of the Player Statistics
+# from all imported attacks, streaming them from the DB in chunks
+def rebuild_luck_statistics(chunk_size: int = 100000) -> None:
+    logging.info('Rebuilding luck statistics')
+    attacks = (
+        AttackResult.objects
+            .filter(is_attack=True, offense_luck__isnull=False,
+                attack_size__gt=0)
+            .values_list('order__player__player_id',
+                'order__game__ladder_id', 'order__game__template_id',
+                'offense_luck', 'defense_luck', 'defending_armies_killed',
+                'attack_size')
+    )
+
+    with transaction.atomic():
+        PlayerLuckStatistics.objects.all().delete()
+        TemplateLuckStatistics.objects.all().delete()
+        PlayerStatistics.objects.update(offense_luck_sum=0,
+            defense_luck_sum=0)
+
+        for chunk in iterate_chunks(attacks, chunk_size):
+            _add_attacks(np.array(
+                [
+                    (player_account_id, _get_ladder_id(ladder_id),
+                        template_id, offense_luck, defense_luck or 0,
+                        defending_armies_killed, attack_size)
+                    for player_account_id, ladder_id, template_id,
+                        offense_luck, defense_luck, defending_armies_killed,
+                        attack_size in chunk
+                ],
+                dtype=np.float64
+            ))
+
+
+# Get the attack count, mean and standard deviation of each metric of luck
+# statistics
+def get_luck_statistics(
+        statistics: Optional[LuckStatistics]) -> Dict[str, Any]:
+    if not statistics:
+        return {'attacks': 0}
+
+    result: Dict[str, Any] = {'attacks': statistics.attacks}
+    for metric in LuckStatistics.METRICS:
+        variance = statistics.get_variance(metric)
+        result[metric] = {
+            'mean': getattr(statistics, f'{metric}_mean'),
+            'standard_deviation': (
+                None if variance is None else variance ** 0.5),
+        }
+    return result
+
+
+# Compare the attacking armies killed in the recorded successful attacks of a
+# Template with the expected number from its combat tables. Defenders are only
+# known for successful attacks, where all of them were killed. Attacks are
+# streamed from the DB in chunks and compared a chunk at a time
+def compare_successful_attacks(template: Template,
+        chunk_size: int = 100000) -> Dict[str, Any]:
+    attacks = (
+        AttackResult.objects
+            .filter(order__game__template_id=template.id, is_attack=True,
+                is_successful=True, attack_size__gt=0)
+            .values_list('attack_size', 'defending_armies_killed',
+                'attacking_armies_killed')
+    )
+
+    attack_count = 0
+    attacking_armies_killed = 0
+    expected_attacking_armies_killed = 0.0
+    for chunk in iterate_chunks(attacks, chunk_size):
+        rows = np.array(chunk, dtype=np.int64)
+        tables = get_combat_tables(template, int(rows[:, :2].max()))
+        _, expected_kills = tables.get_expected_kills(rows[:, 0], rows[:, 1])
+
+        attack_count += len(rows)
+        attacking_armies_killed += int(rows[:, 2].sum())
+        expected_attacking_armies_killed += float(expected_kills.sum())
+
+    return {
+        'template_id': template.id,
+        'attacks': attack_count,
+        'attacking_armies_killed': attacking_armies_killed,
+        'expected_attacking_armies_killed': expected_attacking_armies_killed,
+    }
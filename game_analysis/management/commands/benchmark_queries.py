@@ -0,0 +1,317 @@
+import os.path
+import random
+import statistics
+import tempfile
+
+from collections import defaultdict
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from ...calculate_game_data import INSERT_TURN_STATES_SQL, SELECT_GAMES_QUERY
+from ...calculate_game_data import _refresh_turn_states
+from ...models import Map, PlayerAccount, Template
+
+# Indexes created for analysis queries. Dropped to measure the baseline plans
+ANALYSIS_INDEXES = (
+    'player_game_end_state_idx',
+    'playerstate_game_covering_idx'
+)
+
+# Query behind the original game_analysis_turn_state view
+TURN_STATE_VIEW_SQL = '''
+    select
+        p1.end_state_id = 'Won' as p1_winner, g.id as game_id,
+        t.turn_number as turn_number,
+        s1.income as p1_income, s1.armies_on_board as p1_armies_on_board,
+        s2.income as p2_income, s2.armies_on_board as p2_armies_on_board
+    from
+        game_analysis_game g,
+        game_analysis_turn t,
+        game_analysis_player p1, game_analysis_player p2,
+        game_analysis_playerstate s1, game_analysis_playerstate s2
+    where
+        g.id = t.game_id and g.id = p1.game_id and g.id = p2.game_id
+        and s1.player_id = p1.id and s2.player_id = p2.id
+        and s1.turn_id = t.id and s2.turn_id = t.id
+        and p1.id < p2.id
+        and t.turn_number > -1
+        and (
+            p1.end_state_id in ('SurrenderAccepted', 'Eliminated')
+            or p2.end_state_id in ('SurrenderAccepted', 'Eliminated')
+        )
+'''
+
+PAGE_SIZE = 10000
+PLAYER_ACCOUNTS = 5000
+SYNTHETIC_ID = 1
+
+# Next primary key of each synthetic table
+next_keys: Dict[str, int] = defaultdict(lambda: 1)
+
+
+# Generate a new primary key for a synthetic row of a table
+def _new_key(table: str) -> int:
+    key = next_keys[table]
+    next_keys[table] += 1
+    return key
+
+
+# Insert rows, given as dictionaries of column names to values, into a table
+def _insert(table: str, rows: List[Dict[str, Any]]) -> None:
+    columns = list(rows[0].keys())
+    sql_statement = (
+        f'insert into {table} ({", ".join(columns)}) '
+        f'values ({", ".join(["%s"] * len(columns))})'
+    )
+
+    with connection.cursor() as c:
+        c.executemany(sql_statement,
+            [[row[column] for column in columns] for row in rows])
+
+
+# Create the synthetic Games, Players, Turns, Player States and Orders for a
+# range of Game ids
+def _generate_games(game_ids: Sequence[int], turns: int,
+        orders_per_turn: int, rng: random.Random) -> None:
+    games: List[Dict[str, Any]] = []
+    players: List[Dict[str, Any]] = []
+    turn_rows: List[Dict[str, Any]] = []
+    player_states: List[Dict[str, Any]] = []
+    orders: List[Dict[str, Any]] = []
+
+    for game_id in game_ids:
+        number_of_turns = rng.randint(turns // 2, turns * 3 // 2)
+        games.append({
+            'id': game_id,
+            'template_id': SYNTHETIC_ID,
+            'name': f'Synthetic Game {game_id}',
+            'number_of_turns': number_of_turns,
+            'version': 0
+        })
+
+        winner = rng.randrange(2)
+        game_players = [{
+            'id': _new_key('player'),
+            'game_id': game_id,
+            'player_id': SYNTHETIC_ID + 1 + rng.randrange(PLAYER_ACCOUNTS),
+            'end_state_id': 'Won' if index == winner else 'SurrenderAccepted'
+        } for index in range(2)]
+        players.extend(game_players)
+
+        for turn_number in range(-1, number_of_turns):
+            turn: Dict[str, Any] = {
+                'id': _new_key('turn'),
+                'game_id': game_id,
+                'turn_number': turn_number
+            }
+            turn_rows.append(turn)
+
+            for player in game_players:
+                income = 5 + rng.randrange(10)
+                player_states.append({
+                    'id': _new_key('playerstate'),
+                    'game_id': game_id,
+                    'turn_id': turn['id'],
+                    'turn_number': turn_number,
+                    'player_id': player['id'],
+                    'income': income,
+                    'armies_on_board': 10 + rng.randrange(100),
+                    'armies_deployed': income,
+                    'cumulative_armies_deployed': income * (turn_number + 1),
+                    'territories_controlled': 4 + rng.randrange(20),
+                    'bonuses_threatened': 0,
+                    'income_threatened': 0
+                })
+
+            for order_number in range(orders_per_turn):
+                orders.append({
+                    'id': _new_key('order'),
+                    'game_id': game_id,
+                    'turn_id': turn['id'],
+                    'order_number': order_number,
+                    'order_type_id': 'GameOrderDeploy',
+                    'player_id': game_players[order_number % 2]['id'],
+                    'armies': 1 + rng.randrange(5)
+                })
+
+    with transaction.atomic():
+        _insert('game_analysis_game', games)
+        _insert('game_analysis_player', players)
+        _insert('game_analysis_turn', turn_rows)
+        _insert('game_analysis_playerstate', player_states)
+        _insert('game_analysis_order', orders)
+
+
+class Command(BaseCommand):
+    help = (
+        'Builds a synthetic corpus in a scratch database and records '
+        'EXPLAIN QUERY PLAN output and timings for the analysis queries, '
+        'with and without the analysis indexes.'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--games', type=int, default=160000)
+        parser.add_argument('--turns', type=int, default=25,
+            help='Average number of turns per game')
+        parser.add_argument('--orders-per-turn', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=100,
+            help='Number of games per calculate_game_data batch')
+        parser.add_argument('--repeats', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--database',
+            default=os.path.join(tempfile.gettempdir(),
+                'warzone_benchmark.sqlite3'),
+            help='Path of the scratch database. It is deleted afterwards')
+        parser.add_argument('--skip-baseline', action='store_true',
+            help='Do not rerun the queries without the analysis indexes')
+
+    # Time a callable and return the fastest and median durations in seconds
+    def _time(self, function: Callable[[], object],
+            repeats: int) -> List[float]:
+        durations = []
+        for _ in range(repeats):
+            start_time = perf_counter()
+            function()
+            durations.append(perf_counter() - start_time)
+
+        return [min(durations), statistics.median(durations)]
+
+    # Write the query plan of a SQL statement
+    def _write_plan(self, sql_statement: str,
+            params: Optional[Sequence[object]] = None) -> None:
+        with connection.cursor() as c:
+            c.execute('explain query plan ' + sql_statement, params)
+            for row in c.fetchall():
+                self.stdout.write(f'        {row[-1]}')
+
+    # Time a SQL query and write its timings and query plan
+    def _benchmark_sql(self, name: str, sql_statement: str,
+            params: Sequence[object], repeats: int) -> None:
+        def run() -> None:
+            with connection.cursor() as c:
+                c.execute(sql_statement, params)
+                c.fetchall()
+
+        fastest, median = self._time(run, repeats)
+        self.stdout.write(
+            f'    {name}: min {fastest:.4f}s, median {median:.4f}s')
+        self._write_plan(sql_statement, params)
+
+    # Time the turn state refresh of a batch of Games without keeping it
+    def _benchmark_refresh(self, game_ids: List[int], repeats: int) -> None:
+        sql_statement = INSERT_TURN_STATES_SQL.format(
+            game_ids=', '.join(['%s'] * len(game_ids)))
+
+        def run() -> None:
+            with transaction.atomic():
+                with connection.cursor() as c:
+                    c.execute(sql_statement, game_ids)
+                transaction.set_rollback(True)
+
+        fastest, median = self._time(run, repeats)
+        self.stdout.write(
+            f'    turn state refresh ({len(game_ids)} games): '
+            f'min {fastest:.4f}s, median {median:.4f}s')
+        self._write_plan(sql_statement, game_ids)
+
+    # Time the SELECT_GAMES_QUERY prefetches and write each query's plan
+    def _benchmark_select_games(self, batch_size: int, repeats: int) -> None:
+        fastest, median = self._time(
+            lambda: list(SELECT_GAMES_QUERY.all()[:batch_size]), repeats)
+        self.stdout.write(
+            f'    SELECT_GAMES_QUERY ({batch_size} games): '
+            f'min {fastest:.4f}s, median {median:.4f}s')
+
+        with CaptureQueriesContext(connection) as context:
+            list(SELECT_GAMES_QUERY.all()[:batch_size])
+
+        for query in context.captured_queries:
+            self.stdout.write(f'      {query["sql"][:100]}...')
+            self._write_plan(query['sql'])
+
+    # Run every benchmark against the current schema
+    def _run_benchmarks(self, game_ids: List[int], batch_size: int,
+            repeats: int) -> None:
+        batch = game_ids[len(game_ids) // 2:][:batch_size]
+        game_id = batch[0]
+
+        self._benchmark_sql('turn state view page',
+            f'{TURN_STATE_VIEW_SQL} limit %s offset %s',
+            [PAGE_SIZE, PAGE_SIZE], repeats)
+        self._benchmark_sql('turn state table page',
+            'select * from game_analysis_turn_state limit %s offset %s',
+            [PAGE_SIZE, PAGE_SIZE], repeats)
+        self._benchmark_refresh(batch, repeats)
+        self._benchmark_sql('player end state lookup',
+            'select id from game_analysis_player '
+            'where game_id = %s and end_state_id = %s',
+            [game_id, 'Won'], repeats)
+        self._benchmark_sql('turns after picks lookup',
+            'select id, turn_number from game_analysis_turn '
+            'where game_id = %s and turn_number > -1 order by turn_number',
+            [game_id], repeats)
+        self._benchmark_select_games(batch_size, repeats)
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        rng = random.Random(options['seed'])
+        game_count = options['games']
+        batch_size = options['batch_size']
+        repeats = options['repeats']
+
+        connection.settings_dict['TEST']['NAME'] = options['database']
+        old_name = connection.creation.create_test_db(verbosity=0,
+            autoclobber=True, serialize=False)
+
+        try:
+            with connection.cursor() as c:
+                c.execute('pragma synchronous = off')
+                c.execute('pragma journal_mode = memory')
+
+            # Create the objects shared by every synthetic Game
+            map = Map.objects.create(id=SYNTHETIC_ID, name='Synthetic Map')
+            Template.objects.create(id=SYNTHETIC_ID, map=map,
+                territory_limit=4, wasteland_count=0, max_cards=3,
+                card_pieces_per_turn=1)
+            PlayerAccount.objects.bulk_create([
+                PlayerAccount(id=SYNTHETIC_ID + 1 + index,
+                    name=f'Synthetic Player {index}')
+                for index in range(PLAYER_ACCOUNTS)
+            ])
+
+            # Create the synthetic Games
+            start_time = perf_counter()
+            game_ids = list(range(1, game_count + 1))
+            for offset in range(0, game_count, 1000):
+                _generate_games(game_ids[offset:offset + 1000],
+                    options['turns'], options['orders_per_turn'], rng)
+            self.stdout.write(
+                f'Generated {game_count} games in '
+                f'{perf_counter() - start_time:.1f}s')
+
+            # Build the materialized turn states
+            start_time = perf_counter()
+            for offset in range(0, game_count, batch_size):
+                _refresh_turn_states(game_ids[offset:offset + batch_size])
+            self.stdout.write(
+                f'Refreshed turn states in {perf_counter() - start_time:.1f}s')
+
+            with connection.cursor() as c:
+                c.execute('analyze')
+
+            self.stdout.write('With analysis indexes:')
+            self._run_benchmarks(game_ids, batch_size, repeats)
+
+            if not options['skip_baseline']:
+                with connection.cursor() as c:
+                    for index_name in ANALYSIS_INDEXES:
+                        c.execute(f'drop index {index_name}')
+                    c.execute('analyze')
+
+                self.stdout.write('Without analysis indexes:')
+                self._run_benchmarks(game_ids, batch_size, repeats)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
@@ -0,0 +1,52 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from ...bootstrap import DIFFERENCE_METRICS, bootstrap_win_probabilities
+from ...win_probability import TurnStateSource
+
+
+class Command(BaseCommand):
+    help = (
+        'Bootstraps confidence intervals of the probability of winning by '
+        'the difference between the players in a metric.'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--metric', choices=DIFFERENCE_METRICS,
+            default='income')
+        parser.add_argument('--bin-width', type=int, default=5)
+        parser.add_argument('--min-difference', type=int, default=-50)
+        parser.add_argument('--max-difference', type=int, default=50)
+        parser.add_argument('--replicates', type=int, default=1000)
+        parser.add_argument('--confidence', type=float, default=0.95)
+        parser.add_argument('--workers', type=int, default=1,
+            help='Number of resampling processes')
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--columns',
+            help='Directory of exported Turn State columns to read instead '
+                'of the DB')
+        parser.add_argument('--ladder', type=int, help='Ladder ID')
+        parser.add_argument('--template', type=int, help='Template ID')
+        parser.add_argument('--min-turn', type=int,
+            help='First turn number to resample')
+        parser.add_argument('--max-turn', type=int,
+            help='Last turn number to resample')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        source = TurnStateSource(options['columns'], options['ladder'],
+            options['template'], options['min_turn'], options['max_turn'])
+
+        bins = bootstrap_win_probabilities(source, options['metric'],
+            options['bin_width'], options['min_difference'],
+            options['max_difference'], options['replicates'],
+            options['confidence'], options['workers'], seed=options['seed'])
+
+        self.stdout.write(
+            'bin_start,turn_states,win_probability,lower,upper')
+        for bin in bins:
+            self.stdout.write(','.join(
+                '' if bin[name] is None else str(bin[name])
+                for name in ['bin_start', 'turn_states', 'win_probability',
+                    'lower', 'upper']
+            ))
@@ -0,0 +1,30 @@
+import logging
+
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from ...cache import get_map_wrapper
+from ...models import Map
+
+
+class Command(BaseCommand):
+    help = (
+        'Builds the matrix of the number of hops between each pair of '
+        'territories of Maps.'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--map', type=int, action='append',
+            dest='map_ids', help='Map ID. Builds all Maps if not given')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        map_ids = options['map_ids'] or list(
+            Map.objects.order_by('id').values_list('id', flat=True))
+
+        for map_id in map_ids:
+            distances = get_map_wrapper(map_id, False).build_distances()
+            logging.info(
+                f'Built {distances.dtype} distance matrix of Map {map_id} '
+                f'with {len(distances)} territories'
+            )
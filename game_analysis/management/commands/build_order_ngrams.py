@@ -0,0 +1,26 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from ...models import Map
+from ...ngrams import build_order_ngrams
+
+
+class Command(BaseCommand):
+    help = (
+        'Builds the index of the frequencies of sequences of consecutive '
+        'Orders of the players of Maps.'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--map', type=int, action='append',
+            dest='map_ids', help='Map ID. Builds all Maps if not given')
+        parser.add_argument('--workers', type=int, default=1,
+            help='Number of counting processes')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        map_ids = options['map_ids'] or list(
+            Map.objects.order_by('id').values_list('id', flat=True))
+
+        for map_id in map_ids:
+            build_order_ngrams(map_id, options['workers'])
@@ -0,0 +1,16 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from ...feature_store import compact_feature_store
+
+
+class Command(BaseCommand):
+    help = (
+        'Merges the features logged by game data calculation into the '
+        'memory-mapped feature columns.'
+    )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        record_count = compact_feature_store()
+        self.stdout.write(f'Feature store contains {record_count} records')
@@ -0,0 +1,28 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from ...cache import get_template
+from ...luck_statistics import compare_successful_attacks
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the attacking armies killed in the recorded successful '
+        'attacks of Templates with the number expected from their settings.'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('templates', type=int, nargs='+',
+            help='Template IDs')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        self.stdout.write('template_id,attacks,attacking_armies_killed,'
+            'expected_attacking_armies_killed')
+        for template_id in options['templates']:
+            result = compare_successful_attacks(get_template(template_id))
+            self.stdout.write(
+                f'{result["template_id"]},{result["attacks"]},'
+                f'{result["attacking_armies_killed"]},'
+                f'{result["expected_attacking_armies_killed"]}'
+            )
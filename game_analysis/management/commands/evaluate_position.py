@@ -0,0 +1,43 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from ...cache import get_map_wrapper, get_template
+from ...models import Game
+from ...simulation import MAX_ROLLOUT_TURNS, evaluate_position, get_position
+
+
+class Command(BaseCommand):
+    help = (
+        'Estimates the win probability of each player of a game at the end '
+        'of a turn by simulating rollouts of the rest of the game.'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('game', type=int, help='Game ID')
+        parser.add_argument('turn', type=int, help='Turn number')
+        parser.add_argument('--rollouts', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=1,
+            help='Number of simulation processes')
+        parser.add_argument('--max-turns', type=int,
+            default=MAX_ROLLOUT_TURNS,
+            help='Number of turns after which a rollout is a draw')
+        parser.add_argument('--seed', type=int)
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        game = Game.objects.get(pk=options['game'])
+        template = get_template(game.template_id)
+        position = get_position(game.id, options['turn'])
+
+        result = evaluate_position(position,
+            get_map_wrapper(template.map_id, False).arrays, template,
+            options['rollouts'], options['workers'],
+            max_turns=options['max_turns'], seed=options['seed'])
+
+        self.stdout.write('player_id,win_probability')
+        for player in result['players']:
+            self.stdout.write(
+                f'{player["player_id"]},{player["win_probability"]}')
+        self.stdout.write(f'draw,{result["draw_probability"]}')
+        self.stdout.write(
+            f'{result["rollouts_per_second"]:.1f} rollouts per second')
@@ -0,0 +1,47 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from ...export import CSV, NPY, export_turn_state_columns, get_turn_states
+from ...export import stream_turn_states_csv, stream_turn_states_npy
+
+COLUMNS = 'columns'
+
+
+class Command(BaseCommand):
+    help = (
+        'Exports Turn States as CSV, a .npy file of records or a directory '
+        'of one .npy file per column.'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('output',
+            help='File to write, or directory for the columns format')
+        parser.add_argument('--format', choices=[CSV, NPY, COLUMNS],
+            default=CSV)
+        parser.add_argument('--ladder', type=int, help='Ladder ID')
+        parser.add_argument('--template', type=int, help='Template ID')
+        parser.add_argument('--min-turn', type=int,
+            help='First turn number to export')
+        parser.add_argument('--max-turn', type=int,
+            help='Last turn number to export')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        turn_states = get_turn_states(options['ladder'], options['template'],
+            options['min_turn'], options['max_turn'])
+        output = options['output']
+        export_format = options['format']
+
+        if export_format == COLUMNS:
+            row_count = export_turn_state_columns(turn_states, output)
+            self.stdout.write(f'Exported {row_count} Turn States to {output}')
+        elif export_format == CSV:
+            with open(output, 'w', newline='') as file:
+                for text in stream_turn_states_csv(turn_states):
+                    file.write(text)
+            self.stdout.write(f'Exported Turn States to {output}')
+        else:
+            with open(output, 'wb') as file:
+                for data in stream_turn_states_npy(turn_states):
+                    file.write(data)
+            self.stdout.write(f'Exported Turn States to {output}')
@@ -0,0 +1,15 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from ...luck_statistics import rebuild_luck_statistics
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the luck statistics of Player Accounts and Templates from '
+        'all imported attacks.'
+    )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        rebuild_luck_statistics()
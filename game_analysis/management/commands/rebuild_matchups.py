@@ -0,0 +1,12 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from ...matchups import rebuild_matchups
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the head-to-head Matchups of all imported Games.'
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        rebuild_matchups()
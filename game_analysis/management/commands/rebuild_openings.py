@@ -0,0 +1,15 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from ...openings import rebuild_openings
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the opening index of Template Territory picks from all '
+        'imported Games.'
+    )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        rebuild_openings()
@@ -0,0 +1,15 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from ...player_statistics import rebuild_player_statistics
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the statistics and income by turn of all Player Accounts '
+        'from the imported and calculated data.'
+    )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        rebuild_player_statistics()
@@ -0,0 +1,16 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from ...trajectories import rebuild_trajectories
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the index of the turn by turn trajectories of two player '
+        'Games from their Player States.'
+    )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        game_count = rebuild_trajectories()
+        self.stdout.write(f'Trajectory index contains {game_count} games')
@@ -0,0 +1,12 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from ...aggregates import rebuild_win_probability_cells
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the win probability cube from all Turn States.'
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        rebuild_win_probability_cells()
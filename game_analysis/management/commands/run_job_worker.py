@@ -0,0 +1,40 @@
+from multiprocessing import Process
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import connections
+
+from ...jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Runs queued import and calculation jobs.'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--workers', type=int, default=1,
+            help='Number of worker processes')
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+            help='Seconds to wait before checking an empty queue again')
+        parser.add_argument('--exit-when-empty', action='store_true',
+            help='Stop once there are no queued jobs')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        poll_interval = options['poll_interval']
+        exit_when_empty = options['exit_when_empty']
+
+        if options['workers'] == 1:
+            run_worker(poll_interval, exit_when_empty)
+            return
+
+        # Each worker process must open its own DB connection
+        connections.close_all()
+        workers = [
+            Process(target=run_worker, args=(poll_interval, exit_when_empty))
+            for _ in range(options['workers'])
+        ]
+
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,49 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from ...win_probability import TurnStateSource, evaluate_model
+from ...win_probability import get_default_model_path, train_model
+
+
+class Command(BaseCommand):
+    help = (
+        'Trains a logistic regression model of the probability of winning '
+        'from Turn States and evaluates it on held-out games.'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--columns',
+            help='Directory of exported Turn State columns to read instead '
+                'of the DB')
+        parser.add_argument('--ladder', type=int, help='Ladder ID')
+        parser.add_argument('--template', type=int, help='Template ID')
+        parser.add_argument('--min-turn', type=int,
+            help='First turn number to train on')
+        parser.add_argument('--max-turn', type=int,
+            help='Last turn number to train on')
+        parser.add_argument('--epochs', type=int, default=10)
+        parser.add_argument('--batch-size', type=int, default=65536)
+        parser.add_argument('--learning-rate', type=float, default=0.5)
+        parser.add_argument('--l2-penalty', type=float, default=1e-4)
+        parser.add_argument('--test-fraction', type=float, default=0.2,
+            help='Fraction of games held out for evaluation')
+        parser.add_argument('--workers', type=int, default=1,
+            help='Number of evaluation processes')
+        parser.add_argument('--output', default=get_default_model_path(),
+            help='File to save the model to')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        source = TurnStateSource(options['columns'], options['ladder'],
+            options['template'], options['min_turn'], options['max_turn'])
+
+        model = train_model(source, options['epochs'], options['batch_size'],
+            options['learning_rate'], options['l2_penalty'],
+            options['test_fraction'])
+        model.save(options['output'])
+        self.stdout.write(f'Saved model to {options["output"]}')
+
+        metrics = evaluate_model(model, source, options['batch_size'],
+            options['test_fraction'], options['workers'])
+        for name, value in metrics.items():
+            self.stdout.write(f'{name}: {value}')
@@ -0,0 +1,22 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from ...ratings import get_default_ratings_path, update_ratings
+
+
+class Command(BaseCommand):
+    help = (
+        'Applies Games that ended since the last run to the ratings of '
+        'Player Accounts.'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--path', default=get_default_ratings_path(),
+            help='Ratings checkpoint file')
+        parser.add_argument('--rebuild', action='store_true',
+            help='Rate all Games from the start')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        count = update_ratings(options['path'], options['rebuild'])
+        self.stdout.write(f'Applied {count} Games to the ratings')
@@ -0,0 +1,150 @@
+import logging
+
+from itertools import combinations, groupby
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Matchup, Player
+from .ratings import WINNING_END_STATES, Ratings
+
+# Width of the rating bands of a Player Account's record
+RATING_BAND_WIDTH = 100
+
+# Number of Matchups saved at a time when rebuilding
+REBUILD_BATCH_SIZE = 10000
+
+# Game, Player Account and end state ids of a Player
+PlayerRow = Tuple[int, int, str]
+
+
+# Get the Matchups between the opposing players of a Game. In Games of more
+# than two players, players who both won or both did not win may have been
+# on the same team, so only winners are matched up against the other players
+def _get_game_matchups(game_id: int,
+        players: Iterable[PlayerRow]) -> List[Matchup]:
+    matchups: List[Matchup] = []
+    sorted_players = sorted(players, key=lambda player: player[1])
+    for player_1, player_2 in combinations(sorted_players, 2):
+        _, player_account_id_1, end_state_1 = player_1
+        _, player_account_id_2, end_state_2 = player_2
+        is_winner_1 = end_state_1 in WINNING_END_STATES
+        is_winner_2 = end_state_2 in WINNING_END_STATES
+
+        if is_winner_1 == is_winner_2 and len(sorted_players) > 2:
+            continue
+
+        winner_id: Optional[int] = None
+        if is_winner_1:
+            winner_id = player_account_id_1
+        elif is_winner_2:
+            winner_id = player_account_id_2
+
+        matchups.append(Matchup(player_account_1_id=player_account_id_1,
+            player_account_2_id=player_account_id_2, game_id=game_id,
+            winner_id=winner_id))
+
+    return matchups
+
+
+# Get the Matchups of Players ordered by Game
+def _get_matchups(players: Iterable[PlayerRow]) -> List[Matchup]:
+    matchups: List[Matchup] = []
+    for game_id, game_players in groupby(players, lambda player: player[0]):
+        matchups.extend(_get_game_matchups(game_id, game_players))
+    return matchups
+
+
+# Add the Matchups of newly imported Players
+def add_imported_games(players: Iterable[Player]) -> None:
+    Matchup.objects.bulk_create(_get_matchups(sorted(
+        ((player.game.id, player.player_id, player.end_state_id)
+            for player in players),
+        key=lambda player: player[0]
+    )))
+
+
+# Rebuild the Matchups of all imported Games
+def rebuild_matchups() -> None:
+    logging.info('Rebuilding Matchups')
+    players = (
+        Player.objects
+            .order_by('game_id')
+            .values_list('game_id', 'player_id', 'end_state_id')
+            .iterator()
+    )
+
+    with transaction.atomic():
+        Matchup.objects.all().delete()
+
+        matchups: List[Matchup] = []
+        for game_id, game_players in groupby(players,
+                lambda player: player[0]):
+            matchups.extend(_get_game_matchups(game_id, game_players))
+            if len(matchups) >= REBUILD_BATCH_SIZE:
+                Matchup.objects.bulk_create(matchups)
+                matchups.clear()
+
+        Matchup.objects.bulk_create(matchups)
+
+
+# Get the Games between two Player Accounts and the number each won
+def get_head_to_head(player_account_id_1: int,
+        player_account_id_2: int) -> Dict[str, Any]:
+    player_account_id_1, player_account_id_2 = sorted(
+        [player_account_id_1, player_account_id_2])
+    games = list(
+        Matchup.objects
+            .filter(player_account_1_id=player_account_id_1,
+                player_account_2_id=player_account_id_2)
+            .order_by('game_id')
+            .values_list('game_id', 'winner_id')
+    )
+    winner_ids = [winner_id for _, winner_id in games]
+
+    return {
+        'player_account_ids': [player_account_id_1, player_account_id_2],
+        'games': [
+            {'game_id': game_id, 'winner_id': winner_id}
+            for game_id, winner_id in games
+        ],
+        'wins': {
+            player_account_id_1: winner_ids.count(player_account_id_1),
+            player_account_id_2: winner_ids.count(player_account_id_2),
+        },
+        'games_without_winner': winner_ids.count(None),
+    }
+
+
+# Get a Player Account's wins and losses against opponents in each band of
+# their current rating. Opponents without a rating are counted in a band
+# without a start
+def get_record_by_rating_band(player_account_id: int,
+        ratings: Ratings) -> List[Dict[str, Any]]:
+    records: Dict[Optional[int], Dict[str, Any]] = {}
+    for player_account_id_1, player_account_id_2, winner_id in (
+            Matchup.objects
+                .filter(Q(player_account_1_id=player_account_id)
+                    | Q(player_account_2_id=player_account_id))
+                .values_list('player_account_1_id', 'player_account_2_id',
+                    'winner_id')):
+        opponent_id = (
+            player_account_id_2 if player_account_id_1 == player_account_id
+            else player_account_id_1)
+        rating = ratings.get_rating(opponent_id)
+        band_start = (
+            None if rating is None
+            else int(rating // RATING_BAND_WIDTH * RATING_BAND_WIDTH))
+
+        record = records.setdefault(band_start,
+            {'band_start': band_start, 'games': 0, 'wins': 0, 'losses': 0})
+        record['games'] += 1
+        if winner_id == player_account_id:
+            record['wins'] += 1
+        elif winner_id == opponent_id:
+            record['losses'] += 1
+
+    return sorted(records.values(),
+        key=lambda record: (record['band_start'] is None,
+            record['band_start'] or 0))
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-19 13:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_analysis', '0004_create_turn_state_view'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TerritoryState',
+            fields=[
+                ('id', models.AutoField(editable=False, primary_key=True, serialize=False)),
+                ('turn_number', models.SmallIntegerField()),
+                ('armies', models.SmallIntegerField(blank=True, null=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='game_analysis.Game')),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='game_analysis.Player')),
+                ('territory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='game_analysis.Territory')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='territorystate',
+            index=models.Index(fields=['game', 'territory', 'turn_number'], name='game_analys_game_id_6d1d8b_idx'),
+        ),
+    ]
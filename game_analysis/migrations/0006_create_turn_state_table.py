@@ -0,0 +1,119 @@
+# Generated by Django 2.2.28 on 2026-10-19 13:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+DROP_TURN_STATE_VIEW = 'drop view if exists game_analysis_turn_state'
+
+# Copy of the view created by migration 0004, which restores the view when
+# the migration is unapplied
+CREATE_TURN_STATE_VIEW = '''
+create view game_analysis_turn_state as
+    select
+        p1.end_state_id = 'Won' as p1_winner,
+        g.id as game_id,
+        t.turn_number as turn_number,
+        s1.income as p1_income, s1.armies_on_board as p1_armies_on_board,
+            s1.armies_deployed as p1_armies_deployed,
+            s1.cumulative_armies_deployed as p1_cumulative_armies_deployed,
+            s1.territories_controlled as p1_territories_controlled,
+        s2.income as p2_income, s2.armies_on_board as p2_armies_on_board,
+            s2.armies_deployed as p2_armies_deployed,
+            s2.cumulative_armies_deployed as p2_cumulative_armies_deployed,
+            s2.territories_controlled as p2_territories_controlled
+    from
+        game_analysis_game g,
+        game_analysis_turn t,
+        game_analysis_player p1, game_analysis_player p2,
+        game_analysis_playerstate s1, game_analysis_playerstate s2
+    where
+        g.id = t.game_id and g.id = p1.game_id and g.id = p2.game_id
+        and s1.player_id = p1.id and s2.player_id = p2.id
+        and s1.turn_id = t.id and s2.turn_id = t.id
+        and p1.id < p2.id
+        and t.turn_number > -1
+        and (
+            p1.end_state_id in ('SurrenderAccepted', 'Eliminated')
+            or p2.end_state_id in ('SurrenderAccepted', 'Eliminated')
+        )
+'''
+
+# Empties the table before it is dropped when the migration is unapplied
+DELETE_TURN_STATES = 'delete from game_analysis_turn_state'
+
+# Copy of sql/insert_turn_state.sql as of this migration without a Game filter
+POPULATE_TURN_STATE_TABLE = '''
+insert into game_analysis_turn_state (
+    p1_winner, game_id, turn_number,
+    p1_income, p1_armies_on_board, p1_armies_deployed,
+        p1_cumulative_armies_deployed, p1_territories_controlled,
+    p2_income, p2_armies_on_board, p2_armies_deployed,
+        p2_cumulative_armies_deployed, p2_territories_controlled
+)
+    select
+        p1.end_state_id = 'Won', g.id, t.turn_number,
+        s1.income, s1.armies_on_board, s1.armies_deployed,
+            s1.cumulative_armies_deployed, s1.territories_controlled,
+        s2.income, s2.armies_on_board, s2.armies_deployed,
+            s2.cumulative_armies_deployed, s2.territories_controlled
+    from
+        game_analysis_game g,
+        game_analysis_turn t,
+        game_analysis_player p1, game_analysis_player p2,
+        game_analysis_playerstate s1, game_analysis_playerstate s2
+    where
+        g.id = t.game_id and g.id = p1.game_id and g.id = p2.game_id
+        and s1.player_id = p1.id and s2.player_id = p2.id
+        and s1.turn_id = t.id and s2.turn_id = t.id
+        and p1.id < p2.id
+        and t.turn_number > -1
+        and (
+            p1.end_state_id in ('SurrenderAccepted', 'Eliminated')
+            or p2.end_state_id in ('SurrenderAccepted', 'Eliminated')
+        )
+    order by g.id, t.turn_number
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_analysis', '0005_create_territory_state'),
+    ]
+
+    operations = [
+        migrations.RunSQL(DROP_TURN_STATE_VIEW,
+            reverse_sql=CREATE_TURN_STATE_VIEW),
+        migrations.CreateModel(
+            name='TurnState',
+            fields=[
+                ('id', models.AutoField(editable=False, primary_key=True, serialize=False)),
+                ('p1_winner', models.BooleanField()),
+                ('turn_number', models.SmallIntegerField()),
+                ('p1_income', models.SmallIntegerField()),
+                ('p1_armies_on_board', models.SmallIntegerField()),
+                ('p1_armies_deployed', models.SmallIntegerField()),
+                ('p1_cumulative_armies_deployed', models.SmallIntegerField()),
+                ('p1_territories_controlled', models.SmallIntegerField()),
+                ('p2_income', models.SmallIntegerField()),
+                ('p2_armies_on_board', models.SmallIntegerField()),
+                ('p2_armies_deployed', models.SmallIntegerField()),
+                ('p2_cumulative_armies_deployed', models.SmallIntegerField()),
+                ('p2_territories_controlled', models.SmallIntegerField()),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='game_analysis.Game')),
+            ],
+            options={
+                'db_table': 'game_analysis_turn_state',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='turnstate',
+            index=models.Index(fields=['game', 'turn_number'], name='game_analys_game_id_fd2345_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='turnstate',
+            index=models.Index(fields=['turn_number', 'game'], name='game_analys_turn_nu_567fc4_idx'),
+        ),
+        migrations.RunSQL(POPULATE_TURN_STATE_TABLE,
+            reverse_sql=DELETE_TURN_STATES),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-19 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_analysis', '0006_create_turn_state_table'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['game', 'end_state', 'id'], name='player_game_end_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='playerstate',
+            index=models.Index(fields=['turn', 'player', 'income', 'armies_on_board', 'armies_deployed', 'cumulative_armies_deployed', 'territories_controlled'], name='playerstate_turn_covering_idx'),
+        ),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 2.2.28 on 2026-10-19 13:08
+
+from django.db import migrations, models
+
+# Tables whose UUID keys are replaced with integer keys, in the order they are
+# remapped, along with the (table, column) pairs that reference them
+REMAPPED_TABLES = (
+    ('game_analysis_territory', (
+        ('game_analysis_territory_connected_territories', 'from_territory_id'),
+        ('game_analysis_territory_connected_territories', 'to_territory_id'),
+        ('game_analysis_bonusterritory', 'territory_id'),
+        ('game_analysis_territorybaseline', 'territory_id'),
+        ('game_analysis_territorystate', 'territory_id'),
+        ('game_analysis_order', 'primary_territory_id'),
+        ('game_analysis_order', 'secondary_territory_id'),
+    )),
+    ('game_analysis_player', (
+        ('game_analysis_order', 'player_id'),
+        ('game_analysis_order', 'target_player_id'),
+        ('game_analysis_playerstate', 'player_id'),
+        ('game_analysis_territorystate', 'owner_id'),
+    )),
+    ('game_analysis_turn', (
+        ('game_analysis_order', 'turn_id'),
+        ('game_analysis_playerstate', 'turn_id'),
+    )),
+    ('game_analysis_order', (
+        ('game_analysis_attackresult', 'order_id'),
+    )),
+    ('game_analysis_territorybaseline', ()),
+    ('game_analysis_playerstate', ()),
+)
+
+
+# Replace each UUID key with the row's SQLite rowid, which is unique and
+# already an integer, and point every reference at the new key. The AlterField
+# operations then rebuild the tables with integer columns
+def remap_keys(apps, schema_editor):
+    with schema_editor.connection.cursor() as c:
+        for table, references in REMAPPED_TABLES:
+            for referencing_table, column in references:
+                c.execute(
+                    f'update {referencing_table} set {column} = ('
+                    f'select rowid from {table} '
+                    f'where {table}.id = {referencing_table}.{column}) '
+                    f'where {column} is not null'
+                )
+
+            c.execute(f'update {table} set id = rowid')
+
+
+# The AlterField operations don't rebuild auto-created many-to-many tables, so
+# rebuild the Territory connections table with integer columns
+def rebuild_territory_connections(apps, schema_editor):
+    Territory = apps.get_model('game_analysis', 'Territory')
+    schema_editor._remake_table(Territory.connected_territories.through)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_analysis', '0007_create_analysis_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remap_keys),
+        migrations.AlterField(
+            model_name='order',
+            name='id',
+            field=models.AutoField(editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='player',
+            name='id',
+            field=models.AutoField(editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='playerstate',
+            name='id',
+            field=models.AutoField(editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='territory',
+            name='id',
+            field=models.AutoField(editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='territorybaseline',
+            name='id',
+            field=models.AutoField(editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='turn',
+            name='id',
+            field=models.AutoField(editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.RunPython(rebuild_territory_connections),
+    ]
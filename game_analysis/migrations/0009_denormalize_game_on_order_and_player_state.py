@@ -0,0 +1,77 @@
+# Generated by Django 2.2.28 on 2026-10-19 13:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+POPULATE_ORDER_GAME = '''
+update game_analysis_order set game_id = (
+    select t.game_id from game_analysis_turn t
+    where t.id = game_analysis_order.turn_id
+)
+'''
+
+POPULATE_PLAYER_STATE_GAME_AND_TURN_NUMBER = '''
+update game_analysis_playerstate set
+    game_id = (
+        select t.game_id from game_analysis_turn t
+        where t.id = game_analysis_playerstate.turn_id
+    ),
+    turn_number = (
+        select t.turn_number from game_analysis_turn t
+        where t.id = game_analysis_playerstate.turn_id
+    )
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_analysis', '0008_use_integer_keys'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='playerstate',
+            name='playerstate_turn_covering_idx',
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='game',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='game_analysis.Game'),
+        ),
+        migrations.AddField(
+            model_name='playerstate',
+            name='game',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='game_analysis.Game'),
+        ),
+        migrations.AddField(
+            model_name='playerstate',
+            name='turn_number',
+            field=models.SmallIntegerField(null=True),
+        ),
+        migrations.RunSQL(POPULATE_ORDER_GAME),
+        migrations.RunSQL(POPULATE_PLAYER_STATE_GAME_AND_TURN_NUMBER),
+        migrations.AlterField(
+            model_name='order',
+            name='game',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='game_analysis.Game'),
+        ),
+        migrations.AlterField(
+            model_name='playerstate',
+            name='game',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='game_analysis.Game'),
+        ),
+        migrations.AlterField(
+            model_name='playerstate',
+            name='turn_number',
+            field=models.SmallIntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['game', 'turn', 'order_number'], name='game_analys_game_id_25e5ab_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='playerstate',
+            index=models.Index(fields=['game', 'turn_number', 'player', 'income', 'armies_on_board', 'armies_deployed', 'cumulative_armies_deployed', 'territories_controlled'], name='playerstate_game_covering_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-19 13:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_analysis', '0009_denormalize_game_on_order_and_player_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(editable=False, primary_key=True, serialize=False)),
+                ('job_type', models.CharField(max_length=63)),
+                ('parameters', models.TextField()),
+                ('status', models.CharField(db_index=True, default='Queued', max_length=15)),
+                ('worker', models.CharField(blank=True, max_length=255)),
+                ('items_total', models.IntegerField()),
+                ('items_processed', models.IntegerField(default=0)),
+                ('result', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_date_time', models.DateTimeField(auto_now_add=True)),
+                ('started_date_time', models.DateTimeField(blank=True, null=True)),
+                ('finished_date_time', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
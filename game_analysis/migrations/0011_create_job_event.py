@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-19 13:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_analysis', '0010_create_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobEvent',
+            fields=[
+                ('id', models.AutoField(editable=False, primary_key=True, serialize=False)),
+                ('event', models.CharField(max_length=31)),
+                ('data', models.TextField()),
+                ('created_date_time', models.DateTimeField(auto_now_add=True)),
+                ('job', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='game_analysis.Job')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='jobevent',
+            index=models.Index(fields=['job', 'id'], name='game_analys_job_id_4becdd_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-19 13:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_analysis', '0011_create_job_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WinProbabilityCell',
+            fields=[
+                ('id', models.AutoField(editable=False, primary_key=True, serialize=False)),
+                ('turn_bucket', models.SmallIntegerField()),
+                ('income_diff_bin', models.SmallIntegerField()),
+                ('army_diff_bin', models.SmallIntegerField()),
+                ('turn_states', models.IntegerField(default=0)),
+                ('wins', models.IntegerField(default=0)),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='game_analysis.Template')),
+            ],
+            options={
+                'unique_together': {('template', 'turn_bucket', 'income_diff_bin', 'army_diff_bin')},
+            },
+        ),
+    ]
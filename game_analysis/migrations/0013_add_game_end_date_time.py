@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-19 13:25
+
+from django.db import migrations, models
+
+POPULATE_GAME_END_DATE_TIME = '''
+update game_analysis_game set end_date_time = (
+    select max(t.commit_date_time) from game_analysis_turn t
+    where t.game_id = game_analysis_game.id
+)
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_analysis', '0012_create_win_probability_cell'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='end_date_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunSQL(POPULATE_GAME_END_DATE_TIME),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['end_date_time', 'id'], name='game_end_date_time_idx'),
+        ),
+    ]
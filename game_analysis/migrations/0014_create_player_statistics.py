@@ -0,0 +1,45 @@
+# Generated by Django 2.2.28 on 2026-10-19 13:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_analysis', '0013_add_game_end_date_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerStatistics',
+            fields=[
+                ('id', models.AutoField(editable=False, primary_key=True, serialize=False)),
+                ('games', models.IntegerField(default=0)),
+                ('wins', models.IntegerField(default=0)),
+                ('losses', models.IntegerField(default=0)),
+                ('attacks', models.IntegerField(default=0)),
+                ('offense_luck_sum', models.FloatField(default=0)),
+                ('defense_luck_sum', models.FloatField(default=0)),
+                ('ladder', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='game_analysis.Ladder')),
+                ('player_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statistics', to='game_analysis.PlayerAccount')),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='game_analysis.Template')),
+            ],
+            options={
+                'unique_together': {('player_account', 'ladder', 'template')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PlayerIncomeByTurn',
+            fields=[
+                ('id', models.AutoField(editable=False, primary_key=True, serialize=False)),
+                ('turn_number', models.SmallIntegerField()),
+                ('player_states', models.IntegerField(default=0)),
+                ('income_sum', models.IntegerField(default=0)),
+                ('player_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='income_by_turn', to='game_analysis.PlayerAccount')),
+            ],
+            options={
+                'unique_together': {('player_account', 'turn_number')},
+            },
+        ),
+    ]
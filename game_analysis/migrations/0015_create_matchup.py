@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-19 13:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_analysis', '0014_create_player_statistics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Matchup',
+            fields=[
+                ('id', models.AutoField(editable=False, primary_key=True, serialize=False)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='game_analysis.Game')),
+                ('player_account_1', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='game_analysis.PlayerAccount')),
+                ('player_account_2', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='game_analysis.PlayerAccount')),
+                ('winner', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='game_analysis.PlayerAccount')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='matchup',
+            index=models.Index(fields=['player_account_2', 'player_account_1'], name='matchup_player_account_2_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='matchup',
+            unique_together={('player_account_1', 'player_account_2', 'game')},
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-19 13:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_analysis', '0015_create_matchup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerLuckStatistics',
+            fields=[
+                ('attacks', models.IntegerField(default=0)),
+                ('offense_luck_mean', models.FloatField(default=0)),
+                ('offense_luck_m2', models.FloatField(default=0)),
+                ('defense_luck_mean', models.FloatField(default=0)),
+                ('defense_luck_m2', models.FloatField(default=0)),
+                ('kill_efficiency_mean', models.FloatField(default=0)),
+                ('kill_efficiency_m2', models.FloatField(default=0)),
+                ('player_account', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='luck_statistics', serialize=False, to='game_analysis.PlayerAccount')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='TemplateLuckStatistics',
+            fields=[
+                ('attacks', models.IntegerField(default=0)),
+                ('offense_luck_mean', models.FloatField(default=0)),
+                ('offense_luck_m2', models.FloatField(default=0)),
+                ('defense_luck_mean', models.FloatField(default=0)),
+                ('defense_luck_m2', models.FloatField(default=0)),
+                ('kill_efficiency_mean', models.FloatField(default=0)),
+                ('kill_efficiency_m2', models.FloatField(default=0)),
+                ('template', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='luck_statistics', serialize=False, to='game_analysis.Template')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-19 13:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_analysis', '0016_create_luck_statistics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TemplateTerritoryPicks',
+            fields=[
+                ('id', models.AutoField(editable=False, primary_key=True, serialize=False)),
+                ('games_in_distribution', models.IntegerField(default=0)),
+                ('games_wastelanded', models.IntegerField(default=0)),
+                ('picks', models.IntegerField(default=0)),
+                ('pick_priority_sum', models.IntegerField(default=0)),
+                ('successful_picks', models.IntegerField(default=0)),
+                ('auto_picks', models.IntegerField(default=0)),
+                ('wins', models.IntegerField(default=0)),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='territory_picks', to='game_analysis.Template')),
+                ('territory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='game_analysis.Territory')),
+            ],
+            options={
+                'unique_together': {('template', 'territory')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-19 13:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_analysis', '0017_create_template_territory_picks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LadderSyncState',
+            fields=[
+                ('ladder', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sync_state', serialize=False, to='game_analysis.Ladder')),
+                ('newest_game_id', models.IntegerField(default=0)),
+                ('synced_date_time', models.DateTimeField(blank=True, null=True)),
+                ('games_imported', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
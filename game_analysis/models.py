@@ -1,9 +1,11 @@
 from __future__ import annotations
 
 from datetime import datetime
+from typing import Optional
 from uuid import uuid4, UUID
 
 from django.db import models
+from django.utils import timezone
 
 WARZONE_PATH = 'https://www.warzone.com'
 
@@ -81,8 +83,7 @@ class Map(models.Model):
 
 
 class Territory(models.Model):
-    id: UUID = models.UUIDField(primary_key=True, default=uuid4,
-        editable=False)
+    id: int = models.AutoField(primary_key=True, editable=False)
     map: Map = models.ForeignKey(Map, on_delete=models.CASCADE)
     # value in json returned by api
     api_id: int = models.SmallIntegerField(editable=False)
@@ -207,6 +208,13 @@ class TemplateCardSetting(models.Model):
 
 
 class Game(models.Model):
+    class Meta:
+        indexes = [
+            # Orders Games by when they ended for the rating engine
+            models.Index(fields=['end_date_time', 'id'],
+                name='game_end_date_time_idx'),
+        ]
+
     id: int = models.IntegerField(primary_key=True, editable=False)
     template: Template = models.ForeignKey(Template, on_delete=models.CASCADE)
     name: str = models.CharField(max_length=255)
@@ -216,6 +224,9 @@ class Game(models.Model):
     ladder: Ladder = models.ForeignKey(Ladder, on_delete=models.CASCADE,
         null=True, blank=True)
     version: int = models.SmallIntegerField(default=0, db_index=True)
+    # Commit time of the last Turn
+    end_date_time: Optional[datetime] = models.DateTimeField(null=True,
+        blank=True)
 
     def __str__(self) -> str:
         return self.name
@@ -224,9 +235,13 @@ class Game(models.Model):
 class Player(models.Model):
     class Meta:
         unique_together = (('game', 'player'),)
+        indexes = [
+            # Covers the Player lookups of the turn state build
+            models.Index(fields=['game', 'end_state', 'id'],
+                name='player_game_end_state_idx'),
+        ]
     
-    id: UUID = models.UUIDField(primary_key=True, default=uuid4,
-        editable=False)
+    id: int = models.AutoField(primary_key=True, editable=False)
     game: Game = models.ForeignKey(Game, on_delete=models.CASCADE)
     player: PlayerAccount = models.ForeignKey(PlayerAccount,
         on_delete=models.CASCADE)
@@ -241,8 +256,7 @@ class TerritoryBaseline(models.Model):
     class Meta:
         unique_together = (('game', 'territory'),)
     
-    id: UUID = models.UUIDField(primary_key=True, default=uuid4,
-        editable=False)
+    id: int = models.AutoField(primary_key=True, editable=False)
     game: Game = models.ForeignKey(Game, on_delete=models.CASCADE)
     territory: Territory = models.ForeignKey(Territory,
         on_delete=models.CASCADE)
@@ -256,8 +270,7 @@ class Turn(models.Model):
     class Meta:
         unique_together = (('game', 'turn_number'),)
     
-    id: UUID = models.UUIDField(primary_key=True, default=uuid4,
-        editable=False)
+    id: int = models.AutoField(primary_key=True, editable=False)
     game: Game = models.ForeignKey(Game, on_delete=models.CASCADE)
     turn_number: int = models.SmallIntegerField()
     commit_date_time: datetime = models.DateTimeField(null=True, blank=True)
@@ -269,9 +282,14 @@ class Turn(models.Model):
 class Order(models.Model):
     class Meta:
         unique_together = (('turn', 'order_number'),)
+        indexes = [
+            models.Index(fields=['game', 'turn', 'order_number']),
+        ]
     
-    id: UUID = models.UUIDField(primary_key=True, default=uuid4,
-        editable=False)
+    id: int = models.AutoField(primary_key=True, editable=False)
+    # Same as turn.game. Stored so Orders can be scanned by Game without a join
+    game: Game = models.ForeignKey(Game, on_delete=models.CASCADE,
+        db_index=False)
     turn: Turn = models.ForeignKey(Turn, on_delete=models.CASCADE)
     order_number: int = models.SmallIntegerField()
     order_type: OrderType = models.ForeignKey(OrderType,
@@ -317,8 +335,20 @@ class AttackResult(models.Model):
 class PlayerState(models.Model):
     class Meta:
         unique_together = (('turn', 'player'),)
+        indexes = [
+            # Covers the PlayerState lookups of the turn state build
+            models.Index(fields=['game', 'turn_number', 'player', 'income',
+                    'armies_on_board', 'armies_deployed',
+                    'cumulative_armies_deployed', 'territories_controlled'],
+                name='playerstate_game_covering_idx'),
+        ]
     
-    id: UUID = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    id: int = models.AutoField(primary_key=True, editable=False)
+    # Same as turn.game and turn.turn_number. Stored so Player States can be
+    # scanned by Game without a join
+    game: Game = models.ForeignKey(Game, on_delete=models.CASCADE,
+        db_index=False)
+    turn_number: int = models.SmallIntegerField()
     turn: Turn = models.ForeignKey(Turn, on_delete=models.CASCADE)
     player: Player = models.ForeignKey(Player, on_delete=models.CASCADE)
     income: int = models.SmallIntegerField()
@@ -338,3 +368,308 @@ class PlayerState(models.Model):
 
     def __str__(self) -> str:
         return f'{self.turn} - {self.player}'
+
+
+# Change in the owner or armies of a Territory by the end of a Turn. Only
+# changes are stored, so the state of a Territory on any Turn is the most
+# recent change at or before that Turn
+class TerritoryState(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=['game', 'territory', 'turn_number']),
+        ]
+
+    id: int = models.AutoField(primary_key=True, editable=False)
+    game: Game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    territory: Territory = models.ForeignKey(Territory,
+        on_delete=models.CASCADE, related_name='+')
+    turn_number: int = models.SmallIntegerField()
+    # null if the Territory is neutral
+    owner: Player = models.ForeignKey(Player, on_delete=models.CASCADE,
+        related_name='+', null=True, blank=True)
+    # null if the Territory is neutral since neutral armies are not tracked
+    armies: int = models.SmallIntegerField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f'{self.game_id}:{self.territory} - Turn {self.turn_number}'
+
+
+# State of a pair of Players at the end of each Turn of a Game, materialized
+# from Player and PlayerState. Kept up to date by calculate_game_data for the
+# Games that it processes
+class TurnState(models.Model):
+    class Meta:
+        db_table = 'game_analysis_turn_state'
+        indexes = [
+            models.Index(fields=['game', 'turn_number']),
+            models.Index(fields=['turn_number', 'game']),
+        ]
+
+    id: int = models.AutoField(primary_key=True, editable=False)
+    p1_winner: bool = models.BooleanField()
+    game: Game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    turn_number: int = models.SmallIntegerField()
+    # Player 1 State
+    p1_income: int = models.SmallIntegerField()
+    p1_armies_on_board: int = models.SmallIntegerField()
+    p1_armies_deployed: int = models.SmallIntegerField()
+    p1_cumulative_armies_deployed: int = models.SmallIntegerField()
+    p1_territories_controlled: int = models.SmallIntegerField()
+    # Player 2 State
+    p2_income: int = models.SmallIntegerField()
+    p2_armies_on_board: int = models.SmallIntegerField()
+    p2_armies_deployed: int = models.SmallIntegerField()
+    p2_cumulative_armies_deployed: int = models.SmallIntegerField()
+    p2_territories_controlled: int = models.SmallIntegerField()
+
+    def __str__(self) -> str:
+        return f'{self.game_id}: Turn {self.turn_number}'
+
+
+# Long-running import or calculation queued from a view and run by a worker
+# process started with "manage.py run_job_worker"
+class Job(models.Model):
+    QUEUED = 'Queued'
+    RUNNING = 'Running'
+    FINISHED = 'Finished'
+    FAILED = 'Failed'
+
+    id: int = models.AutoField(primary_key=True, editable=False)
+    job_type: str = models.CharField(max_length=63)
+    # JSON encoded keyword arguments of the job
+    parameters: str = models.TextField()
+    status: str = models.CharField(max_length=15, default=QUEUED,
+        db_index=True)
+    worker: str = models.CharField(max_length=255, blank=True)
+    items_total: int = models.IntegerField()
+    items_processed: int = models.IntegerField(default=0)
+    result: str = models.TextField(blank=True)
+    error: str = models.TextField(blank=True)
+    created_date_time: datetime = models.DateTimeField(auto_now_add=True)
+    started_date_time: datetime = models.DateTimeField(null=True, blank=True)
+    finished_date_time: datetime = models.DateTimeField(null=True,
+        blank=True)
+
+    def __str__(self) -> str:
+        return f'{self.job_type} {self.id} - {self.status}'
+
+    # Get the number of items processed per second since the job started
+    def get_items_per_second(self) -> Optional[float]:
+        if not self.started_date_time:
+            return None
+
+        end_date_time = self.finished_date_time or timezone.now()
+        seconds = (end_date_time - self.started_date_time).total_seconds()
+        return self.items_processed / seconds if seconds > 0 else None
+
+    # Get the estimated number of seconds until the job finishes. Jobs with
+    # an unknown number of items have an items total of 0
+    def get_seconds_remaining(self) -> Optional[float]:
+        items_per_second = self.get_items_per_second()
+        if (self.status != Job.RUNNING or not items_per_second
+                or not self.items_total):
+            return None
+
+        return (self.items_total - self.items_processed) / items_per_second
+
+
+# Progress event reported while a Job runs
+class JobEvent(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=['job', 'id']),
+        ]
+
+    id: int = models.AutoField(primary_key=True, editable=False)
+    job: Job = models.ForeignKey(Job, on_delete=models.CASCADE,
+        db_index=False)
+    event: str = models.CharField(max_length=31)
+    # JSON encoded event data
+    data: str = models.TextField()
+    created_date_time: datetime = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f'{self.job_id}: {self.event}'
+
+
+# Number of Turn States and wins of the player whose state is binned, in a
+# cell of the win probability cube. Each Turn State is counted from the point
+# of view of both players
+class WinProbabilityCell(models.Model):
+    class Meta:
+        unique_together = (
+            ('template', 'turn_bucket', 'income_diff_bin', 'army_diff_bin'),)
+
+    id: int = models.AutoField(primary_key=True, editable=False)
+    template: Template = models.ForeignKey(Template, on_delete=models.CASCADE,
+        related_name='+')
+    turn_bucket: int = models.SmallIntegerField()
+    income_diff_bin: int = models.SmallIntegerField()
+    army_diff_bin: int = models.SmallIntegerField()
+    turn_states: int = models.IntegerField(default=0)
+    wins: int = models.IntegerField(default=0)
+
+    def __str__(self) -> str:
+        return (
+            f'{self.template_id}: Turn bucket {self.turn_bucket}, '
+            f'Income bin {self.income_diff_bin}, Army bin {self.army_diff_bin}'
+        )
+
+
+# Results and attack luck of a Player Account in the Games of a Ladder and
+# Template
+class PlayerStatistics(models.Model):
+    class Meta:
+        unique_together = (('player_account', 'ladder', 'template'),)
+
+    id: int = models.AutoField(primary_key=True, editable=False)
+    player_account: PlayerAccount = models.ForeignKey(PlayerAccount,
+        on_delete=models.CASCADE, related_name='statistics')
+    ladder: Optional[Ladder] = models.ForeignKey(Ladder,
+        on_delete=models.CASCADE, related_name='+', null=True, blank=True)
+    template: Template = models.ForeignKey(Template, on_delete=models.CASCADE,
+        related_name='+')
+    games: int = models.IntegerField(default=0)
+    wins: int = models.IntegerField(default=0)
+    losses: int = models.IntegerField(default=0)
+    attacks: int = models.IntegerField(default=0)
+    # Sums of the luck of the Player Account's attacks, added by the luck
+    # statistics pass
+    offense_luck_sum: float = models.FloatField(default=0)
+    defense_luck_sum: float = models.FloatField(default=0)
+
+    def __str__(self) -> str:
+        return f'{self.player_account_id}: {self.ladder_id} {self.template_id}'
+
+
+# Total income of a Player Account on a turn number over all of its Games
+class PlayerIncomeByTurn(models.Model):
+    class Meta:
+        unique_together = (('player_account', 'turn_number'),)
+
+    id: int = models.AutoField(primary_key=True, editable=False)
+    player_account: PlayerAccount = models.ForeignKey(PlayerAccount,
+        on_delete=models.CASCADE, related_name='income_by_turn')
+    turn_number: int = models.SmallIntegerField()
+    player_states: int = models.IntegerField(default=0)
+    income_sum: int = models.IntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f'{self.player_account_id}: Turn {self.turn_number}'
+
+
+# Game between two opposing Player Accounts. The Player Account with the
+# lower id is always player_account_1
+class Matchup(models.Model):
+    class Meta:
+        unique_together = (('player_account_1', 'player_account_2', 'game'),)
+        indexes = [
+            # Finds the Matchups of a Player Account that is player 2
+            models.Index(fields=['player_account_2', 'player_account_1'],
+                name='matchup_player_account_2_idx'),
+        ]
+
+    id: int = models.AutoField(primary_key=True, editable=False)
+    # Indexed by the unique index
+    player_account_1: PlayerAccount = models.ForeignKey(PlayerAccount,
+        on_delete=models.CASCADE, related_name='+', db_index=False)
+    player_account_2: PlayerAccount = models.ForeignKey(PlayerAccount,
+        on_delete=models.CASCADE, related_name='+', db_index=False)
+    game: Game = models.ForeignKey(Game, on_delete=models.CASCADE,
+        related_name='+')
+    # Null if neither Player Account won
+    winner: Optional[PlayerAccount] = models.ForeignKey(PlayerAccount,
+        on_delete=models.CASCADE, related_name='+', null=True, blank=True,
+        db_index=False)
+
+    def __str__(self) -> str:
+        return (
+            f'{self.game_id}: {self.player_account_1_id} vs '
+            f'{self.player_account_2_id}'
+        )
+
+
+# Running count, mean and sum of squared differences from the mean (Welford)
+# of the luck and kill efficiency of attacks
+class LuckStatistics(models.Model):
+    class Meta:
+        abstract = True
+
+    METRICS = ['offense_luck', 'defense_luck', 'kill_efficiency']
+
+    attacks: int = models.IntegerField(default=0)
+    offense_luck_mean: float = models.FloatField(default=0)
+    offense_luck_m2: float = models.FloatField(default=0)
+    defense_luck_mean: float = models.FloatField(default=0)
+    defense_luck_m2: float = models.FloatField(default=0)
+    # Defending armies killed per attacking army
+    kill_efficiency_mean: float = models.FloatField(default=0)
+    kill_efficiency_m2: float = models.FloatField(default=0)
+
+    # Get the sample variance of a metric, or None if there are too few
+    # attacks
+    def get_variance(self, metric: str) -> Optional[float]:
+        if self.attacks < 2:
+            return None
+        variance: float = getattr(self, f'{metric}_m2') / (self.attacks - 1)
+        return variance
+
+
+class PlayerLuckStatistics(LuckStatistics):
+    player_account: PlayerAccount = models.OneToOneField(PlayerAccount,
+        on_delete=models.CASCADE, primary_key=True,
+        related_name='luck_statistics')
+
+    def __str__(self) -> str:
+        return str(self.player_account_id)
+
+
+class TemplateLuckStatistics(LuckStatistics):
+    template: Template = models.OneToOneField(Template,
+        on_delete=models.CASCADE, primary_key=True,
+        related_name='luck_statistics')
+
+    def __str__(self) -> str:
+        return str(self.template_id)
+
+
+# Starting picks and results of a Territory over the Games of a Template, and
+# how often it was a distribution option or a wasteland
+class TemplateTerritoryPicks(models.Model):
+    class Meta:
+        unique_together = (('template', 'territory'),)
+
+    id: int = models.AutoField(primary_key=True, editable=False)
+    template: Template = models.ForeignKey(Template, on_delete=models.CASCADE,
+        related_name='territory_picks')
+    territory: Territory = models.ForeignKey(Territory,
+        on_delete=models.CASCADE, related_name='+')
+    # Games with each Territory Baseline state
+    games_in_distribution: int = models.IntegerField(default=0)
+    games_wastelanded: int = models.IntegerField(default=0)
+    # Manual picks, the sum of their priorities, where a player's first pick
+    # has priority 1, and the number of them the player received
+    picks: int = models.IntegerField(default=0)
+    pick_priority_sum: int = models.IntegerField(default=0)
+    successful_picks: int = models.IntegerField(default=0)
+    # Territories given to players who did not make enough picks
+    auto_picks: int = models.IntegerField(default=0)
+    # Games won by the player who started with the Territory
+    wins: int = models.IntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f'{self.template_id}: {self.territory_id}'
+
+
+# High-water mark of the Games of a Ladder imported by syncing it
+class LadderSyncState(models.Model):
+    ladder: Ladder = models.OneToOneField(Ladder, on_delete=models.CASCADE,
+        primary_key=True, related_name='sync_state')
+    # Largest id of the Ladder's Games seen by a completed sync
+    newest_game_id: int = models.IntegerField(default=0)
+    synced_date_time: datetime = models.DateTimeField(null=True, blank=True)
+    # Games imported by all syncs of the Ladder
+    games_imported: int = models.IntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f'{self.ladder_id}: {self.newest_game_id}'
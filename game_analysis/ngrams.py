@@ -0,0 +1,346 @@
+import logging
+import os
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections
+
+from . import cache
+from .models import Game, Order, OrderType
+from .progress import ProgressCallback, report
+
+# Longest sequence of orders counted
+MAX_NGRAM_LENGTH = 3
+
+# Bits of a token holding the order type and the territory
+ORDER_TYPE_BITS = 5
+TERRITORY_BITS = 16
+TOKEN_BITS = ORDER_TYPE_BITS + TERRITORY_BITS
+
+# Number of Games whose Orders are read and counted together
+GAMES_PER_BATCH = 1000
+
+# Order types whose territory is the secondary one. The destination of an
+# attack or transfer says more about a strategy than its source
+SECONDARY_TERRITORY_ORDER_TYPES = ['GameOrderAttackTransfer',
+    'GameOrderPlayCardAirlift']
+
+# Codes of the order types and map-relative territory codes used by the
+# index being built by a worker process
+_order_type_codes: Dict[str, int] = {}
+_territory_codes: Dict[int, int] = {}
+
+
+# Get the path of the order n-gram index of a Map
+def get_order_ngrams_path(map_id: int) -> str:
+    return os.path.join(settings.ANALYSIS_DATA_DIR, 'ngrams',
+        f'{map_id}_orders.npz')
+
+
+# Pack tokens into an n-gram key. The first token is in the highest bits and
+# missing tokens are 0, so the keys of the n-grams starting with a prefix are
+# a contiguous range and shorter n-grams sort before their extensions
+def pack_tokens(tokens: List[int]) -> int:
+    if not 1 <= len(tokens) <= MAX_NGRAM_LENGTH:
+        raise ValueError(
+            f'N-grams have between 1 and {MAX_NGRAM_LENGTH} orders.')
+
+    key = 0
+    for i in range(MAX_NGRAM_LENGTH):
+        key = (key << TOKEN_BITS) | (tokens[i] if i < len(tokens) else 0)
+    return key
+
+
+# Unpack the tokens of an n-gram key
+def unpack_tokens(key: int) -> List[int]:
+    tokens = [
+        (key >> (TOKEN_BITS * (MAX_NGRAM_LENGTH - 1 - i)))
+            & ((1 << TOKEN_BITS) - 1)
+        for i in range(MAX_NGRAM_LENGTH)
+    ]
+    return [token for token in tokens if token]
+
+
+# Get the number of tokens of each n-gram key
+def _get_lengths(keys: np.ndarray) -> np.ndarray:
+    lengths = np.zeros(len(keys), dtype=np.int64)
+    for i in range(MAX_NGRAM_LENGTH):
+        token = (keys >> (TOKEN_BITS * (MAX_NGRAM_LENGTH - 1 - i))) & (
+            (1 << TOKEN_BITS) - 1)
+        lengths += token != 0
+    return lengths
+
+
+# Set the codes used to encode Orders by a worker process
+def _set_codes(order_type_codes: Dict[str, int],
+        territory_codes: Dict[int, int]) -> None:
+    global _order_type_codes, _territory_codes
+    _order_type_codes = order_type_codes
+    _territory_codes = territory_codes
+
+
+# Count the n-grams of sequences of tokens, given the sequence of each token.
+# The tokens of a sequence are consecutive. Returns the sorted keys of the
+# n-grams and their counts
+def _get_ngram_counts(sequence_ids: np.ndarray,
+        tokens: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    keys: List[np.ndarray] = []
+    for length in range(1, MAX_NGRAM_LENGTH + 1):
+        # An n-gram must start and end in the same sequence
+        starts = np.flatnonzero(
+            sequence_ids[:len(tokens) - length + 1]
+            == sequence_ids[length - 1:])
+        length_keys = np.zeros(len(starts), dtype=np.int64)
+        for i in range(MAX_NGRAM_LENGTH):
+            length_keys <<= TOKEN_BITS
+            if i < length:
+                length_keys |= tokens[starts + i]
+        keys.append(length_keys)
+
+    return np.unique(np.concatenate(keys), return_counts=True)
+
+
+# Count the n-grams of the order sequences of a batch of Games. Each player's
+# Orders in a turn form one sequence. Returns the sorted keys of the n-grams
+# and their counts
+def _count_ngrams(game_ids: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+    orders = (
+        Order.objects
+            .filter(game_id__in=game_ids)
+            .order_by('game_id', 'turn_id', 'player_id', 'order_number')
+            .values_list('turn_id', 'player_id', 'order_type_id',
+                'primary_territory_id', 'secondary_territory_id')
+    )
+
+    sequence_ids = np.empty(len(orders), dtype=np.int64)
+    tokens = np.empty(len(orders), dtype=np.int64)
+    sequence_id = -1
+    last_sequence: Optional[Tuple[int, int]] = None
+    for i, (turn_id, player_id, order_type_id, primary_territory_id,
+            secondary_territory_id) in enumerate(orders):
+        if (turn_id, player_id) != last_sequence:
+            sequence_id += 1
+            last_sequence = (turn_id, player_id)
+
+        territory_id = (secondary_territory_id
+            if order_type_id in SECONDARY_TERRITORY_ORDER_TYPES
+            else primary_territory_id)
+        sequence_ids[i] = sequence_id
+        tokens[i] = (_order_type_codes[order_type_id] << TERRITORY_BITS) | (
+            _territory_codes.get(territory_id, 0))
+
+    return _get_ngram_counts(sequence_ids, tokens)
+
+
+# Sum the counts of the n-grams of two sorted indices
+def _merge_counts(keys: np.ndarray, counts: np.ndarray,
+        other_keys: np.ndarray,
+        other_counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    merged_keys, inverse = np.unique(np.concatenate([keys, other_keys]),
+        return_inverse=True)
+    merged_counts = np.bincount(inverse,
+        weights=np.concatenate([counts, other_counts]),
+        minlength=len(merged_keys))
+    return merged_keys, merged_counts.astype(np.int64)
+
+
+# Frequencies of the sequences of consecutive Orders of the players of a Map.
+# Each Order is a token of its order type's code in the high bits and the
+# code of its territory in the low bits. Codes start at 1, with territory
+# code 0 meaning the Order has no territory
+class OrderNgramIndex:
+    def __init__(self, map_id: int, order_type_ids: List[str],
+            territory_ids: List[int], keys: np.ndarray, counts: np.ndarray,
+            game_count: int) -> None:
+        self.map_id = map_id
+        self.order_type_ids = order_type_ids
+        self.territory_ids = territory_ids
+        self.keys = keys
+        self.counts = counts
+        self.game_count = game_count
+        self.order_type_codes = {
+            order_type_id: i + 1
+            for i, order_type_id in enumerate(order_type_ids)
+        }
+        self.territory_codes = {
+            territory_id: i + 1
+            for i, territory_id in enumerate(territory_ids)
+        }
+
+    # Encode an Order by its order type id and Territory id
+    def encode(self, order_type_id: str,
+            territory_id: Optional[int] = None) -> int:
+        if order_type_id not in self.order_type_codes:
+            raise ValueError(f'Unknown order type {order_type_id}.')
+        if territory_id is not None and (
+                territory_id not in self.territory_codes):
+            raise ValueError(
+                f'Territory {territory_id} is not on Map {self.map_id}.')
+
+        return (self.order_type_codes[order_type_id] << TERRITORY_BITS) | (
+            self.territory_codes[territory_id]
+            if territory_id is not None else 0)
+
+    # Decode a token into its order type id and Territory id
+    def decode(self, token: int) -> Tuple[str, Optional[int]]:
+        territory_code = token & ((1 << TERRITORY_BITS) - 1)
+        return (self.order_type_ids[(token >> TERRITORY_BITS) - 1],
+            self.territory_ids[territory_code - 1]
+                if territory_code else None)
+
+    # Get the number of times a sequence of tokens was ordered
+    def get_count(self, tokens: List[int]) -> int:
+        key = pack_tokens(tokens)
+        index = int(np.searchsorted(self.keys, key))
+        if index < len(self.keys) and self.keys[index] == key:
+            return int(self.counts[index])
+        return 0
+
+    # Get the most frequent n-grams starting with a sequence of tokens, most
+    # frequent first, optionally only those of a length. Without a prefix,
+    # the most frequent n-grams overall are returned
+    def get_most_frequent(self, prefix: List[int],
+            length: Optional[int] = None,
+            limit: int = 20) -> List[Tuple[List[int], int]]:
+        if prefix:
+            start_key = pack_tokens(prefix)
+            end_key = start_key + (
+                1 << (TOKEN_BITS * (MAX_NGRAM_LENGTH - len(prefix))))
+            start, end = np.searchsorted(self.keys, [start_key, end_key])
+        else:
+            start, end = 0, len(self.keys)
+
+        keys = self.keys[start:end]
+        counts = self.counts[start:end]
+        if length is not None:
+            is_length = _get_lengths(keys) == length
+            keys, counts = keys[is_length], counts[is_length]
+
+        # Ties are broken by key so results are deterministic
+        indices = np.lexsort((keys, -counts))[:limit]
+        return [(unpack_tokens(int(keys[i])), int(counts[i]))
+            for i in indices]
+
+    # Save the index, replacing any previous one only once the new one is
+    # fully written
+    def save(self) -> None:
+        path = get_order_ngrams_path(self.map_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = path + '.tmp'
+
+        with open(temporary_path, 'wb') as file:
+            np.savez(file,
+                order_type_ids=np.array(self.order_type_ids),
+                territory_ids=np.array(self.territory_ids, dtype=np.int64),
+                keys=self.keys,
+                counts=self.counts,
+                game_count=np.array(self.game_count))
+
+        os.replace(temporary_path, path)
+
+    # Load the index of a Map, or None if it has not been built
+    @staticmethod
+    def load(map_id: int) -> Optional['OrderNgramIndex']:
+        path = get_order_ngrams_path(map_id)
+        if not os.path.exists(path):
+            return None
+
+        with np.load(path) as data:
+            return OrderNgramIndex(map_id, data['order_type_ids'].tolist(),
+                data['territory_ids'].tolist(), data['keys'], data['counts'],
+                int(data['game_count']))
+
+
+# Build the order n-gram index of a Map from the Orders of all its Games.
+# Batches of Games are counted in parallel and merged as they finish.
+# Reports a 'batch' event with the number of Games processed to progress
+def build_order_ngrams(map_id: int, workers: int = 1,
+        games_per_batch: int = GAMES_PER_BATCH,
+        progress: Optional[ProgressCallback] = None) -> OrderNgramIndex:
+    order_type_ids = list(
+        OrderType.objects.order_by('id').values_list('id', flat=True))
+    territory_ids = cache.get_map_wrapper(map_id, False).territory_ids
+    if len(order_type_ids) >= 1 << ORDER_TYPE_BITS:
+        raise ValueError(
+            f'Order types do not fit in {ORDER_TYPE_BITS} bits.')
+    if len(territory_ids) >= 1 << TERRITORY_BITS:
+        raise ValueError(f'Map {map_id} has too many territories.')
+
+    game_ids = list(
+        Game.objects
+            .filter(template__map_id=map_id)
+            .order_by('id')
+            .values_list('id', flat=True)
+    )
+    batches = [game_ids[i:i + games_per_batch]
+        for i in range(0, len(game_ids), games_per_batch)]
+
+    logging.info(
+        f'Counting order n-grams of {len(game_ids)} games of Map {map_id} '
+        f'in {workers} processes'
+    )
+    index = OrderNgramIndex(map_id, order_type_ids, territory_ids,
+        np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+        len(game_ids))
+
+    # Each worker process must open its own DB connection
+    connections.close_all()
+    games_processed = 0
+    with ProcessPoolExecutor(workers, initializer=_set_codes,
+            initargs=(index.order_type_codes, index.territory_codes)
+            ) as executor:
+        for batch, (keys, counts) in zip(batches,
+                executor.map(_count_ngrams, batches)):
+            index.keys, index.counts = _merge_counts(index.keys,
+                index.counts, keys, counts)
+            games_processed += len(batch)
+            report(progress, 'batch', games_processed=games_processed,
+                ngrams=len(index.keys))
+
+    index.save()
+    logging.info(
+        f'Counted {len(index.keys)} distinct order n-grams of Map {map_id}')
+    return index
+
+
+# Parse a sequence of Orders written as comma separated order type ids, each
+# followed by a colon and a Territory id if the Order has one, into tokens
+def parse_tokens(index: OrderNgramIndex, text: str) -> List[int]:
+    tokens: List[int] = []
+    for order in filter(None, text.split(',')):
+        order_type_id, _, territory_id = order.strip().partition(':')
+        try:
+            tokens.append(index.encode(order_type_id,
+                int(territory_id) if territory_id else None))
+        except ValueError as e:
+            raise ValueError(f'Invalid order {order}: {e}')
+
+    if len(tokens) > MAX_NGRAM_LENGTH:
+        raise ValueError(
+            f'N-grams have at most {MAX_NGRAM_LENGTH} orders.')
+    return tokens
+
+
+# Get the most frequent order n-grams of a Map starting with a prefix
+def get_order_ngrams(index: OrderNgramIndex, prefix: List[int],
+        length: Optional[int] = None, limit: int = 20) -> Dict[str, Any]:
+    return {
+        'map_id': index.map_id,
+        'games': index.game_count,
+        'prefix_count': index.get_count(prefix) if prefix else None,
+        'ngrams': [
+            {
+                'orders': [
+                    dict(zip(['order_type_id', 'territory_id'],
+                        index.decode(token)))
+                    for token in tokens
+                ],
+                'count': count,
+            }
+            for tokens, count in index.get_most_frequent(prefix, length,
+                limit)
+        ],
+    }
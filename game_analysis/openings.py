@@ -0,0 +1,187 @@
+import logging
+
+from itertools import groupby
+from typing import Any, Dict, Iterable, List, Tuple
+
+from django.db import transaction
+from django.db.models import Count
+
+from .cache import get_in_distribution_baseline_state
+from .cache import get_wasteland_baseline_state
+from .models import AttackResult, Template, TemplateTerritoryPicks
+from .models import TerritoryBaseline
+from .ratings import WINNING_END_STATES
+
+# Order types of manual and automatic picks
+PICK_ORDER_TYPE = 'GameOrderPick'
+AUTO_PICK_ORDER_TYPE = 'GameOrderAutoPick'
+
+# Fields of Template Territory Picks that are totals over Games
+PICKS_TOTAL_FIELDS = ['games_in_distribution', 'games_wastelanded', 'picks',
+    'pick_priority_sum', 'successful_picks', 'auto_picks', 'wins']
+
+# Template and Territory ids of Template Territory Picks
+PicksKey = Tuple[int, int]
+
+# Template id, Territory id, Player id, order number, order type id,
+# whether it succeeded and the Player's end state id of a pick
+PickRow = Tuple[int, int, int, int, str, bool, str]
+
+
+# Get the Template Territory Picks to add to for a key, creating it if needed
+def _get_picks(picks_to_add: Dict[PicksKey, TemplateTerritoryPicks],
+        key: PicksKey) -> TemplateTerritoryPicks:
+    if key not in picks_to_add:
+        picks_to_add[key] = TemplateTerritoryPicks(template_id=key[0],
+            territory_id=key[1])
+    return picks_to_add[key]
+
+
+# Count baseline states of Territories, given their Template id, Territory id
+# and state, and the number of Games with them
+def _count_baselines(picks_to_add: Dict[PicksKey, TemplateTerritoryPicks],
+        baselines: Iterable[Tuple[int, int, str, int]]) -> None:
+    for template_id, territory_id, state, games in baselines:
+        picks = _get_picks(picks_to_add, (template_id, territory_id))
+        if state == get_in_distribution_baseline_state():
+            picks.games_in_distribution += games
+        elif state == get_wasteland_baseline_state():
+            picks.games_wastelanded += games
+
+
+# Count picks ordered by Player and order number. The priority of a manual
+# pick is its position among the manual picks of its Player
+def _count_picks(picks_to_add: Dict[PicksKey, TemplateTerritoryPicks],
+        pick_rows: Iterable[PickRow]) -> None:
+    for _, player_picks in groupby(pick_rows, lambda row: row[2]):
+        priority = 0
+        for (template_id, territory_id, _, _, order_type_id, is_successful,
+                end_state_id) in player_picks:
+            picks = _get_picks(picks_to_add, (template_id, territory_id))
+            if order_type_id == PICK_ORDER_TYPE:
+                priority += 1
+                picks.picks += 1
+                picks.pick_priority_sum += priority
+                picks.successful_picks += is_successful
+            else:
+                picks.auto_picks += 1
+
+            if is_successful and end_state_id in WINNING_END_STATES:
+                picks.wins += 1
+
+
+# Add totals to the Template Territory Picks with the same keys. Must be
+# called in a transaction that has already written to the DB, which stops
+# concurrent imports from updating the same rows
+def _add_picks(picks_to_add: Dict[PicksKey, TemplateTerritoryPicks]) -> None:
+    if not picks_to_add:
+        return
+
+    existing_picks = {
+        (picks.template_id, picks.territory_id): picks
+        for picks in TemplateTerritoryPicks.objects.filter(
+            template_id__in={key[0] for key in picks_to_add},
+            territory_id__in={key[1] for key in picks_to_add})
+    }
+
+    picks_to_update: List[TemplateTerritoryPicks] = []
+    picks_to_create: List[TemplateTerritoryPicks] = []
+    for key, picks in picks_to_add.items():
+        existing = existing_picks.get(key)
+        if existing:
+            for field in PICKS_TOTAL_FIELDS:
+                setattr(existing, field,
+                    getattr(existing, field) + getattr(picks, field))
+            picks_to_update.append(existing)
+        else:
+            picks_to_create.append(picks)
+
+    TemplateTerritoryPicks.objects.bulk_update(picks_to_update,
+        PICKS_TOTAL_FIELDS)
+    TemplateTerritoryPicks.objects.bulk_create(picks_to_create)
+
+
+# Add the Territory Baselines and picks of newly imported Games to the
+# opening index
+def add_imported_games(territory_baselines: Iterable[TerritoryBaseline],
+        attack_results: Iterable[AttackResult]) -> None:
+    picks_to_add: Dict[PicksKey, TemplateTerritoryPicks] = {}
+    _count_baselines(picks_to_add, (
+        (baseline.game.template_id, baseline.territory_id, baseline.state, 1)
+        for baseline in territory_baselines
+    ))
+    _count_picks(picks_to_add, sorted(
+        (
+            (
+                attack_result.order.game.template_id,
+                attack_result.order.primary_territory_id,
+                attack_result.order.player_id,
+                attack_result.order.order_number,
+                attack_result.order.order_type_id,
+                attack_result.is_successful,
+                attack_result.order.player.end_state_id
+            )
+            for attack_result in attack_results
+            if attack_result.order.order_type_id in [PICK_ORDER_TYPE,
+                AUTO_PICK_ORDER_TYPE]
+        ),
+        key=lambda row: (row[2], row[3])
+    ))
+    _add_picks(picks_to_add)
+
+
+# Rebuild the opening index from the Territory Baselines and picks of all
+# imported Games
+def rebuild_openings() -> None:
+    logging.info('Rebuilding opening index')
+
+    with transaction.atomic():
+        TemplateTerritoryPicks.objects.all().delete()
+
+        picks_to_add: Dict[PicksKey, TemplateTerritoryPicks] = {}
+        _count_baselines(picks_to_add,
+            TerritoryBaseline.objects
+                .values_list('game__template_id', 'territory_id', 'state')
+                .annotate(games=Count('id'))
+                .order_by()
+        )
+        _count_picks(picks_to_add,
+            AttackResult.objects
+                .filter(order__order_type_id__in=[PICK_ORDER_TYPE,
+                    AUTO_PICK_ORDER_TYPE])
+                .order_by('order__player_id', 'order__order_number')
+                .values_list('order__game__template_id',
+                    'order__primary_territory_id', 'order__player_id',
+                    'order__order_number', 'order__order_type_id',
+                    'is_successful', 'order__player__end_state_id')
+                .iterator()
+        )
+        TemplateTerritoryPicks.objects.bulk_create(picks_to_add.values())
+
+
+# Get the picks and results of each Territory of a Template, most picked
+# first. Picks per game are over the Games the Territory was in distribution
+def get_template_openings(template: Template) -> Dict[str, Any]:
+    territories: List[Dict[str, Any]] = []
+    for picks in (
+            template.territory_picks
+                .select_related('territory')
+                .order_by('-picks', '-auto_picks', 'territory_id')):
+        starts = picks.successful_picks + picks.auto_picks
+        territories.append({
+            'territory_id': picks.territory_id,
+            'name': picks.territory.name,
+            'games_in_distribution': picks.games_in_distribution,
+            'games_wastelanded': picks.games_wastelanded,
+            'picks': picks.picks,
+            'picks_per_game': (picks.picks / picks.games_in_distribution
+                if picks.games_in_distribution else None),
+            'mean_pick_priority': (picks.pick_priority_sum / picks.picks
+                if picks.picks else None),
+            'successful_picks': picks.successful_picks,
+            'auto_picks': picks.auto_picks,
+            'wins': picks.wins,
+            'win_rate': picks.wins / starts if starts else None,
+        })
+
+    return {'template_id': template.id, 'territories': territories}
@@ -0,0 +1,218 @@
+import logging
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+
+from .models import AttackResult, Player, PlayerAccount, PlayerIncomeByTurn
+from .models import PlayerState, PlayerStatistics
+from .ratings import LOSING_END_STATES, WINNING_END_STATES
+
+# Fields of Player Statistics that are totals over Games
+STATISTICS_TOTAL_FIELDS = ['games', 'wins', 'losses', 'attacks',
+    'offense_luck_sum', 'defense_luck_sum']
+
+# Add Player States and income to the income of Player Accounts by turn,
+# creating any rows that do not exist
+INCREMENT_PLAYER_INCOME_BY_TURN_SQL = f'''
+    insert into {PlayerIncomeByTurn._meta.db_table}
+        (player_account_id, turn_number, player_states, income_sum)
+    values (%s, %s, %s, %s)
+    on conflict (player_account_id, turn_number)
+    do update set
+        player_states = player_states + excluded.player_states,
+        income_sum = income_sum + excluded.income_sum
+'''
+
+# Player Account, Ladder and Template ids of Player Statistics
+StatisticsKey = Tuple[int, Optional[int], int]
+
+
+# Get the Player Statistics key of a Player
+def _get_statistics_key(player: Player) -> StatisticsKey:
+    return (player.player_id, player.game.ladder_id, player.game.template_id)
+
+
+# Add totals to the Player Statistics with the same keys. Must be called in a
+# transaction that has already written to the DB, which stops concurrent
+# imports from updating the same rows
+def _add_statistics(
+        statistics_to_add: Dict[StatisticsKey, PlayerStatistics]) -> None:
+    if not statistics_to_add:
+        return
+
+    existing_statistics = {
+        (s.player_account_id, s.ladder_id, s.template_id): s
+        for s in PlayerStatistics.objects.filter(
+            player_account_id__in={key[0] for key in statistics_to_add},
+            template_id__in={key[2] for key in statistics_to_add})
+    }
+
+    statistics_to_update: List[PlayerStatistics] = []
+    statistics_to_create: List[PlayerStatistics] = []
+    for key, statistics in statistics_to_add.items():
+        existing = existing_statistics.get(key)
+        if existing:
+            for field in STATISTICS_TOTAL_FIELDS:
+                setattr(existing, field,
+                    getattr(existing, field) + getattr(statistics, field))
+            statistics_to_update.append(existing)
+        else:
+            statistics_to_create.append(statistics)
+
+    PlayerStatistics.objects.bulk_update(statistics_to_update,
+        STATISTICS_TOTAL_FIELDS)
+    PlayerStatistics.objects.bulk_create(statistics_to_create)
+
+
+# Add the results and attacks of newly imported Players to their Player
+# Accounts' statistics
+def add_imported_games(players: Iterable[Player],
+        attack_results: Iterable[AttackResult]) -> None:
+    statistics_to_add: Dict[StatisticsKey, PlayerStatistics] = {}
+
+    # Get the statistics to add for a Player
+    def get_statistics(player: Player) -> PlayerStatistics:
+        key = _get_statistics_key(player)
+        if key not in statistics_to_add:
+            statistics_to_add[key] = PlayerStatistics(
+                player_account_id=key[0], ladder_id=key[1],
+                template_id=key[2])
+        return statistics_to_add[key]
+
+    for player in players:
+        statistics = get_statistics(player)
+        statistics.games += 1
+        if player.end_state_id in WINNING_END_STATES:
+            statistics.wins += 1
+        elif player.end_state_id in LOSING_END_STATES:
+            statistics.losses += 1
+
+    # Picks are not attacks and have no luck
+    for attack_result in attack_results:
+        if attack_result.is_attack and attack_result.offense_luck is not None:
+            statistics = get_statistics(attack_result.order.player)
+            statistics.attacks += 1
+
+    _add_statistics(statistics_to_add)
+
+
+# Add the offense and defense luck of newly aggregated attacks to the luck
+# sums of their Player Accounts' statistics
+def add_luck_sums(luck_sums: Dict[StatisticsKey, Tuple[float, float]]) -> None:
+    _add_statistics({
+        key: PlayerStatistics(player_account_id=key[0], ladder_id=key[1],
+            template_id=key[2], offense_luck_sum=offense_luck_sum,
+            defense_luck_sum=defense_luck_sum)
+        for key, (offense_luck_sum, defense_luck_sum) in luck_sums.items()
+    })
+
+
+# Add the incomes of newly calculated Player States to their Player Accounts'
+# income by turn
+def add_player_states(player_states: Iterable[PlayerState]) -> None:
+    totals: Dict[Tuple[int, int], List[int]] = {}
+    for player_state in player_states:
+        key = (player_state.player.player_id, player_state.turn_number)
+        total = totals.setdefault(key, [0, 0])
+        total[0] += 1
+        total[1] += player_state.income
+
+    if not totals:
+        return
+
+    with transaction.atomic(), connection.cursor() as c:
+        c.executemany(INCREMENT_PLAYER_INCOME_BY_TURN_SQL, [
+            (player_account_id, turn_number, player_state_count, income_sum)
+            for (player_account_id, turn_number),
+                (player_state_count, income_sum) in totals.items()
+        ])
+
+
+# Rebuild the statistics and income by turn of all Player Accounts from the
+# imported and calculated data
+def rebuild_player_statistics() -> None:
+    logging.info('Rebuilding Player Statistics')
+
+    with transaction.atomic():
+        PlayerStatistics.objects.all().delete()
+        PlayerIncomeByTurn.objects.all().delete()
+
+        statistics: Dict[StatisticsKey, PlayerStatistics] = {}
+        for row in (
+                Player.objects
+                    .values('player_id', 'game__ladder_id',
+                        'game__template_id')
+                    .annotate(
+                        games=Count('id'),
+                        wins=Count('id',
+                            filter=Q(end_state_id__in=WINNING_END_STATES)),
+                        losses=Count('id',
+                            filter=Q(end_state_id__in=LOSING_END_STATES)))
+                    .order_by()):
+            key = (row['player_id'], row['game__ladder_id'],
+                row['game__template_id'])
+            statistics[key] = PlayerStatistics(player_account_id=key[0],
+                ladder_id=key[1], template_id=key[2], games=row['games'],
+                wins=row['wins'], losses=row['losses'])
+
+        for row in (
+                AttackResult.objects
+                    .filter(is_attack=True, offense_luck__isnull=False)
+                    .values('order__player__player_id',
+                        'order__game__ladder_id', 'order__game__template_id')
+                    .annotate(attacks=Count('pk'),
+                        offense_luck_sum=Sum('offense_luck',
+                            filter=Q(attack_size__gt=0)),
+                        defense_luck_sum=Sum('defense_luck',
+                            filter=Q(attack_size__gt=0)))
+                    .order_by()):
+            key = (row['order__player__player_id'],
+                row['order__game__ladder_id'],
+                row['order__game__template_id'])
+            statistics[key].attacks = row['attacks']
+            statistics[key].offense_luck_sum = row['offense_luck_sum'] or 0
+            statistics[key].defense_luck_sum = row['defense_luck_sum'] or 0
+
+        PlayerStatistics.objects.bulk_create(statistics.values())
+        PlayerIncomeByTurn.objects.bulk_create(
+            PlayerIncomeByTurn(player_account_id=row['player__player_id'],
+                turn_number=row['turn_number'],
+                player_states=row['player_states'],
+                income_sum=row['income_sum'])
+            for row in (
+                PlayerState.objects
+                    .values('player__player_id', 'turn_number')
+                    .annotate(player_states=Count('id'),
+                        income_sum=Sum('income'))
+                    .order_by()
+            )
+        )
+
+
+# Get the statistics and mean income by turn of a Player Account
+def get_player_account_statistics(
+        player_account: PlayerAccount) -> Dict[str, Any]:
+    return {
+        'id': player_account.id,
+        'name': player_account.name,
+        'statistics': [
+            {
+                'ladder_id': s.ladder_id,
+                'template_id': s.template_id,
+                'games': s.games,
+                'wins': s.wins,
+                'losses': s.losses,
+                'attacks': s.attacks,
+                'offense_luck_sum': s.offense_luck_sum,
+                'defense_luck_sum': s.defense_luck_sum,
+            }
+            for s in player_account.statistics.order_by('ladder_id',
+                'template_id')
+        ],
+        'mean_income_by_turn': {
+            i.turn_number: i.income_sum / i.player_states
+            for i in player_account.income_by_turn.order_by('turn_number')
+        },
+    }
@@ -0,0 +1,12 @@
+from typing import Any, Callable, Dict, Optional
+
+# Callback that receives the name and data of each progress event reported by
+# a long-running import or calculation
+ProgressCallback = Callable[[str, Dict[str, Any]], None]
+
+
+# Report a progress event to the callback if there is one
+def report(progress: Optional[ProgressCallback], event: str,
+        **data: Any) -> None:
+    if progress:
+        progress(event, data)
@@ -3,16 +3,16 @@ library(dbplyr)
 library(ggplot2)
 library(caret)
 
-# connect to the sqlite file
-con <- dbConnect(drv=SQLite(), dbname="Workspace/warzone/db.sqlite3")
-
-# get the turn_state view as a data.frame
-turn_states <- dbGetQuery( con,'select * from game_analysis_turn_state limit 10000') %>% 
+# get a random sample of turn states from the training games as a data.frame.
+# Games are split between the training and test sets, so no game is in both
+turn_states <- read.csv('http://localhost:8000/turn-states/sample?size=10000&split=train') %>% 
+   select(-template_id) %>% 
   mutate(result = ifelse(p1_winner > 0.5, "Winner", "Loser") %>% factor()) %>% 
    select(-p1_winner) %>% as_tibble()
   
 
-test_set <- dbGetQuery( con,'select * from game_analysis_turn_state limit 10000 offset 10000') %>% 
+test_set <- read.csv('http://localhost:8000/turn-states/sample?size=10000&split=test') %>% 
+  select(-template_id) %>% 
   mutate(result = ifelse(p1_winner > 0.5, "Winner", "Loser") %>% factor()) %>% 
   # select(-game_id, -p1_winner)
   select(-p1_winner)
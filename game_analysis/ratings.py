@@ -0,0 +1,236 @@
+import logging
+import os
+import numpy as np
+
+from collections import defaultdict
+from datetime import datetime
+from typing import DefaultDict, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Game, Player
+from .progress import ProgressCallback, report
+
+INITIAL_RATING = 1500.0
+K_FACTOR = 32.0
+
+# Rating difference at which the stronger side is expected to win 10 times
+# as often
+RATING_SCALE = 400.0
+
+# End states of Players who won or lost a game. Players who declined or were
+# removed, and games ended by vote, do not change ratings
+WINNING_END_STATES = {'Won'}
+LOSING_END_STATES = {'SurrenderAccepted', 'Booted', 'Eliminated'}
+
+# Number of Games read from the DB at a time
+GAMES_PER_BATCH = 1000
+
+# Number of batches between checkpoints of the ratings
+BATCHES_PER_CHECKPOINT = 10
+
+
+# Get the default path of the ratings checkpoint
+def get_default_ratings_path() -> str:
+    return os.path.join(settings.ANALYSIS_DATA_DIR, 'ratings.npz')
+
+
+# Elo ratings of Player Accounts, with the end time and id of the last Game
+# applied to them and the number of Games applied
+class Ratings:
+    def __init__(self, player_ids: np.ndarray, ratings: np.ndarray,
+            games_played: np.ndarray,
+            last_end_date_time: Optional[datetime] = None,
+            last_game_id: int = 0, games_applied: int = 0) -> None:
+        self.player_ids = player_ids
+        self.ratings = ratings
+        self.games_played = games_played
+        self.last_end_date_time = last_end_date_time
+        self.last_game_id = last_game_id
+        self.games_applied = games_applied
+        self.indices: Dict[int, int] = {
+            player_id: i for i, player_id in enumerate(player_ids.tolist())}
+
+    # Get the number of rated Player Accounts
+    def get_player_count(self) -> int:
+        return len(self.indices)
+
+    # Get the index of a Player Account's rating, adding it if it is new.
+    # The arrays grow by doubling so adding players is amortized O(1)
+    def _get_index(self, player_id: int) -> int:
+        index = self.indices.get(player_id)
+        if index is not None:
+            return index
+
+        index = len(self.indices)
+        if index == len(self.player_ids):
+            capacity = max(2 * len(self.player_ids), 1024)
+            self.player_ids = np.resize(self.player_ids, capacity)
+            self.ratings = np.resize(self.ratings, capacity)
+            self.games_played = np.resize(self.games_played, capacity)
+
+        self.indices[player_id] = index
+        self.player_ids[index] = player_id
+        self.ratings[index] = INITIAL_RATING
+        self.games_played[index] = 0
+        return index
+
+    # Get the rating of a Player Account, or None if it is not rated
+    def get_rating(self, player_id: int) -> Optional[float]:
+        index = self.indices.get(player_id)
+        return None if index is None else float(self.ratings[index])
+
+    # Update the ratings of the players of a Game. Each side is rated by the
+    # mean rating of its players
+    def apply_game(self, winner_ids: List[int], loser_ids: List[int]) -> None:
+        winner_indices = [self._get_index(i) for i in winner_ids]
+        loser_indices = [self._get_index(i) for i in loser_ids]
+        winner_rating = self.ratings[winner_indices].mean()
+        loser_rating = self.ratings[loser_indices].mean()
+
+        expected_win = 1 / (
+            1 + 10 ** ((loser_rating - winner_rating) / RATING_SCALE))
+        change = K_FACTOR * (1 - expected_win)
+        self.ratings[winner_indices] += change
+        self.ratings[loser_indices] -= change
+        self.games_played[winner_indices + loser_indices] += 1
+
+    # Save the ratings, replacing any previous checkpoint only once the new
+    # one is fully written
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        player_count = self.get_player_count()
+        temporary_path = path + '.tmp'
+
+        with open(temporary_path, 'wb') as file:
+            np.savez(file,
+                player_ids=self.player_ids[:player_count],
+                ratings=self.ratings[:player_count],
+                games_played=self.games_played[:player_count],
+                last_end_date_time=np.array(
+                    self.last_end_date_time.isoformat()
+                    if self.last_end_date_time else ''),
+                last_game_id=np.array(self.last_game_id),
+                games_applied=np.array(self.games_applied))
+
+        os.replace(temporary_path, path)
+
+    # Load saved ratings, or empty ratings if there is no checkpoint
+    @staticmethod
+    def load(path: str) -> 'Ratings':
+        if not os.path.exists(path):
+            return Ratings.create_empty()
+
+        with np.load(path) as data:
+            last_end_date_time = str(data['last_end_date_time'])
+            return Ratings(data['player_ids'], data['ratings'],
+                data['games_played'],
+                datetime.fromisoformat(last_end_date_time)
+                    if last_end_date_time else None,
+                int(data['last_game_id']),
+                int(data['games_applied']))
+
+    # Create ratings without any players or games
+    @staticmethod
+    def create_empty() -> 'Ratings':
+        return Ratings(np.empty(0, dtype=np.int64), np.empty(0),
+            np.empty(0, dtype=np.int32))
+
+
+# Get the filter of ended Games up to and including the last Game applied
+def _get_applied_games_filter(ratings: Ratings) -> Q:
+    return (
+        Q(end_date_time__lt=ratings.last_end_date_time)
+        | Q(end_date_time=ratings.last_end_date_time,
+            id__lte=ratings.last_game_id)
+    )
+
+
+# Get batches of the ids and end times of the ended Games after the last Game
+# applied to the ratings, in the order they ended. Each batch must be applied
+# before the next one is read
+def _get_new_games(
+        ratings: Ratings) -> Iterator[List[Tuple[int, datetime]]]:
+    while True:
+        games = Game.objects.filter(end_date_time__isnull=False)
+        if ratings.last_end_date_time:
+            games = games.exclude(_get_applied_games_filter(ratings))
+
+        batch = list(
+            games
+                .order_by('end_date_time', 'id')
+                .values_list('id', 'end_date_time')[:GAMES_PER_BATCH]
+        )
+        if not batch:
+            return
+
+        yield batch
+
+
+# Apply the Games that ended after the last checkpoint to the ratings and
+# save them. If rebuild is set, or Games that ended before the last Game
+# applied were imported since, rates all Games from the start. Reports a
+# 'batch' event for each batch of Games to progress. Returns the number of
+# Games applied
+def update_ratings(path: Optional[str] = None, rebuild: bool = False,
+        progress: Optional[ProgressCallback] = None) -> int:
+    path = path or get_default_ratings_path()
+    ratings = Ratings.create_empty() if rebuild else Ratings.load(path)
+    logging.info(
+        f'Updating ratings of {ratings.get_player_count()} players from '
+        f'Games ending after {ratings.last_end_date_time}'
+    )
+
+    # Games imported since the last update may have ended before the last
+    # Game applied. Ratings depend on the order Games are applied in, so they
+    # are rebuilt to apply them in the order they ended
+    if ratings.last_end_date_time:
+        late_game_count = Game.objects.filter(
+            _get_applied_games_filter(ratings)).count() - ratings.games_applied
+        if late_game_count > 0:
+            logging.info(
+                f'{late_game_count} Games ended before the last Game applied '
+                f'to the ratings. Rebuilding the ratings.'
+            )
+            ratings = Ratings.create_empty()
+
+    games_processed = 0
+    games_rated = 0
+    for batch_number, games in enumerate(_get_new_games(ratings), 1):
+        game_players: DefaultDict[int, List[Tuple[int, str]]] = (
+            defaultdict(list))
+        for game_id, player_id, end_state_id in (
+                Player.objects
+                    .filter(game_id__in=[game_id for game_id, _ in games])
+                    .values_list('game_id', 'player_id', 'end_state_id')):
+            game_players[game_id].append((player_id, end_state_id))
+
+        for game_id, end_date_time in games:
+            players = game_players[game_id]
+            winner_ids = [player_id for player_id, end_state in players
+                if end_state in WINNING_END_STATES]
+            loser_ids = [player_id for player_id, end_state in players
+                if end_state in LOSING_END_STATES]
+
+            if winner_ids and loser_ids:
+                ratings.apply_game(winner_ids, loser_ids)
+                games_rated += 1
+
+            ratings.last_end_date_time = end_date_time
+            ratings.last_game_id = game_id
+            ratings.games_applied += 1
+
+        games_processed += len(games)
+        report(progress, 'batch', games_processed=games_processed,
+            games_rated=games_rated)
+
+        if batch_number % BATCHES_PER_CHECKPOINT == 0:
+            ratings.save(path)
+
+    ratings.save(path)
+    logging.info(
+        f'Rated {games_rated} of {games_processed} Games. '
+        f'{ratings.get_player_count()} players are rated.'
+    )
+    return games_processed
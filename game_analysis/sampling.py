@@ -0,0 +1,122 @@
+import csv
+import io
+import numpy as np
+
+from typing import List, Optional
+
+from django.db.models.query import QuerySet
+
+from .export import TURN_STATE_COLUMN_NAMES, TURN_STATE_DTYPE
+from .export import iterate_chunks
+from .models import Game
+
+TRAIN = 'train'
+TEST = 'test'
+
+# Columns Turn States can be stratified by
+STRATA = ['turn_number', 'template_id', 'p1_winner']
+
+# Sampled Turn State record with the Template id of its Game
+SAMPLE_DTYPE = np.dtype(TURN_STATE_DTYPE.descr + [('template_id', 'i4')])
+
+
+# Mix the bits of 64 bit integers so that nearby values have unrelated
+# hashes
+def _mix(values: np.ndarray) -> np.ndarray:
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    hashes: np.ndarray = values ^ (values >> np.uint64(31))
+    return hashes
+
+
+# Get whether each game is in the held-out test split. Games are assigned by
+# a hash of their id, so all turns of a game are in the same split
+def is_test_game(game_ids: np.ndarray, test_fraction: float) -> np.ndarray:
+    hashes = game_ids.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    is_test: np.ndarray = (
+        (hashes >> np.uint64(11)) < np.uint64(test_fraction * 2 ** 53))
+    return is_test
+
+
+# Get the random key of each Turn State. Keys depend only on the game, turn
+# and seed, so a sample does not depend on the order rows are stored in
+def _get_random_keys(turn_states: np.ndarray, seed: int) -> np.ndarray:
+    ids = ((turn_states['game_id'].astype(np.uint64) << np.uint64(16))
+        | turn_states['turn_number'].astype(np.uint16).astype(np.uint64))
+    return _mix(ids ^ _mix(np.array([seed], dtype=np.uint64)))
+
+
+# Add the Template ids of the Games of Turn States
+def _add_template_ids(turn_states: np.ndarray, game_ids: np.ndarray,
+        template_ids: np.ndarray) -> np.ndarray:
+    records = np.zeros(len(turn_states), dtype=SAMPLE_DTYPE)
+    for name in TURN_STATE_COLUMN_NAMES:
+        records[name] = turn_states[name]
+
+    if len(game_ids):
+        indices = np.minimum(
+            np.searchsorted(game_ids, turn_states['game_id']),
+            len(game_ids) - 1)
+        records['template_id'] = template_ids[indices]
+    return records
+
+
+# Sample Turn States uniformly at random without replacement in one pass, or
+# up to size Turn States from each stratum of the given columns. Each Turn
+# State has a random key and the sample is the Turn States with the smallest
+# keys, which is kept as a reservoir while the rows are read. If a split is
+# given, only Turn States of Games in that split are sampled, so train and
+# test samples never share a Game. Returns the sample ordered by game and turn
+def sample_turn_states(turn_states: QuerySet, size: int,
+        stratify_by: Optional[List[str]] = None,
+        split: Optional[str] = None, test_fraction: float = 0.2,
+        seed: int = 0, chunk_size: int = 100000) -> np.ndarray:
+    stratify_by = stratify_by or []
+    if any(name not in STRATA for name in stratify_by):
+        raise ValueError(f'Turn States can only be stratified by {STRATA}.')
+    if split not in [None, TRAIN, TEST]:
+        raise ValueError(f'Unknown split {split}.')
+
+    games = np.array(
+        list(Game.objects.order_by('id').values_list('id', 'template_id')),
+        dtype=np.int64).reshape(-1, 2)
+    game_ids, template_ids = games[:, 0], games[:, 1]
+
+    sample = np.empty(0, dtype=SAMPLE_DTYPE)
+    keys = np.empty(0, dtype=np.uint64)
+    for chunk in iterate_chunks(turn_states, chunk_size):
+        records = np.array(chunk, dtype=TURN_STATE_DTYPE)
+        if split is not None:
+            records = records[
+                is_test_game(records['game_id'], test_fraction)
+                == (split == TEST)]
+
+        sample = np.concatenate([sample,
+            _add_template_ids(records, game_ids, template_ids)])
+        keys = np.concatenate([keys, _get_random_keys(records, seed)])
+
+        # Keep the rows with the smallest keys of each stratum
+        order = np.lexsort(
+            [keys] + [sample[name] for name in reversed(stratify_by)])
+        sample, keys = sample[order], keys[order]
+        is_stratum_start = np.zeros(len(sample), dtype=bool)
+        is_stratum_start[:1] = True
+        for name in stratify_by:
+            is_stratum_start[1:] |= sample[name][1:] != sample[name][:-1]
+        stratum_starts = np.maximum.accumulate(
+            np.where(is_stratum_start, np.arange(len(sample)), 0))
+        is_kept = np.arange(len(sample)) - stratum_starts < size
+        sample, keys = sample[is_kept], keys[is_kept]
+
+    return sample[np.lexsort((sample['turn_number'], sample['game_id']))]
+
+
+# Get sampled Turn States as CSV text
+def get_sample_csv(sample: np.ndarray) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(TURN_STATE_COLUMN_NAMES + ['template_id'])
+    writer.writerows(sample.tolist())
+    return buffer.getvalue()
@@ -0,0 +1,256 @@
+import logging
+import time
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from django.db.models import Prefetch
+
+from . import cache
+from .calculate_game_data import replay_game
+from .models import Game, Order, Template
+from .progress import ProgressCallback, report
+from .wrappers import GameWrapper, MapArrays
+
+# Owner of neutral territories
+NEUTRAL = -1
+
+# Number of turns a rollout is simulated for before it counts as a draw
+MAX_ROLLOUT_TURNS = 100
+
+# Lowest probability of success of the attacks made by the rollout policy
+MIN_ATTACK_SUCCESS_PROBABILITY = 0.6
+
+# Number of rollouts simulated together by a worker process
+ROLLOUTS_PER_BATCH = 100
+
+# Largest number of armies, used to rule out territories as attack targets
+NO_TARGET = np.iinfo(np.int64).max
+
+
+# Owner and armies of each territory at the end of a turn of a Game. Owners
+# are indices of the Player ids
+class Position:
+    def __init__(self, player_ids: List[int], owners: np.ndarray,
+            armies: np.ndarray, turn_number: int) -> None:
+        self.player_ids = player_ids
+        self.owners = owners
+        self.armies = armies
+        self.turn_number = turn_number
+
+
+# Position, map and Template the rollouts of a worker process start from
+_position: Optional[Position] = None
+_map_arrays: Optional[MapArrays] = None
+_template: Optional[Template] = None
+_max_turns = MAX_ROLLOUT_TURNS
+
+
+# Get the Position of a Game at the end of a turn by replaying its Orders.
+# Territories are in the order of the dense indices of the Map's wrapper.
+# Neutral territories start with the armies of their baseline state. Armies
+# neutrals lose in failed attacks are not replayed
+def get_position(game_id: int, turn_number: int) -> Position:
+    game = (
+        Game.objects
+            .prefetch_related(
+                'player_set',
+                'turn_set',
+                Prefetch('order_set',
+                    queryset=Order.objects.select_related('attackresult')),
+                'playerstate_set',
+                'territorybaseline_set'
+            )
+            .get(pk=game_id)
+    )
+    template = cache.get_template(game.template_id)
+    map_wrapper = cache.get_map_wrapper(template.map_id, False)
+
+    owners = np.full(len(map_wrapper.territory_ids), NEUTRAL, dtype=np.int8)
+    armies = np.full(len(map_wrapper.territory_ids),
+        template.out_distribution_neutrals, dtype=np.int64)
+    for baseline in game.territorybaseline_set.all():
+        armies[map_wrapper.territory_indices[baseline.territory_id]] = (
+            template.wasteland_size
+            if baseline.state == cache.get_wasteland_baseline_state()
+            else template.in_distribution_neutrals)
+
+    for turn_wrapper, players_state in replay_game(GameWrapper(game)):
+        if turn_wrapper.turn.turn_number == turn_number:
+            break
+    else:
+        raise ValueError(f'Game {game_id} has no turn {turn_number}.')
+
+    player_ids = sorted(players_state)
+    for i, player_id in enumerate(player_ids):
+        for territory_id, territory_armies in (
+                players_state[player_id].territories.items()):
+            owners[map_wrapper.territory_indices[territory_id]] = i
+            armies[map_wrapper.territory_indices[territory_id]] = (
+                territory_armies)
+
+    return Position(player_ids, owners, armies, turn_number)
+
+
+# Set the position the rollouts of a worker process start from
+def _set_rollout_position(position: Position, map_arrays: MapArrays,
+        template: Template, max_turns: int) -> None:
+    global _position, _map_arrays, _template, _max_turns
+    _position = position
+    _map_arrays = map_arrays
+    _template = template
+    _max_turns = max_turns
+
+
+# Play a turn of a player in every rollout with a simple policy. The player
+# deploys their income on a random territory bordering another owner, then
+# each territory held at the start of the turn attacks its weakest neighbor
+# with every army that can leave it, if the attack is likely to succeed
+def _play_turn(rng: np.random.Generator, owners: np.ndarray,
+        armies: np.ndarray, player: int) -> None:
+    assert _map_arrays is not None and _template is not None
+    owned = owners == player
+    incomes = _template.base_income + _map_arrays.get_bonus_income(owned)
+
+    is_border = _map_arrays.get_border_mask(owned)
+    deployed_territories = np.argmax(
+        np.where(is_border, rng.random(is_border.shape), -1.0), axis=1)
+    rows = np.flatnonzero(is_border.any(axis=1))
+    armies[rows, deployed_territories[rows]] += incomes[rows]
+
+    guard = 1 if _template.is_one_army_stand_guard else 0
+    for territory in rng.permutation(
+            _map_arrays.get_territory_count()).tolist():
+        territory_neighbors = _map_arrays.get_neighbors(territory)
+        rows = np.flatnonzero(owned[:, territory]
+            & (owners[:, territory] == player)
+            & (armies[:, territory] > guard))
+        if not len(territory_neighbors) or not len(rows):
+            continue
+
+        neighbor_armies = np.where(
+            owners[rows[:, None], territory_neighbors] != player,
+            armies[rows[:, None], territory_neighbors], NO_TARGET)
+        target_indices = np.argmin(neighbor_armies, axis=1)
+        defenders = neighbor_armies[np.arange(len(rows)), target_indices]
+        attackers = armies[rows, territory] - guard
+
+        has_target = defenders != NO_TARGET
+        rows, target_indices = rows[has_target], target_indices[has_target]
+        attackers, defenders = attackers[has_target], defenders[has_target]
+        if not len(rows):
+            continue
+
+        tables = cache.get_combat_tables(_template,
+            int(max(attackers.max(), defenders.max())))
+        is_attack = (tables.get_success_probability(attackers, defenders)
+            >= MIN_ATTACK_SUCCESS_PROBABILITY)
+        rows, target_indices = rows[is_attack], target_indices[is_attack]
+        attackers, defenders = attackers[is_attack], defenders[is_attack]
+        if not len(rows):
+            continue
+
+        targets = territory_neighbors[target_indices]
+        defenders_killed, attackers_killed = tables.sample_kills(rng,
+            attackers, defenders)
+        is_successful = (
+            (defenders_killed == defenders) & (attackers_killed < attackers))
+        survivors = attackers - attackers_killed
+        armies[rows, territory] -= attackers
+
+        won, lost = is_successful, ~is_successful
+        owners[rows[won], targets[won]] = player
+        armies[rows[won], targets[won]] = survivors[won]
+        armies[rows[lost], territory] += survivors[lost]
+        armies[rows[lost], targets[lost]] -= defenders_killed[lost]
+
+
+# Simulate a batch of rollouts from the worker's position. Returns the number
+# of rollouts won by each player, followed by the number that reached the
+# turn limit without a winner
+def _run_rollouts(seed_sequence: np.random.SeedSequence,
+        rollout_count: int) -> np.ndarray:
+    assert _position is not None
+    rng = np.random.default_rng(seed_sequence)
+    player_count = len(_position.player_ids)
+    results = np.zeros(player_count + 1, dtype=np.int64)
+
+    owners = np.tile(_position.owners, (rollout_count, 1))
+    armies = np.tile(_position.armies, (rollout_count, 1))
+    for turn in range(_max_turns):
+        # Alternate which player moves first
+        for i in range(player_count):
+            _play_turn(rng, owners, armies, (turn + i) % player_count)
+
+        # A rollout is over when only one player holds any territories
+        territory_counts = np.stack(
+            [np.count_nonzero(owners == player, axis=1)
+                for player in range(player_count)],
+            axis=1)
+        is_over = np.count_nonzero(territory_counts, axis=1) <= 1
+        results[:player_count] += np.bincount(
+            territory_counts[is_over].argmax(axis=1), minlength=player_count)
+
+        owners, armies = owners[~is_over], armies[~is_over]
+        if not len(owners):
+            break
+
+    results[player_count] += len(owners)
+    return results
+
+
+# Estimate the win probability of each player of a Position by simulating
+# the rest of the game. Batches of rollouts are simulated in parallel, each
+# seeded from its own child of the seed, so the results do not depend on the
+# number of workers. Reports a 'batch' event with the rollouts per second for
+# each batch simulated to progress
+def evaluate_position(position: Position, map_arrays: MapArrays,
+        template: Template, rollouts: int = 1000, workers: int = 1,
+        rollouts_per_batch: int = ROLLOUTS_PER_BATCH,
+        max_turns: int = MAX_ROLLOUT_TURNS, seed: Optional[int] = None,
+        progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+    if rollouts < 1:
+        raise ValueError('At least one rollout must be simulated.')
+
+    batch_sizes = [rollouts_per_batch] * (rollouts // rollouts_per_batch)
+    if rollouts % rollouts_per_batch:
+        batch_sizes.append(rollouts % rollouts_per_batch)
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+
+    logging.info(
+        f'Simulating {rollouts} rollouts from turn {position.turn_number} '
+        f'in {workers} processes'
+    )
+    results = np.zeros(len(position.player_ids) + 1, dtype=np.int64)
+    rollouts_simulated = 0
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(workers, initializer=_set_rollout_position,
+            initargs=(position, map_arrays, template, max_turns)
+            ) as executor:
+        for batch_size, batch_results in zip(batch_sizes,
+                executor.map(_run_rollouts, seed_sequences, batch_sizes)):
+            results += batch_results
+            rollouts_simulated += batch_size
+            report(progress, 'batch', rollouts_simulated=rollouts_simulated,
+                rollouts_per_second=rollouts_simulated / (
+                    time.perf_counter() - start_time))
+
+    rollouts_per_second = rollouts / (time.perf_counter() - start_time)
+    logging.info(
+        f'Simulated {rollouts} rollouts at {rollouts_per_second:.1f} '
+        f'rollouts per second'
+    )
+    return {
+        'turn_number': position.turn_number,
+        'rollouts': rollouts,
+        'rollouts_per_second': rollouts_per_second,
+        'players': [
+            {
+                'player_id': player_id,
+                'win_probability': int(results[i]) / rollouts,
+            }
+            for i, player_id in enumerate(position.player_ids)
+        ],
+        'draw_probability': int(results[-1]) / rollouts,
+    }
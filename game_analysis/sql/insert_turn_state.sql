@@ -0,0 +1,34 @@
+insert into game_analysis_turn_state (
+    p1_winner, game_id, turn_number,
+    p1_income, p1_armies_on_board, p1_armies_deployed,
+        p1_cumulative_armies_deployed, p1_territories_controlled,
+    p2_income, p2_armies_on_board, p2_armies_deployed,
+        p2_cumulative_armies_deployed, p2_territories_controlled
+)
+    select 
+        p1.end_state_id = 'Won',                -- Did Player 1 win?
+        p1.game_id,                             -- Game ID
+        s1.turn_number,                         -- Turn Number
+        -- Player 1 State
+        s1.income, s1.armies_on_board, s1.armies_deployed,
+            s1.cumulative_armies_deployed, s1.territories_controlled,
+        -- Player 2 State
+        s2.income, s2.armies_on_board, s2.armies_deployed,
+            s2.cumulative_armies_deployed, s2.territories_controlled
+    from
+        game_analysis_player p1, game_analysis_player p2,
+        game_analysis_playerstate s1, game_analysis_playerstate s2
+    where
+        -- Join Conditions
+        p1.game_id = p2.game_id
+        and s1.game_id = p1.game_id and s1.player_id = p1.id
+        and s2.game_id = p1.game_id and s2.player_id = p2.id
+        and s2.turn_number = s1.turn_number
+        and p1.id < p2.id                       -- Avoid Row Duplication
+        and s1.turn_number > -1                 -- Remove Post-Picks State
+        and (                                   -- Remove Boot Wins
+            p1.end_state_id in ('SurrenderAccepted', 'Eliminated')
+            or p2.end_state_id in ('SurrenderAccepted', 'Eliminated')
+        )
+        and p1.game_id in ({game_ids})          -- Only Refreshed Games
+    order by p1.game_id, s1.turn_number;
@@ -1,3 +1,1134 @@
-from django.test import TestCase
+import json
+import socket
+import tempfile
+import numpy as np
 
-# Create your tests here.
+from collections import deque
+from datetime import timedelta
+from io import StringIO
+from itertools import product
+from math import comb
+from typing import Any, Dict, List, Optional, Tuple
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from . import api, cache, import_games, jobs, simulation
+
+from .combat import CombatTables, get_kill_distributions
+from .distances import compute_distances, get_unreachable_distance
+from .export import get_turn_states
+from .feature_store import LOG_FILE_NAME, _get_path, _read_log
+from .feature_store import append_game_features
+from .luck_statistics import NO_LADDER_ID, _add_attacks
+from .matchups import _get_game_matchups, rebuild_matchups
+from .models import AttackResult, Game, Job, JobEvent, Ladder
+from .models import LadderSyncState, Map, Order
+from .models import Player, PlayerAccount, PlayerLuckStatistics
+from .models import PlayerStatistics, Template, TemplateLuckStatistics
+from .models import Territory, TerritoryBaseline, Turn, TurnState
+from .ngrams import MAX_NGRAM_LENGTH, TOKEN_BITS, OrderNgramIndex
+from .ngrams import _get_ngram_counts, _merge_counts, pack_tokens
+from .ngrams import unpack_tokens
+from .progress import ProgressCallback
+from .ratings import Ratings, get_default_ratings_path, update_ratings
+from .sampling import TEST, TRAIN, get_sample_csv, sample_turn_states
+from .simulation import NEUTRAL, Position, _play_turn
+from .simulation import _set_rollout_position, evaluate_position
+from .simulation import get_position
+from .wrappers import MapArrays
+
+# Settings of the combat tables tested in both rounding modes
+OFFENSIVE_KILL_RATE = 0.6
+DEFENSIVE_KILL_RATE = 0.7
+LUCK_MODIFIER = 0.16
+
+# Ids of the Templates and numbers of Games and turns of the Turn States
+# sampled by tests
+SAMPLED_TEMPLATE_IDS = [1001, 1002]
+SAMPLED_GAME_COUNT = 60
+SAMPLED_TURN_COUNT = 10
+
+# Ids of Player Accounts created by tests, which are not used by the initial
+# data
+PLAYER_ACCOUNT_IDS = [1001, 1002]
+
+
+# Get the distribution of kills made by armies against an opposing side by
+# enumerating whether each army kills, then blending and rounding the kills
+def _enumerate_kills(armies: int, opposing_size: int, kill_rate: float,
+        luck_modifier: float, is_straight_round: bool) -> Dict[int, float]:
+    distribution: Dict[int, float] = {}
+    for hits in product([False, True], repeat=armies):
+        probability = float(np.prod(
+            [kill_rate if hit else 1 - kill_rate for hit in hits]))
+        blended_kills = (luck_modifier * sum(hits)
+            + (1 - luck_modifier) * kill_rate * armies)
+
+        if is_straight_round:
+            outcomes = [(int(np.floor(blended_kills + 0.5)), 1.0)]
+        else:
+            fraction = blended_kills - np.floor(blended_kills)
+            outcomes = [(int(np.floor(blended_kills)), 1 - fraction),
+                (int(np.floor(blended_kills)) + 1, fraction)]
+
+        for kills, outcome_probability in outcomes:
+            kills = min(kills, armies, opposing_size)
+            distribution[kills] = (distribution.get(kills, 0)
+                + probability * outcome_probability)
+    return distribution
+
+
+# Get the success probability and expected kills of an attack by enumerating
+# the kills of both sides
+def _enumerate_attack(attackers: int, defenders: int,
+        is_straight_round: bool) -> Tuple[float, float, float]:
+    defenders_killed = _enumerate_kills(attackers, defenders,
+        OFFENSIVE_KILL_RATE, LUCK_MODIFIER, is_straight_round)
+    attackers_killed = _enumerate_kills(defenders, attackers,
+        DEFENSIVE_KILL_RATE, LUCK_MODIFIER, is_straight_round)
+
+    success_probability = (
+        defenders_killed.get(defenders, 0)
+        * (1 - attackers_killed.get(attackers, 0)))
+    return (success_probability,
+        sum(kills * p for kills, p in defenders_killed.items()),
+        sum(kills * p for kills, p in attackers_killed.items()))
+
+
+class CombatTests(TestCase):
+    # Each kill distribution is a probability distribution
+    def test_kill_distributions_sum_to_one(self) -> None:
+        for is_straight_round in [True, False]:
+            for luck_modifier in [0, LUCK_MODIFIER, 1]:
+                distributions = get_kill_distributions(OFFENSIVE_KILL_RATE,
+                    luck_modifier, is_straight_round, 50)
+                self.assertTrue((distributions >= 0).all())
+                np.testing.assert_allclose(distributions.sum(axis=1), 1)
+
+    # Success probabilities and expected kills match those found by
+    # enumerating every outcome of small attacks
+    def test_tables_match_enumeration(self) -> None:
+        for is_straight_round in [True, False]:
+            tables = CombatTables(OFFENSIVE_KILL_RATE, DEFENSIVE_KILL_RATE,
+                LUCK_MODIFIER, is_straight_round, 8)
+            for attackers, defenders in product(range(1, 9), range(0, 8)):
+                success_probability, defenders_killed, attackers_killed = (
+                    _enumerate_attack(attackers, defenders,
+                        is_straight_round))
+                self.assertAlmostEqual(
+                    tables.get_success_probability(attackers, defenders),
+                    success_probability)
+                self.assertAlmostEqual(
+                    tables.get_expected_kills(attackers, defenders)[0],
+                    defenders_killed)
+                self.assertAlmostEqual(
+                    tables.get_expected_kills(attackers, defenders)[1],
+                    attackers_killed)
+
+    # Without luck, armies make the expected kills rounded to the nearest
+    # integer, or either integer around them in proportion to their distance
+    def test_kill_distributions_without_luck(self) -> None:
+        for is_straight_round in [True, False]:
+            distributions = get_kill_distributions(OFFENSIVE_KILL_RATE, 0,
+                is_straight_round, 50)
+            for armies in range(51):
+                expected_kills = OFFENSIVE_KILL_RATE * armies
+                if is_straight_round:
+                    self.assertAlmostEqual(
+                        distributions[armies, round(expected_kills)], 1)
+                else:
+                    rounded_down = int(np.floor(expected_kills + 1e-9))
+                    self.assertAlmostEqual(distributions[armies,
+                        rounded_down:rounded_down + 2].sum(), 1)
+                    self.assertAlmostEqual(
+                        distributions[armies] @ np.arange(51),
+                        expected_kills)
+
+    # With full luck, the kills of armies follow the binomial distribution
+    def test_kill_distributions_with_full_luck(self) -> None:
+        for is_straight_round in [True, False]:
+            distributions = get_kill_distributions(OFFENSIVE_KILL_RATE, 1,
+                is_straight_round, 12)
+            for armies in range(13):
+                for kills in range(armies + 1):
+                    self.assertAlmostEqual(distributions[armies, kills],
+                        comb(armies, kills) * OFFENSIVE_KILL_RATE ** kills
+                        * (1 - OFFENSIVE_KILL_RATE) ** (armies - kills))
+
+    # The mean sampled kills match the expected kills
+    def test_sampled_kills_match_expected_kills(self) -> None:
+        rng = np.random.default_rng(0)
+        sample_size = 100000
+        for is_straight_round in [True, False]:
+            tables = CombatTables(OFFENSIVE_KILL_RATE, DEFENSIVE_KILL_RATE,
+                LUCK_MODIFIER, is_straight_round, 64)
+            for attackers, defenders in [(1, 1), (5, 3), (12, 10), (60, 20)]:
+                defenders_killed, attackers_killed = tables.sample_kills(rng,
+                    np.full(sample_size, attackers),
+                    np.full(sample_size, defenders))
+                expected_defenders_killed, expected_attackers_killed = (
+                    tables.get_expected_kills(attackers, defenders))
+
+                # Allow five standard errors of the mean
+                for kills, expected_kills in [
+                        (defenders_killed, expected_defenders_killed),
+                        (attackers_killed, expected_attackers_killed)]:
+                    tolerance = 5 * max(kills.std(), 0.01) / sample_size ** 0.5
+                    self.assertLess(abs(kills.mean() - expected_kills),
+                        tolerance)
+
+
+# Get the adjacency in compressed sparse row form of an undirected graph
+def _get_adjacency(territory_count: int,
+        edges: List[Tuple[int, int]]) -> Tuple[np.ndarray, np.ndarray]:
+    neighbors: List[List[int]] = [[] for _ in range(territory_count)]
+    for territory_1, territory_2 in edges:
+        neighbors[territory_1].append(territory_2)
+        neighbors[territory_2].append(territory_1)
+
+    adjacency_indptr = np.cumsum([0] + [len(n) for n in neighbors])
+    adjacency_indices = np.array(
+        [neighbor for n in neighbors for neighbor in sorted(n)],
+        dtype=np.int64)
+    return adjacency_indptr, adjacency_indices
+
+
+# Get the number of hops between each pair of territories with a breadth
+# first search from each territory, or None where there is no path
+def _get_bfs_distances(adjacency_indptr: np.ndarray,
+        adjacency_indices: np.ndarray) -> List[List[Optional[int]]]:
+    territory_count = len(adjacency_indptr) - 1
+    distances: List[List[Optional[int]]] = []
+    for source in range(territory_count):
+        source_distances: List[Optional[int]] = [None] * territory_count
+        source_distances[source] = 0
+        queue = deque([source])
+        while queue:
+            territory = queue.popleft()
+            distance = source_distances[territory]
+            assert distance is not None
+            for neighbor in adjacency_indices[
+                    adjacency_indptr[territory]:
+                    adjacency_indptr[territory + 1]]:
+                if source_distances[neighbor] is None:
+                    source_distances[neighbor] = distance + 1
+                    queue.append(neighbor)
+        distances.append(source_distances)
+    return distances
+
+
+class DistancesTests(TestCase):
+    # Check the computed distances of a graph against a plain breadth first
+    # search
+    def assert_distances_match_bfs(self, territory_count: int,
+            edges: List[Tuple[int, int]]) -> np.ndarray:
+        adjacency = _get_adjacency(territory_count, edges)
+        distances = compute_distances(*adjacency)
+        unreachable_distance = get_unreachable_distance(distances)
+        expected_distances = [
+            [unreachable_distance if d is None else d for d in row]
+            for row in _get_bfs_distances(*adjacency)
+        ]
+        np.testing.assert_array_equal(distances, expected_distances)
+        return distances
+
+    # Searches reaching a territory from several territories of the frontier
+    # at once keep one path to it, and territories of other components are
+    # unreachable
+    def test_disconnected_graph_matches_bfs(self) -> None:
+        edges = [(0, 1), (0, 2), (1, 3), (2, 3), (3, 4), (1, 2), (5, 6),
+            (6, 7), (7, 5), (8, 9)]
+        distances = self.assert_distances_match_bfs(11, edges)
+        self.assertEqual(distances.dtype, np.uint8)
+        self.assertEqual(distances[0, 5], np.iinfo(np.uint8).max)
+        self.assertEqual(distances[10, 10], 0)
+
+    # Random graphs with more territories than are searched in one batch
+    # match a plain breadth first search
+    def test_random_graphs_match_bfs(self) -> None:
+        rng = np.random.default_rng(0)
+        for territory_count, edge_count in [(40, 30), (40, 80), (600, 700)]:
+            edges = [
+                (int(territory_1), int(territory_2))
+                for territory_1, territory_2 in rng.integers(0,
+                    territory_count, (edge_count, 2))
+                if territory_1 != territory_2
+            ]
+            self.assert_distances_match_bfs(territory_count, edges)
+
+    # Distances that do not fit in uint8 are stored as uint16, with its
+    # largest value meaning there is no path
+    def test_long_paths_use_uint16(self) -> None:
+        edges = [(i, i + 1) for i in range(299)]
+        distances = self.assert_distances_match_bfs(301, edges)
+        self.assertEqual(distances.dtype, np.uint16)
+        self.assertEqual(distances[0, 299], 299)
+        self.assertEqual(distances[0, 300], np.iinfo(np.uint16).max)
+
+        # The largest uint8 value is a distance once it does not fit
+        distances = self.assert_distances_match_bfs(256,
+            [(i, i + 1) for i in range(255)])
+        self.assertEqual(distances.dtype, np.uint16)
+        self.assertEqual(distances[0, 255], 255)
+
+        distances = self.assert_distances_match_bfs(255,
+            [(i, i + 1) for i in range(254)])
+        self.assertEqual(distances.dtype, np.uint8)
+
+
+class OrderNgramTests(TestCase):
+    # Get an index of n-grams of tokens with counts
+    def get_index(self, ngram_counts: List[Tuple[List[int], int]]
+            ) -> OrderNgramIndex:
+        keys = np.array([pack_tokens(tokens) for tokens, _ in ngram_counts],
+            dtype=np.int64)
+        counts = np.array([count for _, count in ngram_counts],
+            dtype=np.int64)
+        order = np.argsort(keys)
+        return OrderNgramIndex(1, ['GameOrderDeploy'], [1], keys[order],
+            counts[order], 1)
+
+    # Packed keys unpack to their tokens, keep the order of their tokens and
+    # sort n-grams before their extensions
+    def test_pack_tokens(self) -> None:
+        largest_token = (1 << TOKEN_BITS) - 1
+        for tokens in [[1], [5, largest_token], [largest_token, 1, 7]]:
+            self.assertEqual(unpack_tokens(pack_tokens(tokens)), tokens)
+
+        self.assertLess(pack_tokens([3]), pack_tokens([3, 1]))
+        self.assertLess(pack_tokens([3, 1]), pack_tokens([3, 1, 1]))
+        self.assertLess(pack_tokens([3, largest_token, largest_token]),
+            pack_tokens([4]))
+        self.assertLess(pack_tokens([3, 2]), pack_tokens([3, 10]))
+
+        for tokens in [[], [1] * (MAX_NGRAM_LENGTH + 1)]:
+            with self.assertRaises(ValueError):
+                pack_tokens(tokens)
+
+    # The n-grams starting with a prefix include those with the largest
+    # tokens after it and exclude those of the next prefix
+    def test_get_most_frequent_prefix_range(self) -> None:
+        largest_token = (1 << TOKEN_BITS) - 1
+        index = self.get_index([
+            ([2, largest_token, largest_token], 1),
+            ([3], 9),
+            ([3, 1], 2),
+            ([3, largest_token], 5),
+            ([3, 1, largest_token], 3),
+            ([3, largest_token, largest_token], 4),
+            ([4], 8),
+            ([4, 1], 7),
+        ])
+
+        self.assertEqual(index.get_most_frequent([3]), [
+            ([3], 9),
+            ([3, largest_token], 5),
+            ([3, largest_token, largest_token], 4),
+            ([3, 1, largest_token], 3),
+            ([3, 1], 2),
+        ])
+        self.assertEqual(index.get_most_frequent([3, 1]),
+            [([3, 1, largest_token], 3), ([3, 1], 2)])
+        self.assertEqual(
+            index.get_most_frequent([3, largest_token, largest_token]),
+            [([3, largest_token, largest_token], 4)])
+        self.assertEqual(index.get_most_frequent([3], length=2),
+            [([3, largest_token], 5), ([3, 1], 2)])
+        self.assertEqual(index.get_most_frequent([5]), [])
+        self.assertEqual(index.get_most_frequent([], limit=2),
+            [([3], 9), ([4], 8)])
+        self.assertEqual(index.get_count([4, 1]), 7)
+        self.assertEqual(index.get_count([4, 2]), 0)
+
+    # N-grams are counted within each sequence and never across the end of
+    # one sequence and the start of the next
+    def test_ngrams_do_not_cross_sequences(self) -> None:
+        keys, counts = _get_ngram_counts(
+            np.array([0, 0, 0, 1, 1, 2, 3, 3, 3]),
+            np.array([1, 2, 3, 4, 5, 6, 7, 7, 7]))
+
+        self.assertEqual(
+            {tuple(unpack_tokens(int(key))): int(count)
+                for key, count in zip(keys, counts)},
+            {
+                (1,): 1, (2,): 1, (3,): 1, (4,): 1, (5,): 1, (6,): 1,
+                (7,): 3,
+                (1, 2): 1, (2, 3): 1, (4, 5): 1, (7, 7): 2,
+                (1, 2, 3): 1, (7, 7, 7): 1,
+            })
+        self.assertTrue((np.diff(keys) > 0).all())
+
+    # Merging the counts of two indices sums the counts of shared n-grams
+    def test_merge_counts(self) -> None:
+        keys, counts = _merge_counts(np.array([1, 5, 9]), np.array([2, 1, 4]),
+            np.array([5, 7]), np.array([3, 6]))
+        self.assertEqual(keys.tolist(), [1, 5, 7, 9])
+        self.assertEqual(counts.tolist(), [2, 4, 6, 4])
+
+
+class LuckStatisticsTests(TestCase):
+    # Create the Player Accounts and Template the attacks belong to
+    def setUp(self) -> None:
+        game_map = Map.objects.create(id=1, name='Map')
+        Template.objects.create(id=1, map=game_map, territory_limit=3,
+            wasteland_count=0, max_cards=0, card_pieces_per_turn=0)
+        for player_account_id in PLAYER_ACCOUNT_IDS:
+            PlayerAccount.objects.create(id=player_account_id,
+                name=f'Player {player_account_id}')
+
+    # Merging the moments of batches of attacks gives the moments of all of
+    # the attacks together
+    def test_merged_moments_match_concatenated_data(self) -> None:
+        rng = np.random.default_rng(0)
+        attacks = np.column_stack([
+            rng.choice(PLAYER_ACCOUNT_IDS, 500),
+            rng.choice([0, NO_LADDER_ID], 500),
+            np.ones(500),
+            rng.normal(0.1, 0.3, 500),
+            rng.normal(-0.2, 0.5, 500),
+            rng.integers(0, 10, 500),
+            rng.integers(1, 10, 500),
+        ]).astype(np.float64)
+
+        for batch in np.split(attacks, [1, 7, 200, 201, 420]):
+            _add_attacks(batch)
+
+        metrics = {
+            'offense_luck': attacks[:, 3],
+            'defense_luck': attacks[:, 4],
+            'kill_efficiency': attacks[:, 5] / attacks[:, 6],
+        }
+        for player_account_id in PLAYER_ACCOUNT_IDS:
+            statistics = PlayerLuckStatistics.objects.get(
+                pk=player_account_id)
+            is_player = attacks[:, 0] == player_account_id
+            self.assertEqual(statistics.attacks, is_player.sum())
+            for metric, values in metrics.items():
+                self.assertAlmostEqual(
+                    getattr(statistics, f'{metric}_mean'),
+                    np.mean(values[is_player]))
+                self.assertAlmostEqual(statistics.get_variance(metric),
+                    np.var(values[is_player], ddof=1))
+
+        statistics = TemplateLuckStatistics.objects.get(pk=1)
+        self.assertEqual(statistics.attacks, len(attacks))
+        for metric, values in metrics.items():
+            self.assertAlmostEqual(getattr(statistics, f'{metric}_mean'),
+                np.mean(values))
+            self.assertAlmostEqual(statistics.get_variance(metric),
+                np.var(values, ddof=1))
+
+        # The luck sums of the Player Statistics of each Ladder
+        for statistics in PlayerStatistics.objects.all():
+            is_key = (
+                (attacks[:, 0] == statistics.player_account_id)
+                & (attacks[:, 1] == (
+                    NO_LADDER_ID if statistics.ladder_id is None
+                    else statistics.ladder_id))
+            )
+            self.assertAlmostEqual(statistics.offense_luck_sum,
+                attacks[is_key, 3].sum())
+            self.assertAlmostEqual(statistics.defense_luck_sum,
+                attacks[is_key, 4].sum())
+        self.assertEqual(PlayerStatistics.objects.count(), 4)
+
+    # The attacking armies killed in successful attacks are compared with
+    # the number expected by the combat tables of the Template
+    @mock.patch.dict(cache.combat_tables, clear=True)
+    @mock.patch.dict(cache.templates, clear=True)
+    def test_compare_attack_kills(self) -> None:
+        Game.objects.create(id=1, template_id=1, name='Game',
+            number_of_turns=5)
+        player = Player.objects.create(game_id=1,
+            player_id=PLAYER_ACCOUNT_IDS[0], end_state_id='Won')
+        turn = Turn.objects.create(game_id=1, turn_number=1)
+        for order_number, (attack_size, defenders, attackers_killed,
+                is_successful) in enumerate(
+                    [(5, 3, 3, True), (4, 1, 0, True), (2, 5, 2, False)]):
+            order = Order.objects.create(game_id=1, turn=turn,
+                order_number=order_number,
+                order_type_id='GameOrderAttackTransfer', player=player,
+                armies=attack_size)
+            AttackResult.objects.create(order=order, is_attack=True,
+                is_successful=is_successful, attack_size=attack_size,
+                attacking_armies_killed=attackers_killed,
+                defending_armies_killed=defenders)
+
+        # Without luck, 3 and 1 defenders kill 2 and 1 attackers
+        output = StringIO()
+        call_command('compare_attack_kills', '1', stdout=output)
+        self.assertEqual(output.getvalue().splitlines(), [
+            'template_id,attacks,attacking_armies_killed,'
+                'expected_attacking_armies_killed',
+            '1,2,3,3.0',
+        ])
+
+
+class SamplingTests(TestCase):
+    # Create the Turn States of Games of two Templates
+    @classmethod
+    def setUpTestData(cls) -> None:
+        game_map = Map.objects.create(id=1001, name='Map')
+        for template_id in SAMPLED_TEMPLATE_IDS:
+            Template.objects.create(id=template_id, map=game_map,
+                territory_limit=3, wasteland_count=0, max_cards=0,
+                card_pieces_per_turn=0)
+
+        rng = np.random.default_rng(0)
+        for game_id in range(1, SAMPLED_GAME_COUNT + 1):
+            Game.objects.create(id=game_id,
+                template_id=SAMPLED_TEMPLATE_IDS[game_id % 2],
+                name=f'Game {game_id}', number_of_turns=SAMPLED_TURN_COUNT)
+            TurnState.objects.bulk_create(
+                TurnState(game_id=game_id, turn_number=turn_number,
+                    p1_winner=bool(rng.integers(2)),
+                    **{name: int(rng.integers(100)) for name in [
+                        'p1_income', 'p1_armies_on_board',
+                        'p1_armies_deployed', 'p1_cumulative_armies_deployed',
+                        'p1_territories_controlled', 'p2_income',
+                        'p2_armies_on_board', 'p2_armies_deployed',
+                        'p2_cumulative_armies_deployed',
+                        'p2_territories_controlled']})
+                for turn_number in range(SAMPLED_TURN_COUNT)
+            )
+
+    # The sample does not depend on the chunk size or the order the Turn
+    # States are read in
+    def test_sample_does_not_depend_on_chunks_or_order(self) -> None:
+        for stratify_by in [[], ['turn_number', 'template_id']]:
+            samples = [
+                sample_turn_states(turn_states, 5, stratify_by,
+                    chunk_size=chunk_size)
+                for turn_states, chunk_size in [
+                    (get_turn_states(), 100000),
+                    (get_turn_states(), 7),
+                    (get_turn_states(), 1),
+                    (get_turn_states().order_by('-game_id', 'turn_number'),
+                        13),
+                    (get_turn_states().order_by('turn_number', '-game_id'),
+                        5),
+                ]
+            ]
+            for sample in samples[1:]:
+                np.testing.assert_array_equal(sample, samples[0])
+
+            seed_sample = sample_turn_states(get_turn_states(), 5,
+                stratify_by, seed=1, chunk_size=7)
+            self.assertFalse(np.array_equal(seed_sample, samples[0]))
+
+    # Each stratum has at most size Turn States, or all of its Turn States
+    # if it has fewer
+    def test_strata_are_capped_at_size(self) -> None:
+        sample = sample_turn_states(get_turn_states(), 4,
+            ['turn_number', 'template_id', 'p1_winner'], chunk_size=9)
+        self.assertEqual(len(np.unique(sample[['game_id', 'turn_number']])),
+            len(sample))
+
+        turn_states = list(TurnState.objects.values_list('turn_number',
+            'game__template_id', 'p1_winner'))
+        for stratum in set(turn_states):
+            is_stratum = (
+                (sample['turn_number'] == stratum[0])
+                & (sample['template_id'] == stratum[1])
+                & (sample['p1_winner'] == stratum[2]))
+            self.assertEqual(is_stratum.sum(),
+                min(4, turn_states.count(stratum)))
+
+        sample = sample_turn_states(get_turn_states(), 25, chunk_size=3)
+        self.assertEqual(len(sample), 25)
+
+    # The train and test splits share no Game and together hold every Turn
+    # State
+    def test_splits_share_no_game(self) -> None:
+        turn_state_count = SAMPLED_GAME_COUNT * SAMPLED_TURN_COUNT
+        train_sample, test_sample = [
+            sample_turn_states(get_turn_states(), turn_state_count,
+                split=split, test_fraction=0.3, chunk_size=11)
+            for split in [TRAIN, TEST]
+        ]
+        train_game_ids = set(train_sample['game_id'].tolist())
+        test_game_ids = set(test_sample['game_id'].tolist())
+
+        self.assertTrue(train_game_ids and test_game_ids)
+        self.assertFalse(train_game_ids & test_game_ids)
+        self.assertEqual(len(train_sample) + len(test_sample),
+            turn_state_count)
+
+        train_sample = sample_turn_states(get_turn_states(), 10,
+            ['turn_number'], TRAIN, 0.3, chunk_size=4)
+        self.assertFalse(set(train_sample['game_id'].tolist())
+            & test_game_ids)
+
+    # The CSV header names the columns of the sample
+    def test_sample_csv_header(self) -> None:
+        sample = sample_turn_states(get_turn_states(), 2)
+        lines = get_sample_csv(sample).splitlines()
+        self.assertEqual(lines[0].split(','),
+            [field[0] for field in sample.dtype.descr])
+        self.assertEqual(len(lines), 3)
+
+
+class FeatureStoreTests(TestCase):
+    # Create a Game with a few Turn States
+    def setUp(self) -> None:
+        game_map = Map.objects.create(id=1001, name='Map')
+        Template.objects.create(id=1001, map=game_map, territory_limit=3,
+            wasteland_count=0, max_cards=0, card_pieces_per_turn=0)
+        Game.objects.create(id=1, template_id=1001, name='Game',
+            number_of_turns=3)
+        TurnState.objects.bulk_create(
+            TurnState(game_id=1, turn_number=turn_number, p1_winner=True,
+                **{name: turn_number + 1 for name in [
+                    'p1_income', 'p1_armies_on_board', 'p1_armies_deployed',
+                    'p1_cumulative_armies_deployed',
+                    'p1_territories_controlled', 'p2_income',
+                    'p2_armies_on_board', 'p2_armies_deployed',
+                    'p2_cumulative_armies_deployed',
+                    'p2_territories_controlled']})
+            for turn_number in range(3)
+        )
+
+        data_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(data_directory.cleanup)
+        settings_override = override_settings(
+            ANALYSIS_DATA_DIR=data_directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    # Records appended after a partially written record are read whole
+    def test_append_after_torn_write(self) -> None:
+        self.assertEqual(append_game_features([1]), 3)
+        first_records = np.array(_read_log(_get_path(LOG_FILE_NAME)))
+
+        with open(_get_path(LOG_FILE_NAME), 'ab') as log_file:
+            log_file.write(first_records.tobytes()[:5])
+        self.assertEqual(append_game_features([1]), 3)
+
+        records = _read_log(_get_path(LOG_FILE_NAME))
+        np.testing.assert_array_equal(records,
+            np.concatenate([first_records, first_records]))
+
+
+# Player Accounts rated by the ratings tests
+RATED_PLAYER_ACCOUNT_IDS = [1001, 1002, 1003, 1004]
+
+
+class RatingsTests(TestCase):
+    # Create the Template and Player Accounts of the rated Games
+    def setUp(self) -> None:
+        game_map = Map.objects.create(id=1001, name='Map')
+        Template.objects.create(id=1001, map=game_map, territory_limit=3,
+            wasteland_count=0, max_cards=0, card_pieces_per_turn=0)
+        for player_id in RATED_PLAYER_ACCOUNT_IDS:
+            PlayerAccount.objects.create(id=player_id, name=str(player_id))
+
+        data_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(data_directory.cleanup)
+        self.path = f'{data_directory.name}/ratings.npz'
+        self.start = timezone.now()
+
+    # Create ended Games, won by a player chosen by game id
+    def _create_games(self, game_ids: List[int]) -> None:
+        for game_id in game_ids:
+            Game.objects.create(id=game_id, template_id=1001,
+                name=f'Game {game_id}', number_of_turns=5,
+                end_date_time=self.start + timedelta(hours=game_id))
+            winner_id = RATED_PLAYER_ACCOUNT_IDS[game_id % 4]
+            loser_id = RATED_PLAYER_ACCOUNT_IDS[(3 * game_id + 1) % 4]
+            Player.objects.create(game_id=game_id, player_id=winner_id,
+                end_state_id='Won')
+            Player.objects.create(game_id=game_id, player_id=loser_id,
+                end_state_id='Eliminated')
+
+    # Get the saved ratings of the Player Accounts
+    def _get_ratings(self) -> Tuple[List[Optional[float]], int]:
+        ratings = Ratings.load(self.path)
+        return (
+            [ratings.get_rating(player_id)
+                for player_id in RATED_PLAYER_ACCOUNT_IDS],
+            ratings.games_applied
+        )
+
+    # Updating the ratings with the Games that ended since the last update
+    # gives the same ratings as rating all Games from the start
+    def test_incremental_update_matches_rebuild(self) -> None:
+        self._create_games(list(range(1, 7)))
+        self.assertEqual(update_ratings(self.path), 6)
+        self._create_games(list(range(7, 11)))
+        self.assertEqual(update_ratings(self.path), 4)
+        incremental_ratings = self._get_ratings()
+
+        self.assertEqual(update_ratings(self.path, rebuild=True), 10)
+        self.assertEqual(self._get_ratings(), incremental_ratings)
+        self.assertEqual(incremental_ratings[1], 10)
+        self.assertNotEqual(incremental_ratings[0][0], 1500.0)
+
+    # Games imported after later Games were rated are applied by rebuilding
+    # the ratings
+    def test_late_games_are_applied(self) -> None:
+        self._create_games([1, 2, 5, 6])
+        self.assertEqual(update_ratings(self.path), 4)
+        self._create_games([3, 4])
+        self.assertEqual(update_ratings(self.path), 6)
+        late_ratings = self._get_ratings()
+        self.assertEqual(late_ratings[1], 6)
+        self.assertEqual(update_ratings(self.path), 0)
+
+        self.assertEqual(update_ratings(self.path, rebuild=True), 6)
+        self.assertEqual(self._get_ratings(), late_ratings)
+
+
+class MatchupTests(TestCase):
+    # Create a two-player Game won by 1001, a two-player Game won by 1002
+    # and a team Game won by 1001 and 1003 against 1002 and 1004
+    def setUp(self) -> None:
+        game_map = Map.objects.create(id=1001, name='Map')
+        Template.objects.create(id=1001, map=game_map, territory_limit=3,
+            wasteland_count=0, max_cards=0, card_pieces_per_turn=0)
+        for player_id in RATED_PLAYER_ACCOUNT_IDS:
+            PlayerAccount.objects.create(id=player_id, name=str(player_id))
+
+        for game_id, end_states in [
+                (1, {1001: 'Won', 1002: 'Eliminated'}),
+                (2, {1001: 'SurrenderAccepted', 1002: 'Won'}),
+                (3, {1001: 'Won', 1002: 'Eliminated', 1003: 'Won',
+                    1004: 'Booted'})]:
+            Game.objects.create(id=game_id, template_id=1001,
+                name=f'Game {game_id}', number_of_turns=5)
+            for player_id, end_state in end_states.items():
+                Player.objects.create(game_id=game_id, player_id=player_id,
+                    end_state_id=end_state)
+        rebuild_matchups()
+
+        data_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(data_directory.cleanup)
+        settings_override = override_settings(
+            ANALYSIS_DATA_DIR=data_directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    # Both players of a two-player Game are matched up, even if neither won
+    def test_two_player_game_matchups(self) -> None:
+        for end_states, winner_id in [
+                (['Eliminated', 'Won'], 1002), (['EndedByVote'] * 2, None)]:
+            matchups = _get_game_matchups(1, [
+                (1, 1002, end_states[1]), (1, 1001, end_states[0])])
+            self.assertEqual(
+                [(matchup.player_account_1_id, matchup.player_account_2_id,
+                    matchup.winner_id) for matchup in matchups],
+                [(1001, 1002, winner_id)])
+
+    # In a team Game, winners are matched up against the other players and
+    # possible teammates are not matched up
+    def test_team_game_matchups(self) -> None:
+        matchups = _get_game_matchups(3, [(3, 1001, 'Won'),
+            (3, 1002, 'Eliminated'), (3, 1003, 'Won'), (3, 1004, 'Booted')])
+        self.assertEqual(
+            [(matchup.player_account_1_id, matchup.player_account_2_id,
+                matchup.winner_id) for matchup in matchups],
+            [(1001, 1002, 1001), (1001, 1004, 1001), (1002, 1003, 1003),
+                (1003, 1004, 1003)])
+
+    # The head-to-head record is the same from either player's side
+    def test_head_to_head_view(self) -> None:
+        for player_account_id, opponent_id in [(1002, 1001), (1001, 1002)]:
+            response = self.client.get(
+                f'/players/{player_account_id}/head-to-head/{opponent_id}')
+            self.assertEqual(response.json(), {
+                'player_account_ids': [1001, 1002],
+                'games': [
+                    {'game_id': 1, 'winner_id': 1001},
+                    {'game_id': 2, 'winner_id': 1002},
+                    {'game_id': 3, 'winner_id': 1001},
+                ],
+                'wins': {'1001': 2, '1002': 1},
+                'games_without_winner': 0,
+            })
+
+        response = self.client.get('/players/1003/head-to-head/1001')
+        self.assertEqual(response.json()['games'], [])
+
+    # Games against opponents are counted in the bands of their ratings,
+    # and against unrated opponents in a band without a start
+    def test_record_by_rating_view(self) -> None:
+        ratings = Ratings.create_empty()
+        ratings.apply_game([1002], [1003])
+        ratings.save(get_default_ratings_path())
+
+        response = self.client.get('/players/1001/record-by-rating')
+        self.assertEqual(response.json(), {
+            'id': 1001,
+            'rating': None,
+            'record_by_rating_band': [
+                {'band_start': 1500, 'games': 3, 'wins': 2, 'losses': 1},
+                {'band_start': None, 'games': 1, 'wins': 1, 'losses': 0},
+            ],
+        })
+        self.assertEqual(
+            self.client.get('/players/1005/record-by-rating').status_code,
+            404)
+
+
+# Build the Map arrays of a line of territories, each connected to the next
+def _get_line_map_arrays(territory_count: int,
+        bonus_territory_lists: List[List[int]],
+        bonus_values: List[int]) -> MapArrays:
+    return MapArrays(
+        [[t for t in [territory - 1, territory + 1]
+            if 0 <= t < territory_count]
+            for territory in range(territory_count)],
+        bonus_territory_lists, bonus_values)
+
+
+@mock.patch.dict(cache.templates, clear=True)
+@mock.patch.dict(cache.maps, clear=True)
+@mock.patch.dict(cache.combat_tables, clear=True)
+class SimulationTests(TestCase):
+    # Create a Game on a line of five territories. Each player picks an end
+    # of the line, then deploys and takes the neutral territory next to it
+    def setUp(self) -> None:
+        game_map = Map.objects.create(id=1001, name='Map')
+        territories = [
+            Territory.objects.create(map=game_map, api_id=i, name=str(i))
+            for i in range(5)]
+        for territory_1, territory_2 in zip(territories, territories[1:]):
+            territory_1.connected_territories.add(territory_2)
+        self.template = Template.objects.create(id=1001, map=game_map,
+            territory_limit=1, wasteland_count=1, max_cards=0,
+            card_pieces_per_turn=0)
+        for player_account_id in PLAYER_ACCOUNT_IDS:
+            PlayerAccount.objects.create(id=player_account_id,
+                name=f'Player {player_account_id}')
+
+        Game.objects.create(id=1, template=self.template, name='Game',
+            number_of_turns=2)
+        for territory, state in [(territories[0], 'In Distribution'),
+                (territories[2], 'Wasteland'),
+                (territories[4], 'In Distribution')]:
+            TerritoryBaseline.objects.create(game_id=1, territory=territory,
+                state=state)
+
+        players = [
+            Player.objects.create(game_id=1, player_id=player_account_id,
+                end_state_id='Won')
+            for player_account_id in PLAYER_ACCOUNT_IDS]
+        self.player_ids = [player.id for player in players]
+        turns = [Turn.objects.create(game_id=1, turn_number=turn_number)
+            for turn_number in range(2)]
+
+        # Orders of each player by turn, as order type, territories and the
+        # attack size and armies killed by each side
+        orders = [
+            (0, players[0], 'GameOrderPick', 0, None, 4, 0, 0),
+            (0, players[1], 'GameOrderPick', 4, None, 4, 0, 0),
+            (1, players[0], 'GameOrderDeploy', 0, None, 5, None, None),
+            (1, players[0], 'GameOrderAttackTransfer', 0, 1, 8, 1, 2),
+            (1, players[1], 'GameOrderDeploy', 4, None, 5, None, None),
+            (1, players[1], 'GameOrderAttackTransfer', 4, 3, 8, 1, 2),
+        ]
+        for order_number, (turn_number, player, order_type_id, primary,
+                secondary, armies, attackers_killed,
+                defenders_killed) in enumerate(orders):
+            order = Order.objects.create(game_id=1, turn=turns[turn_number],
+                order_number=order_number, order_type_id=order_type_id,
+                player=player, armies=armies,
+                primary_territory=territories[primary],
+                secondary_territory=(
+                    None if secondary is None else territories[secondary]))
+            if attackers_killed is not None:
+                AttackResult.objects.create(order=order,
+                    is_attack=order_type_id == 'GameOrderAttackTransfer',
+                    is_successful=True, attack_size=armies,
+                    attacking_armies_killed=attackers_killed,
+                    defending_armies_killed=defenders_killed)
+
+    # Replaying the Orders gives the owner and armies of each territory at
+    # the end of a turn, with neutrals starting from their baseline
+    def test_get_position(self) -> None:
+        position = get_position(1, 0)
+        self.assertEqual(position.player_ids, self.player_ids)
+        self.assertEqual(position.owners.tolist(), [0, NEUTRAL, NEUTRAL,
+            NEUTRAL, 1])
+        self.assertEqual(position.armies.tolist(), [4, 2, 10, 2, 4])
+
+        position = get_position(1, 1)
+        self.assertEqual(position.turn_number, 1)
+        self.assertEqual(position.owners.tolist(), [0, 0, NEUTRAL, 1, 1])
+        self.assertEqual(position.armies.tolist(), [1, 7, 10, 7, 1])
+
+        with self.assertRaises(ValueError):
+            get_position(1, 2)
+
+    # A player deploys on their border and attacks the weakest neighbor of
+    # each territory they held at the start of the turn, only if the attack
+    # is likely to succeed. Without luck, combat is deterministic
+    def test_rollout_policy(self) -> None:
+        map_arrays = _get_line_map_arrays(3, [[2]], [3])
+        owners = np.array([[0, NEUTRAL, 1]], dtype=np.int8)
+        armies = np.array([[10, 2, 3]], dtype=np.int64)
+        rng = np.random.default_rng(0)
+
+        with mock.patch.multiple(simulation, _position=None,
+                _map_arrays=None, _template=None):
+            _set_rollout_position(Position(self.player_ids, owners[0],
+                armies[0], 1), map_arrays, self.template, 10)
+
+            # 14 attackers kill 8 and lose 1 taking the neutral
+            _play_turn(rng, owners, armies, 0)
+            self.assertEqual(owners.tolist(), [[0, 0, 1]])
+            self.assertEqual(armies.tolist(), [[1, 13, 3]])
+
+            # The bonus adds to the income, and 10 attackers would not kill
+            # 13 defenders
+            _play_turn(rng, owners, armies, 1)
+            self.assertEqual(owners.tolist(), [[0, 0, 1]])
+            self.assertEqual(armies.tolist(), [[1, 13, 11]])
+
+    # Rollouts with the same seed give the same results, whatever the number
+    # of workers
+    def test_rollouts_are_reproducible(self) -> None:
+        template = Template(id=1001, map_id=1001, territory_limit=1,
+            wasteland_count=0, max_cards=0, card_pieces_per_turn=0,
+            luck_modifier=LUCK_MODIFIER, is_straight_round=False)
+        position = Position(self.player_ids,
+            np.array([0, NEUTRAL, NEUTRAL, NEUTRAL, 1], dtype=np.int8),
+            np.array([5, 2, 2, 2, 5], dtype=np.int64), 1)
+        map_arrays = _get_line_map_arrays(5, [[0, 1], [3, 4]], [1, 1])
+
+        results = [
+            evaluate_position(position, map_arrays, template, rollouts=120,
+                workers=workers, rollouts_per_batch=50, max_turns=30,
+                seed=seed)
+            for workers, seed in [(1, 7), (1, 7), (2, 7)]
+        ]
+        for result in results:
+            self.assertEqual(
+                [player['player_id'] for player in result['players']],
+                self.player_ids)
+            self.assertAlmostEqual(
+                sum(player['win_probability']
+                    for player in result['players'])
+                + result['draw_probability'], 1)
+        for result in results[1:]:
+            self.assertEqual(result['players'], results[0]['players'])
+            self.assertEqual(result['draw_probability'],
+                results[0]['draw_probability'])
+
+
+# Number of Games on a page of a Ladder read by the ladder sync tests
+LADDER_PAGE_SIZE = 10
+
+
+@mock.patch.dict(cache.ladders, clear=True)
+class LadderSyncTests(TestCase):
+    # Mock the Ladder's pages of Game ids, newest first, and the import of
+    # each Game, which queues the Game to be saved
+    def setUp(self) -> None:
+        game_map = Map.objects.create(id=1001, name='Map')
+        Template.objects.create(id=1001, map=game_map, territory_limit=3,
+            wasteland_count=0, max_cards=0, card_pieces_per_turn=0)
+        self.ladder_game_ids = list(range(130, 100, -1))
+        self.offsets: List[int] = []
+        self.parsed_game_ids: List[int] = []
+
+        # Get a page of the Ladder's Game ids
+        def get_ladder_game_ids(ladder_id: int, offset: int,
+                max_results: int) -> List[int]:
+            self.offsets.append(offset)
+            return self.ladder_game_ids[offset:offset + max_results]
+
+        # Queue a Game of the Ladder to be saved
+        def parse_ladder_game(email: str, api_token: str, game_id: int,
+                offset: int, ladder: Ladder) -> Game:
+            self.parsed_game_ids.append(game_id)
+            game = Game(id=game_id, template_id=1001, name=f'Game {game_id}',
+                number_of_turns=5, ladder=ladder)
+            import_games.games_to_save.append(game)
+            return game
+
+        patches: List[Any] = [
+            mock.patch.object(api, 'get_ladder_game_ids',
+                get_ladder_game_ids),
+            mock.patch.object(import_games, '_parse_ladder_game',
+                parse_ladder_game),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    # Sync the Ladder. Returns the number of Games imported
+    def _sync(self) -> int:
+        self.offsets.clear()
+        self.parsed_game_ids.clear()
+        return import_games.sync_ladder_games('e', 't', 0,
+            games_per_page=LADDER_PAGE_SIZE)
+
+    # The first sync reads every page, importing only the missing Games of
+    # pages whose other Games were already imported. Later syncs stop at the
+    # first page without a missing Game newer than the high-water mark
+    def test_sync_stops_at_page_without_new_games(self) -> None:
+        for game_id in [125, 124, 105]:
+            Game.objects.create(id=game_id, template_id=1001,
+                name=f'Game {game_id}', number_of_turns=5, ladder_id=0)
+
+        self.assertEqual(self._sync(), 27)
+        self.assertEqual(self.offsets, [0, 10, 20, 30])
+        self.assertEqual(self.parsed_game_ids,
+            [game_id for game_id in range(130, 100, -1)
+                if game_id not in [125, 124, 105]])
+        sync_state = LadderSyncState.objects.get(ladder_id=0)
+        self.assertEqual(sync_state.newest_game_id, 130)
+        self.assertEqual(sync_state.games_imported, 27)
+
+        # A Game older than the mark on the first page is imported, and the
+        # next page has no new Games
+        self.ladder_game_ids = (
+            list(range(135, 130, -1)) + [99] + self.ladder_game_ids)
+        self.assertEqual(self._sync(), 6)
+        self.assertEqual(self.offsets, [0, 10])
+        self.assertEqual(self.parsed_game_ids, [135, 134, 133, 132, 131, 99])
+        sync_state = LadderSyncState.objects.get(ladder_id=0)
+        self.assertEqual(sync_state.newest_game_id, 135)
+        self.assertEqual(sync_state.games_imported, 33)
+
+        self.assertEqual(self._sync(), 0)
+        self.assertEqual(self.offsets, [0])
+        self.assertEqual(Game.objects.filter(ladder_id=0).count(), 36)
+
+
+# Job type run by tests, which reports a game and returns its parameters
+TEST_JOB_TYPE = 'Test'
+
+
+# Run a test job. Returns the result message
+def _run_test_job(progress: ProgressCallback, **parameters: Any) -> str:
+    progress('game', {'games_processed': 1})
+    return f'Ran with {sorted(parameters)}'
+
+
+@mock.patch.dict(jobs.JOB_FUNCTIONS, {TEST_JOB_TYPE: _run_test_job})
+class JobTests(TestCase):
+    # Jobs are claimed oldest first, each by one worker
+    def test_claim_oldest_queued_job(self) -> None:
+        first_job = jobs.enqueue_job(TEST_JOB_TYPE, 1)
+        second_job = jobs.enqueue_job(TEST_JOB_TYPE, 1)
+
+        claimed_job = jobs._claim_next_job()
+        assert claimed_job is not None
+        self.assertEqual(claimed_job.id, first_job.id)
+        self.assertEqual(claimed_job.status, Job.RUNNING)
+        self.assertEqual(claimed_job.worker, jobs._get_worker_name())
+        self.assertIsNotNone(claimed_job.started_date_time)
+
+        claimed_job = jobs._claim_next_job()
+        assert claimed_job is not None
+        self.assertEqual(claimed_job.id, second_job.id)
+        self.assertIsNone(jobs._claim_next_job())
+
+    # A calculation job is not claimed while another one runs, but jobs of
+    # other types still are
+    def test_calculation_jobs_run_one_at_a_time(self) -> None:
+        calculation_jobs = [
+            jobs.enqueue_job(jobs.CALCULATE_GAME_DATA, 10, max_results=10,
+                batch_size=5)
+            for _ in range(2)
+        ]
+        other_job = jobs.enqueue_job(TEST_JOB_TYPE, 1)
+
+        claimed_job = jobs._claim_next_job()
+        assert claimed_job is not None
+        self.assertEqual(claimed_job.id, calculation_jobs[0].id)
+        claimed_job = jobs._claim_next_job()
+        assert claimed_job is not None
+        self.assertEqual(claimed_job.id, other_job.id)
+        self.assertIsNone(jobs._claim_next_job())
+
+        # Of two calculation jobs claimed at the same time, the one with the
+        # smaller id runs
+        Job.objects.filter(pk=calculation_jobs[1].id).update(
+            status=Job.RUNNING, worker='other:1',
+            started_date_time=claimed_job.started_date_time)
+        Job.objects.filter(pk=calculation_jobs[0].id).update(
+            started_date_time=claimed_job.started_date_time)
+        self.assertFalse(jobs._is_blocked(
+            Job.objects.get(pk=calculation_jobs[0].id)))
+        self.assertTrue(jobs._is_blocked(
+            Job.objects.get(pk=calculation_jobs[1].id)))
+
+        # Once the running calculation job is done the next one is claimed
+        Job.objects.filter(pk=calculation_jobs[0].id).update(
+            status=Job.FINISHED)
+        Job.objects.filter(pk=calculation_jobs[1].id).update(
+            status=Job.QUEUED, worker='', started_date_time=None)
+        claimed_job = jobs._claim_next_job()
+        assert claimed_job is not None
+        self.assertEqual(claimed_job.id, calculation_jobs[1].id)
+
+    # Running jobs whose worker on this host has stopped, or which have not
+    # reported for the stale job timeout, are queued again
+    def test_requeue_stale_jobs(self) -> None:
+        stopped_job, silent_job, active_job, reporting_job = [
+            jobs.enqueue_job(TEST_JOB_TYPE, 1) for _ in range(4)]
+        now = timezone.now()
+        stale_time = now - timedelta(seconds=jobs.STALE_JOB_TIMEOUT + 60)
+        for job, worker, started_date_time in [
+                (stopped_job, f'{socket.gethostname()}:999999999', now),
+                (silent_job, 'other:1', stale_time),
+                (active_job, 'other:2', now),
+                (reporting_job, 'other:3', stale_time)]:
+            Job.objects.filter(pk=job.id).update(status=Job.RUNNING,
+                worker=worker, started_date_time=started_date_time)
+        JobEvent.objects.create(job=reporting_job, event='game', data='{}')
+
+        jobs._requeue_stale_jobs()
+
+        statuses = dict(Job.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[stopped_job.id], Job.QUEUED)
+        self.assertEqual(statuses[silent_job.id], Job.QUEUED)
+        self.assertEqual(statuses[active_job.id], Job.RUNNING)
+        self.assertEqual(statuses[reporting_job.id], Job.RUNNING)
+        self.assertEqual(Job.objects.get(pk=stopped_job.id).worker, '')
+        self.assertTrue(JobEvent.objects.filter(job=silent_job,
+            event='status').exists())
+
+    # Running a job saves its result and events, and removes the API token
+    # from its parameters
+    def test_run_job_drops_api_token(self) -> None:
+        jobs.enqueue_job(TEST_JOB_TYPE, 1, email='e', api_token='secret')
+        job = jobs._claim_next_job()
+        assert job is not None
+
+        jobs.run_job(job)
+
+        job = Job.objects.get(pk=job.id)
+        self.assertEqual(job.status, Job.FINISHED)
+        self.assertEqual(job.result, "Ran with ['api_token', 'email']")
+        self.assertEqual(json.loads(job.parameters), {'email': 'e'})
+        self.assertEqual(job.items_processed, 1)
+        self.assertEqual(
+            list(JobEvent.objects.filter(job=job).order_by('id')
+                .values_list('event', flat=True)),
+            ['game', 'status'])
+
+    # Streaming sends the events of a finished job and stops, and stops at
+    # once for a job that does not exist
+    def test_stream_job_events(self) -> None:
+        jobs.enqueue_job(TEST_JOB_TYPE, 1)
+        job = jobs._claim_next_job()
+        assert job is not None
+        jobs.run_job(job)
+        first_event = JobEvent.objects.filter(job=job).order_by('id').first()
+        assert first_event is not None
+
+        messages = list(jobs.stream_job_events(job.id))
+        self.assertTrue(messages[0].startswith('retry: '))
+        self.assertEqual([message.split('\n')[1] for message in messages[1:]],
+            ['event: game', 'event: status'])
+
+        messages = list(jobs.stream_job_events(job.id, first_event.id))
+        self.assertEqual(len(messages), 2)
+
+        self.assertEqual(len(list(jobs.stream_job_events(job.id + 1))), 1)
@@ -0,0 +1,332 @@
+import logging
+import os
+import shutil
+import numpy as np
+
+from itertools import groupby
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .export import iterate_chunks
+from .models import PlayerState
+
+# Player State values in each trajectory
+TRAJECTORY_FEATURES = ['income', 'armies_on_board', 'territories_controlled']
+
+# Number of turns in each trajectory, starting from turn 0
+TRAJECTORY_TURNS = 32
+
+# Number of values in a trajectory vector of a two player Game
+VECTOR_SIZE = 2 * len(TRAJECTORY_FEATURES) * TRAJECTORY_TURNS
+
+# Number of random projections in the sketch of each trajectory and the seed
+# they are drawn from
+SKETCH_SIZE = 16
+SKETCH_SEED = 0
+
+# Number of candidates per neighbor found by an approximate search, which
+# are then ranked by their exact distances
+CANDIDATES_PER_NEIGHBOR = 10
+
+# Number of trajectories whose distances are computed together
+ROWS_PER_BATCH = 16384
+
+GAME_IDS_FILE_NAME = 'game_ids.bin'
+VECTORS_FILE_NAME = 'vectors.bin'
+SKETCHES_FILE_NAME = 'sketches.bin'
+
+# Files of the index and the number of 4 byte values in each of their rows
+FILE_ROW_SIZES = [
+    (GAME_IDS_FILE_NAME, 1),
+    (VECTORS_FILE_NAME, VECTOR_SIZE),
+    (SKETCHES_FILE_NAME, SKETCH_SIZE),
+]
+
+
+# Get the directory of the trajectory index
+def get_trajectory_directory() -> str:
+    return os.path.join(settings.ANALYSIS_DATA_DIR, 'trajectories')
+
+
+# Get the random projections of the sketches of trajectories
+def _get_projection() -> np.ndarray:
+    projection = np.random.default_rng(SKETCH_SEED).standard_normal(
+        (VECTOR_SIZE, SKETCH_SIZE))
+    scaled_projection: np.ndarray = (
+        projection / np.sqrt(SKETCH_SIZE)).astype('f4')
+    return scaled_projection
+
+
+# Swap the players of trajectory vectors
+def _swap_players(vectors: np.ndarray) -> np.ndarray:
+    return np.roll(vectors, VECTOR_SIZE // 2, axis=-1)
+
+
+# Get the mask of the values of a trajectory vector from turns before a turn
+def _get_turn_mask(turns: int) -> np.ndarray:
+    return np.tile(np.arange(TRAJECTORY_TURNS) < turns,
+        2 * len(TRAJECTORY_FEATURES))
+
+
+# Get the trajectory vectors of the two player Games among the Player States
+# of Games, ordered by Game, player and turn. Each player's values are taken
+# at each turn of the trajectory, holding the last values after the Game
+# ended, and scaled logarithmically. The players are in the order of their
+# ids. Returns the Game ids, vectors and numbers of turns of the Games
+def _get_trajectories(player_states: List[Tuple[Any, ...]]
+        ) -> Tuple[List[int], np.ndarray, List[int]]:
+    game_ids: List[int] = []
+    vectors: List[np.ndarray] = []
+    turn_counts: List[int] = []
+    turns = np.arange(TRAJECTORY_TURNS)
+
+    for game_id, game_states in groupby(player_states, lambda row: row[0]):
+        players = [
+            np.array([row[2:] for row in player_rows])
+            for _, player_rows in groupby(game_states, lambda row: row[1])
+        ]
+        if len(players) != 2:
+            continue
+
+        player_vectors = []
+        for values in players:
+            rows = np.searchsorted(values[:, 0], turns, side='right') - 1
+            player_vectors.append(values[np.maximum(rows, 0), 1:].T)
+
+        game_ids.append(game_id)
+        vectors.append(np.log1p(np.maximum(
+            np.stack(player_vectors).ravel(), 0)))
+        turn_counts.append(max(int(values[-1, 0]) + 1 for values in players))
+
+    return (game_ids,
+        np.array(vectors, dtype='f4').reshape(len(vectors), VECTOR_SIZE),
+        turn_counts)
+
+
+# Get the Player State rows of Games used to build their trajectories
+def _get_player_states(game_ids: Optional[List[int]] = None) -> Any:
+    player_states = PlayerState.objects.filter(turn_number__gte=0)
+    if game_ids is not None:
+        player_states = player_states.filter(game_id__in=game_ids)
+
+    return (
+        player_states
+            .order_by('game_id', 'player_id', 'turn_number')
+            .values_list('game_id', 'player_id', 'turn_number',
+                *TRAJECTORY_FEATURES)
+    )
+
+
+# Get the number of rows written completely to every file of an index
+# directory
+def _get_row_count(directory: str) -> int:
+    row_counts: List[int] = []
+    for name, row_size in FILE_ROW_SIZES:
+        path = os.path.join(directory, name)
+        row_counts.append(os.path.getsize(path) // (4 * row_size)
+            if os.path.exists(path) else 0)
+    return min(row_counts)
+
+
+# Append trajectories to the files of an index directory. Rows left by a
+# partial write are removed first, so row i of every file is the same Game.
+# The Game ids are written last, so a Game is only indexed once all of its
+# rows are written
+def _write_trajectories(directory: str, game_ids: List[int],
+        vectors: np.ndarray) -> None:
+    os.makedirs(directory, exist_ok=True)
+    row_count = _get_row_count(directory)
+    for name, row_size in FILE_ROW_SIZES:
+        with open(os.path.join(directory, name), 'ab') as file:
+            file.truncate(row_count * 4 * row_size)
+
+    for name, values in [
+            (VECTORS_FILE_NAME, vectors.astype('f4')),
+            (SKETCHES_FILE_NAME, (vectors @ _get_projection()).astype('f4')),
+            (GAME_IDS_FILE_NAME, np.array(game_ids, dtype='i4'))]:
+        with open(os.path.join(directory, name), 'ab') as file:
+            file.write(np.ascontiguousarray(values).tobytes())
+
+
+# Memory-mapped trajectories of two player Games. Each file is a contiguous
+# matrix with a row per Game
+class TrajectoryIndex:
+    def __init__(self, game_ids: np.ndarray, vectors: np.ndarray,
+            sketches: np.ndarray) -> None:
+        self.game_ids = game_ids
+        self.vectors = vectors
+        self.sketches = sketches
+
+    # Get the number of indexed Games
+    def get_game_count(self) -> int:
+        return len(self.game_ids)
+
+    # Get the squared distance of each row of a matrix to the nearer of two
+    # query vectors, and whether it is nearer the second, computed a batch of
+    # rows at a time. Only the columns in the mask are compared
+    @staticmethod
+    def _get_distances(matrix: np.ndarray, queries: np.ndarray,
+            rows: np.ndarray,
+            mask: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        queries = queries.astype('f8')
+        if mask is not None:
+            queries = queries[:, mask]
+        query_norms = (queries ** 2).sum(axis=1)
+
+        distances = np.empty(len(rows))
+        is_second = np.empty(len(rows), dtype=bool)
+        for start in range(0, len(rows), ROWS_PER_BATCH):
+            batch_rows = rows[start:start + ROWS_PER_BATCH]
+            # The expanded squared distance loses too much precision in
+            # single precision for near identical trajectories
+            values = np.asarray(matrix[batch_rows], dtype='f8')
+            if mask is not None:
+                values = values[:, mask]
+
+            batch_distances = ((values ** 2).sum(axis=1)[:, None]
+                - 2 * values @ queries.T + query_norms)
+            distances[start:start + len(batch_rows)] = (
+                batch_distances.min(axis=1))
+            is_second[start:start + len(batch_rows)] = (
+                batch_distances.argmin(axis=1) == 1)
+
+        return np.maximum(distances, 0), is_second
+
+    # Find the k trajectories nearest a query trajectory, compared over its
+    # first turns. Players may match either player of another Game. An
+    # approximate search ranks the Games by the distances of their sketches
+    # and only compares the nearest candidates exactly. Sketches project
+    # whole trajectories, so searches over fewer turns are always exact.
+    # Returns the rows, distances and whether the players were swapped
+    def find_nearest(self, vector: np.ndarray, turns: int, k: int,
+            approximate: bool = False, exclude_game_id: Optional[int] = None
+            ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        queries = np.stack([vector, _swap_players(vector)])
+        rows = np.arange(self.get_game_count())
+        if exclude_game_id is not None:
+            rows = rows[np.asarray(self.game_ids) != exclude_game_id]
+
+        candidate_count = k * CANDIDATES_PER_NEIGHBOR
+        if (approximate and turns >= TRAJECTORY_TURNS
+                and len(rows) > candidate_count):
+            sketch_distances, _ = self._get_distances(self.sketches,
+                queries @ _get_projection(), rows, None)
+            rows = np.sort(rows[np.argpartition(sketch_distances,
+                candidate_count - 1)[:candidate_count]])
+
+        mask = _get_turn_mask(turns) if turns < TRAJECTORY_TURNS else None
+        distances, is_swapped = self._get_distances(self.vectors, queries,
+            rows, mask)
+
+        # Ties are broken by row so results are deterministic
+        nearest = np.lexsort((rows, distances))[:k]
+        return rows[nearest], np.sqrt(distances[nearest]), is_swapped[nearest]
+
+    # Memory-map the index. Rows past the end of any file were only
+    # partially written and are ignored. Returns None if it has not been built
+    @staticmethod
+    def load() -> Optional['TrajectoryIndex']:
+        directory = get_trajectory_directory()
+        paths = [os.path.join(directory, name)
+            for name, _ in FILE_ROW_SIZES]
+        row_count = _get_row_count(directory)
+        if not row_count:
+            return None
+
+        game_ids, vectors, sketches = [
+            np.memmap(path, dtype=dtype, mode='r', shape=shape)
+            for path, dtype, shape in zip(paths, ['i4', 'f4', 'f4'], [
+                (row_count,),
+                (row_count, VECTOR_SIZE),
+                (row_count, SKETCH_SIZE)
+            ])
+        ]
+        return TrajectoryIndex(game_ids, vectors, sketches)
+
+
+# Add the trajectories of newly calculated Games to the index. Games that
+# are already indexed are skipped. Returns the number of Games added
+def append_game_trajectories(game_ids: List[int]) -> int:
+    index = TrajectoryIndex.load()
+    if index:
+        indexed = set(
+            np.asarray(index.game_ids)[
+                np.isin(index.game_ids, game_ids)].tolist())
+        game_ids = [game_id for game_id in game_ids
+            if game_id not in indexed]
+    if not game_ids:
+        return 0
+
+    new_game_ids, vectors, _ = _get_trajectories(
+        list(_get_player_states(game_ids)))
+    if new_game_ids:
+        _write_trajectories(get_trajectory_directory(), new_game_ids,
+            vectors)
+    return len(new_game_ids)
+
+
+# Rebuild the index from the Player States of all Games. The new index
+# replaces the current one once it is fully written
+def rebuild_trajectories(chunk_size: int = 100000) -> int:
+    directory = get_trajectory_directory()
+    new_directory = directory + '.new'
+    old_directory = directory + '.old'
+    shutil.rmtree(new_directory, ignore_errors=True)
+    os.makedirs(new_directory)
+
+    logging.info('Rebuilding trajectory index')
+    game_count = 0
+    rows: List[Tuple[Any, ...]] = []
+    for chunk in iterate_chunks(_get_player_states(), chunk_size):
+        rows.extend(chunk)
+
+        # The last Game of a chunk may continue in the next one
+        last_game_rows = [row for row in rows if row[0] == rows[-1][0]]
+        rows = rows[:len(rows) - len(last_game_rows)]
+        game_ids, vectors, _ = _get_trajectories(rows)
+        _write_trajectories(new_directory, game_ids, vectors)
+        game_count += len(game_ids)
+        rows = last_game_rows
+
+    game_ids, vectors, _ = _get_trajectories(rows)
+    _write_trajectories(new_directory, game_ids, vectors)
+    game_count += len(game_ids)
+
+    if os.path.exists(directory):
+        os.replace(directory, old_directory)
+    os.replace(new_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+
+    logging.info(f'Trajectory index contains {game_count} games')
+    return game_count
+
+
+# Find the indexed Games whose trajectories are nearest that of a Game over
+# its first turns, or all its turns if not given
+def find_similar_games(game_id: int, turns: Optional[int] = None,
+        k: int = 10, approximate: bool = False) -> Dict[str, Any]:
+    game_ids, vectors, turn_counts = _get_trajectories(
+        list(_get_player_states([game_id])))
+    if not game_ids:
+        raise ValueError(f'Game {game_id} has no two player trajectory.')
+
+    turns = min(turns or turn_counts[0], turn_counts[0], TRAJECTORY_TURNS)
+    index = TrajectoryIndex.load()
+    if not index:
+        return {'game_id': game_id, 'turns': turns, 'games': []}
+
+    rows, distances, is_swapped = index.find_nearest(vectors[0], turns, k,
+        approximate, game_id)
+    return {
+        'game_id': game_id,
+        'turns': turns,
+        'games': [
+            {
+                'game_id': int(index.game_ids[row]),
+                'distance': float(distance),
+                'players_swapped': bool(swapped),
+            }
+            for row, distance, swapped in zip(rows, distances, is_swapped)
+        ],
+    }
@@ -19,8 +19,49 @@ urlpatterns = [
     path('games/ladder/import',
         views.import_ladder_games_view, 
         name = 'import_ladder_games'),
+    path('games/ladder/sync',
+        views.sync_ladder_games_view,
+        name='sync_ladder_games'),
     path('games/calculate-data',
         views.calculate_game_data_view,
         name = 'calculate_game_data'),
+    path('turn-states/export',
+        views.export_turn_states_view,
+        name='export_turn_states'),
+    path('turn-states/sample',
+        views.sample_turn_states_view,
+        name='sample_turn_states'),
+    path('games/<int:game_id>/similar',
+        views.similar_games_view,
+        name='similar_games'),
+    path('players/<int:player_account_id>',
+        views.player_account_view,
+        name='player_account'),
+    path('players/<int:player_account_id>/head-to-head/<int:opponent_id>',
+        views.head_to_head_view,
+        name='head_to_head'),
+    path('players/<int:player_account_id>/record-by-rating',
+        views.record_by_rating_view,
+        name='record_by_rating'),
+    path('players/<int:player_account_id>/luck',
+        views.player_luck_view,
+        name='player_luck'),
+    path('templates/<int:template_id>/luck',
+        views.template_luck_view,
+        name='template_luck'),
+    path('templates/<int:template_id>/openings',
+        views.template_openings_view,
+        name='template_openings'),
+    path('maps/<int:map_id>/order-ngrams',
+        views.map_order_ngrams_view,
+        name='map_order_ngrams'),
+    path('win-probability',
+        views.win_probability_view,
+        name='win_probability'),
+    path('jobs', views.jobs_view, name='jobs'),
+    path('jobs/<int:job_id>', views.job_status_view, name='job_status'),
+    path('jobs/<int:job_id>/events',
+        views.job_events_view,
+        name='job_events'),
     path('sandbox', views.sandbox, name='sandbox')
 ]
@@ -6,16 +6,37 @@ from urllib.error import URLError
 
 from django.core.handlers.wsgi import WSGIRequest
 from django.db import models
-from django.http import HttpResponse, HttpResponseRedirect
-from django.shortcuts import render
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
 from django.views.generic import ListView
 
+from . import cache
+from .aggregates import get_win_probability
 from .api import get_api_token
-from .calculate_game_data import calculate_game_data
-from .forms import CalculateGameDataForm, ImportGameForm, ImportLadderGamesForm
-from .import_games import import_game, import_ladder_games
-from .models import Ladder
+from .export import CSV, get_turn_states, stream_turn_states_csv
+from .export import stream_turn_states_npy
+from .forms import CalculateGameDataForm, ExportTurnStatesForm, ImportGameForm
+from .forms import ImportLadderGamesForm, OrderNgramsForm
+from .forms import SampleTurnStatesForm, SimilarGamesForm, SyncLadderGamesForm
+from .forms import WinProbabilityForm
+from .import_games import import_game
+from .jobs import CALCULATE_GAME_DATA, IMPORT_LADDER_GAMES, SYNC_LADDER_GAMES
+from .jobs import enqueue_job
+from .jobs import get_job_status, stream_job_events
+from .luck_statistics import get_luck_statistics
+from .matchups import get_head_to_head, get_record_by_rating_band
+from .models import Game, Job, Ladder, PlayerAccount, PlayerLuckStatistics
+from .models import Map, Template, TemplateLuckStatistics
+from .ngrams import OrderNgramIndex, get_order_ngrams, parse_tokens
+from .openings import get_template_openings
+from .player_statistics import get_player_account_statistics
+from .ratings import get_default_ratings_path
+from .sampling import get_sample_csv, sample_turn_states
 from .sandbox import sandbox_method
+from .trajectories import find_similar_games
 
 GAME_ANALYSIS = 'game_analysis'
 
@@ -83,6 +104,14 @@ def import_game_view(request: WSGIRequest) -> HttpResponse:
     return response
 
 
+def _get_job_queued_message(job: Job) -> str:
+    return (
+        f'Queued job {job.id}. '
+        f'Its progress is reported at {reverse("job_status", args=[job.id])} '
+        f'and streamed from {reverse("job_events", args=[job.id])}.'
+    )
+
+
 def import_ladder_games_view(request: WSGIRequest) -> HttpResponse:
     if request.method == 'POST':
         try:
@@ -100,30 +129,54 @@ def import_ladder_games_view(request: WSGIRequest) -> HttpResponse:
                 except URLError:
                     return home(request, 'Error getting API Token')
 
-                start_time = datetime.now()
+                # Queue games to be imported
+                job = enqueue_job(IMPORT_LADDER_GAMES, max_results,
+                    email=email, api_token=api_token, ladder_id=ladder_id,
+                    max_results=max_results, offset=offset)
 
-                # Import games
-                count = import_ladder_games(email, api_token, ladder_id, max_results,
-                    offset, 50)
+                return home(request, _get_job_queued_message(job))
+        except URLError as e:
+            logging.exception(e.reason)
+            return home(request, e.reason)
+    else:
+        form = ImportLadderGamesForm()
 
-                end_time = datetime.now()
+    response: HttpResponse = render(request,
+        GAME_ANALYSIS + '/basic_post_form.html',
+        {'form_title': 'Import Ladder Games', 'form': form})
+    return response
 
-                message = (
-                    f'Imported {count} games out of {max_results}. '
-                    f'Execution duration was {end_time - start_time}.'
-                )
 
-                return home(
-                    request, message)
+def sync_ladder_games_view(request: WSGIRequest) -> HttpResponse:
+    if request.method == 'POST':
+        try:
+            form = SyncLadderGamesForm(request.POST)
+            if form.is_valid():
+                email = form.cleaned_data['email']
+                password = form.cleaned_data['password']
+                ladder_id = form.cleaned_data['ladder_id']
+
+                # Get api token
+                try:
+                    api_token = get_api_token(email, password)
+                except URLError:
+                    return home(request, 'Error getting API Token')
+
+                # Queue the new games to be imported. Their number is not
+                # known until the sync reaches the already imported games
+                job = enqueue_job(SYNC_LADDER_GAMES, 0, email=email,
+                    api_token=api_token, ladder_id=ladder_id)
+
+                return home(request, _get_job_queued_message(job))
         except URLError as e:
             logging.exception(e.reason)
             return home(request, e.reason)
     else:
-        form = ImportLadderGamesForm()
+        form = SyncLadderGamesForm()
 
     response: HttpResponse = render(request,
         GAME_ANALYSIS + '/basic_post_form.html',
-        {'form_title': 'Import Ladder Games', 'form': form})
+        {'form_title': 'Sync Ladder Games', 'form': form})
     return response
 
 
@@ -133,25 +186,15 @@ def calculate_game_data_view(request: WSGIRequest) -> HttpResponse:
         if form.is_valid():
             games_to_process = form.cleaned_data['max_results']
             batch_size = form.cleaned_data['batch_size']
+            record_territory_history = (
+                form.cleaned_data['record_territory_history'])
 
-            start_time = datetime.now()
-
-            # Import games
-            count = calculate_game_data(games_to_process, batch_size)
-
-            end_time = datetime.now()
-
-            # All games must have been handled
-            all_games_processed = count < games_to_process
-
-            message = (
-                f'Calculated game data for {count} games. '
-                f'There are {"no " if all_games_processed else ""} more games '
-                f'to be processed. '
-                f'Execution duration was {end_time - start_time}'
-            )
+            # Queue game data to be calculated
+            job = enqueue_job(CALCULATE_GAME_DATA, games_to_process,
+                max_results=games_to_process, batch_size=batch_size,
+                record_territory_history=record_territory_history)
 
-            return home(request, message)
+            return home(request, _get_job_queued_message(job))
     else:
         form = CalculateGameDataForm()
     
@@ -161,6 +204,186 @@ def calculate_game_data_view(request: WSGIRequest) -> HttpResponse:
     return response
 
 
+def export_turn_states_view(request: WSGIRequest) -> HttpResponse:
+    if request.method == 'POST':
+        form = ExportTurnStatesForm(request.POST)
+        if form.is_valid():
+            export_format = form.cleaned_data['format']
+            turn_states = get_turn_states(
+                form.cleaned_data['ladder_id'],
+                form.cleaned_data['template_id'],
+                form.cleaned_data['min_turn_number'],
+                form.cleaned_data['max_turn_number'])
+
+            streaming_response: StreamingHttpResponse
+            if export_format == CSV:
+                streaming_response = StreamingHttpResponse(
+                    stream_turn_states_csv(turn_states),
+                    content_type='text/csv')
+            else:
+                streaming_response = StreamingHttpResponse(
+                    stream_turn_states_npy(turn_states),
+                    content_type='application/octet-stream')
+
+            streaming_response['Content-Disposition'] = (
+                f'attachment; filename="turn_states.{export_format}"')
+            return streaming_response
+    else:
+        form = ExportTurnStatesForm()
+
+    response: HttpResponse = render(request,
+        GAME_ANALYSIS + '/basic_post_form.html',
+        {'form_title': 'Export Turn States', 'form': form})
+    return response
+
+
+def sample_turn_states_view(request: WSGIRequest) -> HttpResponse:
+    form = SampleTurnStatesForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    sample = sample_turn_states(
+        get_turn_states(
+            form.cleaned_data['ladder_id'],
+            form.cleaned_data['template_id'],
+            form.cleaned_data['min_turn_number'],
+            form.cleaned_data['max_turn_number']),
+        form.cleaned_data['size'],
+        form.cleaned_data['stratify_by'],
+        form.cleaned_data['split'] or None,
+        form.cleaned_data['test_fraction']
+            if form.cleaned_data['test_fraction'] is not None else 0.2,
+        form.cleaned_data['seed'] or 0)
+
+    response = HttpResponse(get_sample_csv(sample), content_type='text/csv')
+    response['Content-Disposition'] = (
+        'attachment; filename="turn_state_sample.csv"')
+    return response
+
+
+def player_account_view(request: WSGIRequest,
+        player_account_id: int) -> JsonResponse:
+    player_account = get_object_or_404(PlayerAccount, pk=player_account_id)
+    return JsonResponse(get_player_account_statistics(player_account))
+
+
+def head_to_head_view(request: WSGIRequest, player_account_id: int,
+        opponent_id: int) -> JsonResponse:
+    return JsonResponse(get_head_to_head(player_account_id, opponent_id))
+
+
+def record_by_rating_view(request: WSGIRequest,
+        player_account_id: int) -> JsonResponse:
+    player_account = get_object_or_404(PlayerAccount, pk=player_account_id)
+    ratings = cache.get_ratings(get_default_ratings_path())
+    return JsonResponse({
+        'id': player_account.id,
+        'rating': ratings.get_rating(player_account.id),
+        'record_by_rating_band': get_record_by_rating_band(
+            player_account.id, ratings),
+    })
+
+
+def player_luck_view(request: WSGIRequest,
+        player_account_id: int) -> JsonResponse:
+    player_account = get_object_or_404(PlayerAccount, pk=player_account_id)
+    statistics = PlayerLuckStatistics.objects.filter(
+        pk=player_account.id).first()
+    return JsonResponse(
+        {'id': player_account.id, **get_luck_statistics(statistics)})
+
+
+def template_luck_view(request: WSGIRequest, template_id: int) -> JsonResponse:
+    template = get_object_or_404(Template, pk=template_id)
+    statistics = TemplateLuckStatistics.objects.filter(pk=template.id).first()
+    return JsonResponse(
+        {'id': template.id, **get_luck_statistics(statistics)})
+
+
+def template_openings_view(request: WSGIRequest,
+        template_id: int) -> JsonResponse:
+    template = get_object_or_404(Template, pk=template_id)
+    return JsonResponse(get_template_openings(template))
+
+
+def map_order_ngrams_view(request: WSGIRequest, map_id: int) -> JsonResponse:
+    game_map = get_object_or_404(Map, pk=map_id)
+    form = OrderNgramsForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    index = OrderNgramIndex.load(game_map.id)
+    if not index:
+        return JsonResponse(
+            {'errors': {'map_id': ['Order n-grams have not been built.']}},
+            status=404)
+
+    try:
+        prefix = parse_tokens(index, form.cleaned_data['prefix'])
+    except ValueError as e:
+        return JsonResponse({'errors': {'prefix': [str(e)]}}, status=400)
+
+    return JsonResponse(get_order_ngrams(index, prefix,
+        form.cleaned_data['length'], form.cleaned_data['limit'] or 20))
+
+
+def similar_games_view(request: WSGIRequest, game_id: int) -> JsonResponse:
+    game = get_object_or_404(Game, pk=game_id)
+    form = SimilarGamesForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    try:
+        return JsonResponse(find_similar_games(game.id,
+            form.cleaned_data['turns'], form.cleaned_data['k'] or 10,
+            form.cleaned_data['approximate']))
+    except ValueError as e:
+        return JsonResponse({'errors': {'game_id': [str(e)]}}, status=400)
+
+
+def win_probability_view(request: WSGIRequest) -> JsonResponse:
+    form = WinProbabilityForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    response = JsonResponse(get_win_probability(
+        form.cleaned_data['template_id'],
+        form.cleaned_data['turn_number'],
+        form.cleaned_data['income_diff'],
+        form.cleaned_data['army_diff']))
+
+    # Win probabilities only change as more games are calculated, so clients
+    # and proxies may reuse them for an hour
+    patch_cache_control(response, public=True, max_age=3600)
+    return response
+
+
+def jobs_view(request: WSGIRequest) -> JsonResponse:
+    jobs = Job.objects.order_by('-id')[:50]
+    return JsonResponse({'jobs': [get_job_status(job) for job in jobs]})
+
+
+def job_status_view(request: WSGIRequest, job_id: int) -> JsonResponse:
+    job = get_object_or_404(Job, pk=job_id)
+    return JsonResponse(get_job_status(job))
+
+
+def job_events_view(request: WSGIRequest,
+        job_id: int) -> StreamingHttpResponse:
+    job = get_object_or_404(Job, pk=job_id)
+
+    # Resume after the last event received by a reconnecting client
+    last_event_id = request.META.get('HTTP_LAST_EVENT_ID', '')
+    response = StreamingHttpResponse(
+        stream_job_events(job.id,
+            int(last_event_id) if last_event_id.isdigit() else 0),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 def sandbox(request: WSGIRequest) -> HttpResponse:
     response: HttpResponse = render(request, 
         GAME_ANALYSIS + '/sandbox.html',
@@ -0,0 +1,294 @@
+import logging
+import os
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, Optional
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Max, Min
+
+from .export import TURN_STATE_COLUMN_NAMES, TURN_STATE_DTYPE
+from .export import get_turn_states, iterate_chunks
+from .models import TurnState
+from .progress import ProgressCallback, report
+from .sampling import is_test_game
+
+# Turn State columns used to predict whether player 1 wins
+FEATURE_NAMES = [
+    'p1_income',
+    'p1_armies_on_board',
+    'p1_armies_deployed',
+    'p1_cumulative_armies_deployed',
+    'p1_territories_controlled',
+    'p2_income',
+    'p2_armies_on_board',
+    'p2_armies_deployed',
+    'p2_cumulative_armies_deployed',
+    'p2_territories_controlled',
+]
+
+# Largest magnitude of the log odds passed to the logistic function, to
+# avoid overflow
+MAX_LOG_ODDS = 30.0
+
+
+# Get the default path of the saved win probability model
+def get_default_model_path() -> str:
+    return os.path.join(settings.ANALYSIS_DATA_DIR,
+        'win_probability_model.npz')
+
+
+# Get the feature matrix of Turn State records
+def _get_features(turn_states: np.ndarray) -> np.ndarray:
+    return np.column_stack(
+        [turn_states[name].astype(np.float64) for name in FEATURE_NAMES])
+
+
+# Turn States read in batches from the DB or from a directory of columns
+# written by "manage.py export_turn_states --format columns"
+class TurnStateSource:
+    def __init__(self, columns_directory: Optional[str] = None,
+            ladder_id: Optional[int] = None,
+            template_id: Optional[int] = None,
+            min_turn_number: Optional[int] = None,
+            max_turn_number: Optional[int] = None) -> None:
+        if columns_directory and (
+                ladder_id is not None or template_id is not None):
+            raise ValueError(
+                'Exported columns can only be filtered by turn number.')
+
+        self.columns_directory = columns_directory
+        self.ladder_id = ladder_id
+        self.template_id = template_id
+        self.min_turn_number = min_turn_number
+        self.max_turn_number = max_turn_number
+
+    # Get batches of Turn State records in one of partition_count partitions
+    # of the source
+    def get_batches(self, batch_size: int, partition: int = 0,
+            partition_count: int = 1) -> Iterator[np.ndarray]:
+        if self.columns_directory:
+            return self._get_column_batches(batch_size, partition,
+                partition_count)
+        else:
+            return self._get_db_batches(batch_size, partition,
+                partition_count)
+
+    # Get batches from the DB. Partitions are ranges of game ids
+    def _get_db_batches(self, batch_size: int, partition: int,
+            partition_count: int) -> Iterator[np.ndarray]:
+        turn_states = get_turn_states(self.ladder_id, self.template_id,
+            self.min_turn_number, self.max_turn_number)
+
+        if partition_count > 1:
+            game_id_range = TurnState.objects.aggregate(Min('game_id'),
+                Max('game_id'))
+            min_game_id = game_id_range['game_id__min'] or 0
+            game_id_count = (game_id_range['game_id__max'] or 0) - min_game_id
+            turn_states = turn_states.filter(game_id__gte=(
+                min_game_id + game_id_count * partition // partition_count))
+
+            # The last partition includes the largest game id
+            if partition < partition_count - 1:
+                turn_states = turn_states.filter(game_id__lt=(
+                    min_game_id
+                    + game_id_count * (partition + 1) // partition_count))
+
+        for chunk in iterate_chunks(turn_states, batch_size):
+            yield np.array(chunk, dtype=TURN_STATE_DTYPE)
+
+    # Get batches from memory-mapped columns. Partitions are ranges of rows
+    def _get_column_batches(self, batch_size: int, partition: int,
+            partition_count: int) -> Iterator[np.ndarray]:
+        assert self.columns_directory is not None
+        columns = {
+            name: np.load(
+                os.path.join(self.columns_directory, f'{name}.npy'),
+                mmap_mode='r')
+            for name in TURN_STATE_COLUMN_NAMES
+        }
+        row_count = len(columns['game_id'])
+        start = row_count * partition // partition_count
+        end = row_count * (partition + 1) // partition_count
+
+        for batch_start in range(start, end, batch_size):
+            batch_end = min(batch_start + batch_size, end)
+            turn_states = np.empty(batch_end - batch_start,
+                dtype=TURN_STATE_DTYPE)
+            for name in TURN_STATE_COLUMN_NAMES:
+                turn_states[name] = columns[name][batch_start:batch_end]
+
+            if self.min_turn_number is not None:
+                turn_states = turn_states[
+                    turn_states['turn_number'] >= self.min_turn_number]
+            if self.max_turn_number is not None:
+                turn_states = turn_states[
+                    turn_states['turn_number'] <= self.max_turn_number]
+
+            yield turn_states
+
+
+# Logistic regression model of the probability that player 1 wins from a
+# Turn State
+class WinProbabilityModel:
+    def __init__(self, means: np.ndarray, scales: np.ndarray,
+            weights: np.ndarray, bias: float) -> None:
+        self.means = means
+        self.scales = scales
+        self.weights = weights
+        self.bias = bias
+
+    # Get the log odds of player 1 winning for each row of features
+    def get_log_odds(self, features: np.ndarray) -> np.ndarray:
+        log_odds = (features - self.means) / self.scales @ self.weights
+        clipped_log_odds: np.ndarray = np.clip(log_odds + self.bias,
+            -MAX_LOG_ODDS, MAX_LOG_ODDS)
+        return clipped_log_odds
+
+    # Get the probability of player 1 winning for each row of features
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        result: np.ndarray = 1 / (1 + np.exp(-self.get_log_odds(features)))
+        return result
+
+    # Save the model to a .npz file
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez(path, feature_names=np.array(FEATURE_NAMES),
+            means=self.means, scales=self.scales, weights=self.weights,
+            bias=np.array(self.bias))
+
+    # Load a model saved to a .npz file
+    @staticmethod
+    def load(path: str) -> 'WinProbabilityModel':
+        with np.load(path) as data:
+            if list(data['feature_names']) != FEATURE_NAMES:
+                raise ValueError(f'{path} was trained on other features.')
+
+            return WinProbabilityModel(data['means'], data['scales'],
+                data['weights'], float(data['bias']))
+
+
+# Get the mean log loss of predicted probabilities
+def _get_log_loss(probabilities: np.ndarray, results: np.ndarray) -> float:
+    probabilities = np.clip(probabilities, 1e-15, 1 - 1e-15)
+    return float(-np.mean(
+        results * np.log(probabilities)
+        + (1 - results) * np.log(1 - probabilities)
+    ))
+
+
+# Train a model with mini-batch gradient descent on the Turn States of games
+# not in the test split. Features are scaled by their mean and standard
+# deviation, which are found in a first pass over the source
+def train_model(source: TurnStateSource, epochs: int = 10,
+        batch_size: int = 65536, learning_rate: float = 0.5,
+        l2_penalty: float = 1e-4, test_fraction: float = 0.2,
+        progress: Optional[ProgressCallback] = None) -> WinProbabilityModel:
+    feature_count = len(FEATURE_NAMES)
+    row_count = 0
+    sums = np.zeros(feature_count)
+    squared_sums = np.zeros(feature_count)
+
+    for turn_states in source.get_batches(batch_size):
+        turn_states = turn_states[
+            ~is_test_game(turn_states['game_id'], test_fraction)]
+        features = _get_features(turn_states)
+        row_count += len(features)
+        sums += features.sum(axis=0)
+        squared_sums += (features ** 2).sum(axis=0)
+
+    if not row_count:
+        raise ValueError('There are no Turn States to train on.')
+
+    means = sums / row_count
+    scales = np.sqrt(np.maximum(squared_sums / row_count - means ** 2, 0))
+    scales[scales == 0] = 1
+    model = WinProbabilityModel(means, scales, np.zeros(feature_count), 0.0)
+    logging.info(f'Training on {row_count} Turn States')
+
+    for epoch in range(epochs):
+        log_loss_sum = 0.0
+        for turn_states in source.get_batches(batch_size):
+            turn_states = turn_states[
+                ~is_test_game(turn_states['game_id'], test_fraction)]
+            if not len(turn_states):
+                continue
+
+            features = _get_features(turn_states)
+            results = turn_states['p1_winner'].astype(np.float64)
+            probabilities = model.predict(features)
+            log_loss_sum += (
+                _get_log_loss(probabilities, results) * len(features))
+
+            errors = probabilities - results
+            scaled_features = (features - model.means) / model.scales
+            model.weights -= learning_rate * (
+                scaled_features.T @ errors / len(features)
+                + l2_penalty * model.weights)
+            model.bias -= learning_rate * float(errors.mean())
+
+        log_loss = log_loss_sum / row_count
+        logging.info(f'Epoch {epoch + 1} of {epochs}: Log loss {log_loss}')
+        report(progress, 'epoch', epoch=epoch + 1, log_loss=log_loss)
+
+    return model
+
+
+# Get the Turn State count, log loss sum, correct predictions and correct
+# income baseline predictions over the test games of a partition
+def _evaluate_partition(model: WinProbabilityModel, source: TurnStateSource,
+        batch_size: int, test_fraction: float, partition: int,
+        partition_count: int) -> np.ndarray:
+    totals = np.zeros(4)
+
+    for turn_states in source.get_batches(batch_size, partition,
+            partition_count):
+        turn_states = turn_states[
+            is_test_game(turn_states['game_id'], test_fraction)]
+        if not len(turn_states):
+            continue
+
+        results = turn_states['p1_winner']
+        probabilities = model.predict(_get_features(turn_states))
+        income_guesses = turn_states['p1_income'] > turn_states['p2_income']
+        totals += np.array([
+            len(turn_states),
+            _get_log_loss(probabilities, results) * len(turn_states),
+            np.count_nonzero((probabilities > 0.5) == results),
+            np.count_nonzero(income_guesses == results),
+        ])
+
+    return totals
+
+
+# Evaluate a model on the Turn States of the test games, with each worker
+# process reading and scoring one partition of the source
+def evaluate_model(model: WinProbabilityModel, source: TurnStateSource,
+        batch_size: int = 65536, test_fraction: float = 0.2,
+        workers: int = 1) -> Dict[str, float]:
+    # Each worker process must open its own DB connection
+    connections.close_all()
+    with ProcessPoolExecutor(workers) as executor:
+        partition_totals = list(executor.map(
+            _evaluate_partition,
+            [model] * workers,
+            [source] * workers,
+            [batch_size] * workers,
+            [test_fraction] * workers,
+            range(workers),
+            [workers] * workers
+        ))
+
+    row_count, log_loss_sum, correct_count, baseline_correct_count = (
+        np.sum(partition_totals, axis=0))
+    if not row_count:
+        raise ValueError('There are no Turn States to evaluate on.')
+
+    return {
+        'turn_states': int(row_count),
+        'log_loss': log_loss_sum / row_count,
+        'accuracy': correct_count / row_count,
+        'income_baseline_accuracy': baseline_correct_count / row_count,
+    }
@@ -1,5 +1,9 @@
-from typing import Dict, List, Set
+import numpy as np
 
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .distances import compute_distances, get_unreachable_distance
+from .distances import load_distances, save_distances
 from .models import Bonus, Game, Map, Order, Player, PlayerState, Territory
 from .models import Turn
 
@@ -26,6 +30,111 @@ class BonusWrapper():
         }
 
 
+# Get the compressed sparse row form of lists of column indices. The columns
+# of row i are indices[indptr[i]:indptr[i + 1]]
+def _get_compressed_rows(
+        rows: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(columns) for columns in rows])
+    indices = np.array([column for columns in rows for column in columns],
+        dtype=np.int64)
+    return indptr, indices
+
+
+# Reduce the values of the columns of each compressed sparse row along the
+# last axis of an array of values of every entry. Empty rows are the identity
+def _reduce_rows(ufunc: np.ufunc, values: np.ndarray, indptr: np.ndarray,
+        identity: Any) -> np.ndarray:
+    result = np.full(values.shape[:-1] + (len(indptr) - 1,), identity,
+        dtype=values.dtype)
+    is_not_empty = np.diff(indptr) > 0
+    if values.shape[-1]:
+        result[..., is_not_empty] = ufunc.reduceat(values,
+            indptr[:-1][is_not_empty], axis=-1)
+    return result
+
+
+# Adjacency and bonuses of a Map as arrays indexed by the dense territory and
+# bonus indices of its MapWrapper. Adjacency and the bonus-territory
+# incidence matrix are in compressed sparse row form, and the incidence
+# matrix is stored by bonus and by territory. Methods take arrays whose last
+# axis is a territory mask of a player, with any leading axes, so that
+# border, bonus and threat computations are vectorized
+class MapArrays():
+    def __init__(self, neighbor_lists: List[List[int]],
+            bonus_territory_lists: List[List[int]],
+            bonus_values: List[int]):
+        self.adjacency_indptr, self.adjacency_indices = (
+            _get_compressed_rows(neighbor_lists))
+        self.bonus_territory_indptr, self.bonus_territory_indices = (
+            _get_compressed_rows(bonus_territory_lists))
+
+        territory_bonus_lists: List[List[int]] = [
+            [] for _ in neighbor_lists]
+        for bonus_index, territory_indices in enumerate(
+                bonus_territory_lists):
+            for territory_index in territory_indices:
+                territory_bonus_lists[territory_index].append(bonus_index)
+        self.territory_bonus_indptr, self.territory_bonus_indices = (
+            _get_compressed_rows(territory_bonus_lists))
+
+        self.bonus_values = np.array(bonus_values, dtype=np.int64)
+        self.bonus_sizes = np.diff(self.bonus_territory_indptr)
+
+    # Get the number of territories
+    def get_territory_count(self) -> int:
+        return len(self.adjacency_indptr) - 1
+
+    # Get the indices of the neighbors of a territory
+    def get_neighbors(self, territory_index: int) -> np.ndarray:
+        return self.adjacency_indices[self.adjacency_indptr[territory_index]:
+            self.adjacency_indptr[territory_index + 1]]
+
+    # Get the indices of the bonuses a territory is in
+    def get_territory_bonuses(self, territory_index: int) -> np.ndarray:
+        return self.territory_bonus_indices[
+            self.territory_bonus_indptr[territory_index]:
+            self.territory_bonus_indptr[territory_index + 1]]
+
+    # Get the mask of territories bordering any territory of a mask
+    def get_bordering_mask(self, territories: np.ndarray) -> np.ndarray:
+        return _reduce_rows(np.logical_or,
+            territories[..., self.adjacency_indices], self.adjacency_indptr,
+            False)
+
+    # Get the mask of owned territories bordering territories not owned
+    def get_border_mask(self, owned: np.ndarray) -> np.ndarray:
+        result: np.ndarray = owned & self.get_bordering_mask(~owned)
+        return result
+
+    # Get the mask of bonuses all of whose territories are owned
+    def get_completed_bonus_mask(self, owned: np.ndarray) -> np.ndarray:
+        owned_counts = _reduce_rows(np.add,
+            owned[..., self.bonus_territory_indices].astype(np.int64),
+            self.bonus_territory_indptr, 0)
+        result: np.ndarray = (
+            (owned_counts == self.bonus_sizes) & (self.bonus_sizes > 0))
+        return result
+
+    # Get the income from completed bonuses
+    def get_bonus_income(self, owned: np.ndarray) -> np.ndarray:
+        result: np.ndarray = (
+            self.get_completed_bonus_mask(owned) @ self.bonus_values)
+        return result
+
+    # Get the mask of completed bonuses with a territory bordering an enemy
+    # territory
+    def get_threatened_bonus_mask(self, owned: np.ndarray,
+            enemy_owned: np.ndarray) -> np.ndarray:
+        threatened_territories = owned & self.get_bordering_mask(enemy_owned)
+        result: np.ndarray = (
+            self.get_completed_bonus_mask(owned)
+            & _reduce_rows(np.logical_or,
+                threatened_territories[..., self.bonus_territory_indices],
+                self.bonus_territory_indptr, False))
+        return result
+
+
 class MapWrapper():
     def __init__(self, map: Map, use_api_ids: bool):
         self.map = map
@@ -41,6 +150,71 @@ class MapWrapper():
             for bonus in map.bonus_set.all()
         }
 
+        # Territory and bonus ids by dense index, in order of primary key so
+        # the indices are the same whichever ids the wrapper uses
+        self.territory_ids: List[int] = [
+            territory.api_id if use_api_ids else territory.pk
+            for territory in sorted(map.territory_set.all(),
+                key=lambda territory: territory.pk)
+        ]
+        self.territory_indices: Dict[int, int] = {
+            territory_id: i for i, territory_id in enumerate(
+                self.territory_ids)
+        }
+        self.bonus_ids: List[int] = [
+            bonus.api_id if use_api_ids else bonus.pk
+            for bonus in sorted(map.bonus_set.all(),
+                key=lambda bonus: bonus.pk)
+        ]
+        self.bonus_indices: Dict[int, int] = {
+            bonus_id: i for i, bonus_id in enumerate(self.bonus_ids)
+        }
+
+        self.arrays = MapArrays(
+            [
+                sorted(self.territory_indices[connected_territory_id]
+                    for connected_territory_id
+                    in self.territories[territory_id].connected_territory_ids)
+                for territory_id in self.territory_ids
+            ],
+            [
+                sorted(self.territory_indices[territory_id]
+                    for territory_id in self.bonuses[bonus_id].territory_ids)
+                for bonus_id in self.bonus_ids
+            ],
+            [self.bonuses[bonus_id].bonus.base_value
+                for bonus_id in self.bonus_ids]
+        )
+        self._distances: Optional[np.ndarray] = None
+
+    # Compute the matrix of hops between territories by index and save it
+    # with the Map
+    def build_distances(self) -> np.ndarray:
+        self._distances = compute_distances(self.arrays.adjacency_indptr,
+            self.arrays.adjacency_indices)
+        save_distances(self.map.pk, self._distances)
+        return self._distances
+
+    # Get the matrix of hops between territories by index, loading the Map's
+    # saved matrix or building it if there is none
+    def get_distances(self) -> np.ndarray:
+        if self._distances is None:
+            self._distances = load_distances(self.map.pk,
+                len(self.territory_indices))
+        if self._distances is None:
+            return self.build_distances()
+        return self._distances
+
+    # Get the number of hops between two territories, or None if there is no
+    # path between them
+    def get_distance(self, from_territory_id: int,
+            to_territory_id: int) -> Optional[int]:
+        distances = self.get_distances()
+        distance = int(distances[self.territory_indices[from_territory_id],
+            self.territory_indices[to_territory_id]])
+        return (None if distance == get_unreachable_distance(distances)
+            else distance)
+
 
 class PlayerStateWrapper():
     def __init__(self, player_state: PlayerState):
@@ -52,14 +226,15 @@ class PlayerStateWrapper():
 
 
 class TurnWrapper():
-    def __init__(self, turn: Turn):
+    def __init__(self, turn: Turn, orders: List[Order],
+            player_states: List[PlayerState]):
         self.turn = turn
         self.player_states: Dict[int, PlayerStateWrapper] = {
             player_state.player_id: PlayerStateWrapper(player_state)
-            for player_state in turn.playerstate_set.all()
+            for player_state in player_states
         }
         self.orders: List[Order] = sorted(
-            list(turn.order_set.all()),
+            orders,
             key=lambda order: order.order_number
         )
 
@@ -71,7 +246,7 @@ class GameWrapper():
             player.pk: player for player in game.player_set.all()
         }
         self.turns: List[TurnWrapper] = [] if shallow else sorted(
-            [TurnWrapper(turn) for turn in game.turn_set.all()],
+            self._get_turn_wrappers(),
             key=lambda turn_wrapper: turn_wrapper.turn.turn_number
         )
 
@@ -80,3 +255,20 @@ class GameWrapper():
         #     territory_baseline.territory_id: territory_baseline
         #     for territory_baseline in game.territorybaseline_set.all()
         # }
+
+    # Group the Game's Orders and Player States by Turn
+    def _get_turn_wrappers(self) -> List[TurnWrapper]:
+        orders: Dict[int, List[Order]] = {}
+        for order in self.game.order_set.all():
+            orders.setdefault(order.turn_id, []).append(order)
+
+        player_states: Dict[int, List[PlayerState]] = {}
+        for player_state in self.game.playerstate_set.all():
+            player_states.setdefault(player_state.turn_id, []).append(
+                player_state)
+
+        return [
+            TurnWrapper(turn, orders.get(turn.pk, []),
+                player_states.get(turn.pk, []))
+            for turn in self.game.turn_set.all()
+        ]
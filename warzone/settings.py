@@ -78,6 +78,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Job workers and the web server write concurrently, so wait for
+        # locks rather than failing
+        'OPTIONS': {
+            'timeout': 30,
+        },
     }
 }
 
@@ -120,6 +125,12 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+
+# Directory of files derived from the DB for analysis, such as the feature
+# store
+
+ANALYSIS_DATA_DIR = os.path.join(BASE_DIR, 'analysis_data')
+
 # LOGGING = {
 #     # ...
 #     'version': 1,